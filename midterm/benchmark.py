@@ -0,0 +1,443 @@
+"""Benchmarks for the factory simulators.
+
+Builds synthetic factories of a given size for both factory_game's World
+and the midterm game's Factory, runs them headless for a fixed number of
+ticks and reports ticks per second, peak memory and the share of step
+time each kind of station (or subsystem) takes. Results can be saved as
+JSON and later runs compared against them to catch regressions:
+
+    python benchmark.py --size 200 --ticks 2000 --save baseline.json
+    python benchmark.py --size 200 --ticks 2000 --baseline baseline.json
+
+--materials N instead measures how much memory the midterm game takes per
+station and per material, with N materials on its conveyors, and
+--snapshot how long factory_game takes to save and load a snapshot of
+--size chains (9091 chains are about 100k stations).
+"""
+
+import argparse
+import gc
+import importlib.util
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "factory_game"))
+
+from world import World
+from extractor import Extractor
+from furnace import Furnace
+from assembler import Assembler
+from conveyor import Conveyor
+from core import Core
+from profiler import Profiler
+
+SCENARIOS = ("chains", "long", "fanin")
+# Ticks run with tracemalloc and the profiler on, which are much slower
+TRACED_TICKS = 300
+
+
+def load_midterm():
+    """Import the midterm game's main.py, which shares its name with
+    factory_game's entry point"""
+    spec = importlib.util.spec_from_file_location(
+        "midterm_game", os.path.join(HERE, "main.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# factory_game layouts. Every chain gets its own rows of tiles, and
+# conveyors are linked explicitly.
+
+
+def world_chains(n, length=1):
+    """n iron/copper extractor -> furnace -> assembler -> core chains"""
+    world = World()
+    for i in range(n):
+        y = 2 * i
+        iron = Extractor(f"Iron{i}", 0, y, "Iron Ore")
+        copper = Extractor(f"Copper{i}", 0, y + 1, "Copper Ore")
+        iron_furnace = Furnace(f"IronFurnace{i}", 2, y)
+        copper_furnace = Furnace(f"CopperFurnace{i}", 2, y + 1)
+        assembler = Assembler(f"Assembler{i}", 4, y, recipe="PRODUCT")
+        core = Core(f"Core{i}", 6, y, world.inventory)
+        for station in (iron, copper, iron_furnace, copper_furnace, assembler, core):
+            world.add_station(station)
+        for x, y, sources, target in (
+            (1, y, [iron], iron_furnace),
+            (1, y + 1, [copper], copper_furnace),
+            (3, y, [iron_furnace], assembler),
+            (3, y + 1, [copper_furnace], assembler),
+            (5, y, [assembler], core),
+        ):
+            world.add_station(Conveyor("", x, y, sources, target, length))
+    return world
+
+
+def world_long(n):
+    """Chains whose conveyors are 20 tiles long"""
+    return world_chains(n, length=20)
+
+
+def world_fanin(n):
+    """n extractors all feeding one conveyor into one furnace"""
+    world = World()
+    ores = ("Iron Ore", "Copper Ore")
+    extractors = [Extractor(f"Ore{i}", i, 0, ores[i % 2]) for i in range(n)]
+    furnace = Furnace("Furnace", 0, 2)
+    core = Core("Core", 0, 4, world.inventory)
+    for station in extractors + [furnace, core]:
+        world.add_station(station)
+    world.add_station(Conveyor("", 0, 1, extractors, furnace))
+    world.add_station(Conveyor("", 0, 3, [furnace], core))
+    return world
+
+
+# Midterm layouts. The midterm furnace turns iron into steel, which its
+# assembler never takes, so chains run their circuits through the
+# furnace (which passes them on unchanged) after assembling them.
+
+
+def factory_chains(game, n, length=None):
+    """n extractor -> assembler -> furnace -> packager -> output chains"""
+    factory = game.Factory(initialize=False, log=None)
+    for i in range(n):
+        y = 2 * i
+        iron = game.Extractor(0, y, "iron")
+        copper = game.Extractor(0, y + 1, "copper")
+        assembler = game.Assembler(2, y)
+        furnace = game.Furnace(4, y)
+        packager = game.Packager(6, y)
+        output = game.OutputStation(8, y)
+        for station in (iron, copper, assembler, furnace, packager, output):
+            factory.add_station(station)
+        for source, target in (
+            (iron, assembler),
+            (copper, assembler),
+            (assembler, furnace),
+            (furnace, packager),
+            (packager, output),
+        ):
+            factory.add_conveyor(game.Conveyor(source, target, length))
+    return factory
+
+
+def factory_long(game, n):
+    """Chains whose conveyors take 2000 frames to cross"""
+    return factory_chains(game, n, length=2000)
+
+
+def factory_fanin(game, n):
+    """n extractors, each on its own conveyor into one packager"""
+    factory = game.Factory(initialize=False, log=None)
+    packager = game.Packager(0, 2)
+    output = game.OutputStation(0, 4)
+    factory.add_station(packager)
+    factory.add_station(output)
+    factory.add_conveyor(game.Conveyor(packager, output))
+    for i in range(n):
+        extractor = game.Extractor(i, 0, ("iron", "copper")[i % 2])
+        factory.add_station(extractor)
+        factory.add_conveyor(game.Conveyor(extractor, packager))
+    return factory
+
+
+def material_memory(game, count):
+    """Bytes per station and per material of a midterm factory with
+    `count` materials queued up on its conveyors"""
+    chains = max(1, count // 100_000)
+    gc.collect()
+    tracemalloc.start()
+    factory = factory_chains(game, chains)
+    per_station = tracemalloc.get_traced_memory()[0] / len(factory.stations)
+
+    per_conveyor = -(-count // len(factory.conveyors))
+    types = ("iron", "copper", "circuit", "product")
+    before = tracemalloc.get_traced_memory()[0]
+    for conveyor in factory.conveyors:
+        lane = conveyor.lane = game.Lane(per_conveyor * 34, 34)
+        for k in range(per_conveyor):
+            lane.push(game.Material(types[k % len(types)]))
+            lane.advance(lane.spacing)
+    per_material = (tracemalloc.get_traced_memory()[0] - before) / (
+        per_conveyor * len(factory.conveyors)
+    )
+    tracemalloc.stop()
+    return per_station, per_material
+
+
+def snapshot_times(size, ticks, repeat):
+    """Best of `repeat` seconds to dump and to load a snapshot of a
+    factory_game world of `size` chains that has run for `ticks` ticks,
+    and the world and the snapshot"""
+    from snapshot import dumps, loads
+
+    world = world_chains(size)
+    world.run(ticks)
+    dump = load = math.inf
+    copy = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        data = dumps(world)
+        dump = min(dump, time.perf_counter() - start)
+        copy = None  # freeing the last copy isn't part of loading
+        gc.collect()
+        start = time.perf_counter()
+        copy = loads(data)
+        load = min(load, time.perf_counter() - start)
+    return dump, load, world, data
+
+
+def benchmarks(games, scenarios, size):
+    """(name, build, run, profile) for every case to run.
+
+    build() returns a fresh simulation and run(sim, ticks) steps it.
+    profile(sim, ticks) runs it under a Profiler and returns the
+    profiler's step_seconds, or is None where that isn't supported.
+    """
+    cases = []
+    if "factory_game" in games:
+        builders = {"chains": world_chains, "long": world_long, "fanin": world_fanin}
+
+        def run_stepped(world, ticks):
+            world.run(ticks)
+
+        def run_event_driven(world, ticks):
+            world.run(ticks, event_driven=True)
+
+        def profile_world(world, ticks):
+            world.profiler = Profiler(sample_every=1)
+            world.run(ticks)
+            return world.profiler.step_seconds
+
+        backends = [("stepped", run_stepped), ("event", run_event_driven)]
+        try:
+            from columnar import ColumnarWorld
+
+            def run_columnar(world, ticks):
+                ColumnarWorld(world).run(ticks)
+
+            backends.append(("columnar", run_columnar))
+        except ImportError:  # NumPy isn't installed
+            pass
+
+        for scenario in scenarios:
+            build = builders[scenario]
+            for backend, run in backends:
+                profile = profile_world if backend == "stepped" else None
+                cases.append(
+                    (
+                        f"factory_game/{scenario}/{backend}",
+                        lambda build=build: build(size),
+                        run,
+                        profile,
+                    )
+                )
+
+    if "midterm" in games:
+        game = load_midterm()
+        builders = {
+            "chains": factory_chains,
+            "long": factory_long,
+            "fanin": factory_fanin,
+        }
+
+        def run_factory(factory, ticks):
+            for _ in range(ticks):
+                factory.update()
+
+        def profile_factory(factory, ticks):
+            factory.profiler = game.Profiler(sample_every=1)
+            run_factory(factory, ticks)
+            return factory.profiler.step_seconds
+
+        for scenario in scenarios:
+            build = builders[scenario]
+            cases.append(
+                (
+                    f"midterm/{scenario}",
+                    lambda build=build: build(game, size),
+                    run_factory,
+                    profile_factory,
+                )
+            )
+    return cases
+
+
+def measure(name, build, run, profile, size, ticks, repeat):
+    # Best of `repeat` timed runs, each on a freshly built simulation
+    seconds = math.inf
+    for _ in range(repeat):
+        sim = build()
+        gc.collect()
+        start = time.perf_counter()
+        run(sim, ticks)
+        seconds = min(seconds, time.perf_counter() - start)
+
+    # Peak memory of building the simulation and running it for a bit
+    gc.collect()
+    tracemalloc.start()
+    sim = build()
+    run(sim, min(ticks, TRACED_TICKS))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    subsystems = {}
+    if profile is not None:
+        step_seconds = profile(build(), min(ticks, TRACED_TICKS))
+        total = sum(step_seconds.values())
+        subsystems = {
+            subsystem: spent / total for subsystem, spent in step_seconds.items()
+        }
+
+    return {
+        "name": name,
+        "size": size,
+        "stations": len(sim.stations),
+        "ticks": ticks,
+        "seconds": seconds,
+        "ticks_per_second": ticks / seconds if seconds else math.inf,
+        "peak_mb": peak / 2**20,
+        "subsystems": subsystems,
+    }
+
+
+def print_result(result):
+    shares = ", ".join(
+        f"{subsystem} {share:.0%}"
+        for subsystem, share in sorted(
+            result["subsystems"].items(), key=lambda pair: -pair[1]
+        )
+    )
+    print(
+        f"{result['name']:<30} {result['stations']:>7} stations "
+        f"{result['ticks_per_second']:>10,.0f} ticks/s "
+        f"{result['peak_mb']:>8.1f} MB"
+    )
+    if shares:
+        print(f"{'':<30} {shares}")
+
+
+def compare(results, baseline, threshold):
+    """Print how results changed against a baseline and return the
+    regressions: runs more than `threshold` slower or bigger"""
+    before = {
+        (r["name"], r["size"], r["ticks"]): r for r in baseline.get("results", [])
+    }
+    regressions = []
+    print(f"Against the baseline ({threshold:.0%} tolerance):")
+    for result in results:
+        old = before.get((result["name"], result["size"], result["ticks"]))
+        if old is None:
+            print(f"  {result['name']}: not in the baseline")
+            continue
+        speed = result["ticks_per_second"] / old["ticks_per_second"] - 1
+        memory = result["peak_mb"] / old["peak_mb"] - 1 if old["peak_mb"] else 0.0
+        regressed = speed < -threshold or memory > threshold
+        if regressed:
+            regressions.append(result["name"])
+        print(
+            f"  {result['name']}: ticks/s {speed:+.1%}, peak memory {memory:+.1%}"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Factory simulator benchmarks")
+    parser.add_argument(
+        "--game",
+        choices=("factory_game", "midterm", "all"),
+        default="all",
+        help="which simulator to benchmark (default: all)",
+    )
+    parser.add_argument(
+        "--scenario",
+        choices=SCENARIOS + ("all",),
+        default="all",
+        help="chains of stations, chains with long conveyors or wide fan-in "
+        "(default: all)",
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=100,
+        help="number of chains, or of extractors for fan-in (default: 100)",
+    )
+    parser.add_argument(
+        "--ticks", type=int, default=1000, help="ticks per run (default: 1000)"
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="timed runs per benchmark; the best counts (default: 3)",
+    )
+    parser.add_argument(
+        "--materials",
+        type=int,
+        metavar="N",
+        help="instead, measure the midterm game's memory per station and per "
+        "material with N materials on its conveyors",
+    )
+    parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help="instead, time saving and loading a snapshot of factory_game's "
+        "chains after --ticks ticks",
+    )
+    parser.add_argument("--save", metavar="PATH", help="write the results as JSON")
+    parser.add_argument(
+        "--baseline",
+        metavar="PATH",
+        help="compare against results saved with --save; exits with status 1 "
+        "on a regression",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="slowdown or memory growth that counts as a regression (default: 0.1)",
+    )
+    args = parser.parse_args()
+
+    if args.materials:
+        per_station, per_material = material_memory(load_midterm(), args.materials)
+        print(f"{per_station:,.0f} bytes/station, {per_material:,.1f} bytes/material")
+        return
+    if args.snapshot:
+        dump, load, world, data = snapshot_times(args.size, args.ticks, args.repeat)
+        print(
+            f"{len(world.stations):,} stations, {len(data) / 2**20:.1f} MB: "
+            f"dump {dump:.3f} s, load {load:.3f} s"
+        )
+        return
+
+    games = ("factory_game", "midterm") if args.game == "all" else (args.game,)
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+
+    results = []
+    for case in benchmarks(games, scenarios, args.size):
+        result = measure(*case, args.size, args.ticks, args.repeat)
+        print_result(result)
+        results.append(result)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": sys.version, "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,16 @@
-from station import Station
-from collections import Counter
-from item import Item
+from crafter import Crafter
+from recipes import Recipe, RecipeRegistry, default_registry
 
 
-class Assembler(Station):
-    def __init__(self, name, x, y, recipe):
-        super().__init__(name, x, y)
-        self.recipe = recipe
+class Assembler(Crafter):
+    MACHINE = "assembler"
 
-    def step(self):
-        input_counts = Counter([item.name for item in self.inputs])
-        can_assemble = all(
-            input_counts.get(name, 0) >= count for name, count in self.recipe.items()
-        )
-
-        if can_assemble:
-            for name, count in self.recipe.items():
-                removed = 0
-                for i in range(len(self.inputs) - 1, -1, -1):
-                    if self.inputs[i].name == name:
-                        del self.inputs[i]
-                        removed += 1
-                        if removed == count:
-                            break
-            self.output_buffer.append(Item("Product"))
+    def __init__(self, name, x, y, recipe=None, recipes=None):
+        # A plain {"item": count} recipe is still accepted and makes "Product"
+        if isinstance(recipe, dict):
+            recipes = RecipeRegistry(
+                [Recipe(f"{name}:Product", self.MACHINE, recipe, {"Product": 1})]
+            )
+        elif isinstance(recipe, str):
+            recipes = RecipeRegistry([default_registry()[recipe]])
+        super().__init__(name, x, y, recipes)
@@ -0,0 +1,301 @@
+import os
+import tempfile
+from conveyor import Conveyor
+from core import Core
+from item import Item
+from station import TILE_SIZE
+
+
+class Chunk:
+    """One SIZE x SIZE square of tiles.
+
+    While loaded its stations are part of the world; while unloaded they
+    only exist in the snapshot file of the Region it went out with.
+    """
+
+    def __init__(self, key, tick):
+        self.key = key
+        self.stations = []
+        self.region = None  # set while unloaded
+        self.changed = tick  # last tick it was built on or loaded
+
+
+class Region:
+    """Chunks unloaded together, with the rates they deliver to Cores"""
+
+    def __init__(self, keys, path, rates):
+        self.keys = keys
+        self.path = path
+        self.rates = rates  # item id -> items per tick
+
+
+class ChunkManager:
+    """Keeps only the part of a World near the camera in memory.
+
+    Set world.chunks to one and the world is divided into SIZE x SIZE
+    chunks, made as stations are placed in them. Every `check_every` ticks
+    chunks far from the camera are written out to snapshot files in
+    `directory` and dropped from the world, so they cost neither memory
+    nor steps. Chunks go out together with every chunk a belt links them
+    to, so no item can cross into or out of unloaded stations, and only
+    once their output has settled: not built on for `settle_ticks`, and
+    over the last check every belt into a Core delivered what
+    throughput.analyze() says it delivers in the steady state, give or
+    take one item and `tolerance` of the expected count. While out, a
+    region is summarized by the same analysis: what it would deliver to
+    its Cores per tick is added to the world's inventory. Chunks come back
+    in as the camera nears them or something is built next to them, in
+    the state they went out in.
+
+    So a run with chunks unloaded is close to stepping everything, not
+    the same: a settled region delivers in bursts and its summary at an
+    even rate, so the Cores can end up with up to about one item per belt
+    into a Core more or fewer of each item than a full run.
+    """
+
+    SIZE = 32
+
+    def __init__(
+        self,
+        world,
+        directory=None,
+        radius=1,
+        settle_ticks=600,
+        check_every=300,
+        view=(800, 600),
+        tolerance=0.05,
+    ):
+        self.world = world
+        if directory is None:
+            # Removed with the manager
+            self._tempdir = tempfile.TemporaryDirectory(prefix="factory-chunks-")
+            directory = self._tempdir.name
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.radius = radius  # chunks around the view kept loaded
+        self.settle_ticks = settle_ticks
+        self.check_every = check_every
+        self.view = view  # screen size in pixels
+        self.tolerance = tolerance
+        self.chunks = {}
+        self.rates = {}  # item id -> items per tick, all unloaded regions
+        self._carry = {}  # item id -> fraction of an item not added yet
+        self._until_check = check_every
+        self._regions = 0  # for file names
+        self._observed = None  # tick of the last check
+        self._moved = {}  # id(belt) -> items it had moved at the last check
+
+        for station in world.stations:
+            self.added(station)
+
+    def key(self, x, y):
+        return (x // self.SIZE, y // self.SIZE)
+
+    def chunk(self, key):
+        """The chunk at a key, made if it doesn't exist yet"""
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.chunks[key] = Chunk(key, self.world.tick)
+        return chunk
+
+    def loaded(self, x, y):
+        """Make sure tile (x, y) and the tiles next to it are loaded"""
+        for dx, dy in ((0, 0), (1, 0), (0, 1), (-1, 0), (0, -1)):
+            chunk = self.chunks.get(self.key(x + dx, y + dy))
+            if chunk is not None and chunk.region is not None:
+                self._load(chunk.region)
+
+    def added(self, station):
+        chunk = self.chunk(self.key(station.x, station.y))
+        chunk.stations.append(station)
+        chunk.changed = self.world.tick
+
+    def removed(self, station):
+        chunk = self.chunks[self.key(station.x, station.y)]
+        chunk.stations.remove(station)
+        chunk.changed = self.world.tick
+        if not chunk.stations:
+            del self.chunks[chunk.key]
+
+    def until_check(self):
+        return self._until_check
+
+    def advance(self, ticks):
+        """Add what the unloaded regions delivered over `ticks` ticks and
+        page chunks in and out when a check is due"""
+        if self.rates:
+            inventory = self.world.inventory
+            carry = self._carry
+            for item_id, rate in self.rates.items():
+                total = carry.get(item_id, 0.0) + rate * ticks
+                whole = int(total)
+                if whole:
+                    inventory.add(item_id, whole)
+                carry[item_id] = total - whole
+        self._until_check -= ticks
+        if self._until_check <= 0:
+            self._until_check = self.check_every
+            self.refresh()
+
+    def near_camera(self):
+        """Keys of the chunks on screen and `radius` chunks around them"""
+        span = self.SIZE * TILE_SIZE
+        left, top = self.world.camera_offset
+        width, height = self.view
+        r = self.radius
+        x0, y0 = left // span - r, top // span - r
+        x1 = (left + width - 1) // span + r
+        y1 = (top + height - 1) // span + r
+        return {(cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)}
+
+    def load_near_camera(self):
+        for key in self.near_camera():
+            chunk = self.chunks.get(key)
+            if chunk is not None and chunk.region is not None:
+                self._load(chunk.region)
+
+    def load_all(self):
+        for chunk in list(self.chunks.values()):
+            if chunk.region is not None:
+                self._load(chunk.region)
+
+    def refresh(self):
+        """Load the chunks near the camera and unload the far, settled ones"""
+        from throughput import analyze
+
+        self.load_near_camera()
+        near = self.near_camera()
+        tick = self.world.tick
+        for keys in self._groups():
+            if all(
+                key not in near and tick - self.chunks[key].changed >= self.settle_ticks
+                for key in keys
+            ):
+                part = self._part(keys)
+                report = analyze(part)
+                if self._steady(keys, report):
+                    self._unload(keys, part, report)
+        self._observe()
+
+    def _observe(self):
+        # What every loaded belt into a Core has delivered so far, to
+        # compare with next time
+        self._observed = self.world.tick
+        self._moved = {
+            id(station): station.moved
+            for chunk in self.chunks.values()
+            for station in chunk.stations
+            if isinstance(station, Conveyor) and isinstance(station.next_station, Core)
+        }
+
+    def _steady(self, keys, report):
+        # Did every belt into a Core deliver its settled rate since the last
+        # check? Chunks built on or loaded since then haven't been watched
+        # for long enough. Buffers elsewhere can take much longer to fill
+        # up, but don't change what reaches the Cores
+        if self._observed is None:
+            return False
+        if any(self.chunks[key].changed > self._observed for key in keys):
+            return False
+        ticks = self.world.tick - self._observed
+        for node in report.nodes:
+            belt = node.station
+            if not isinstance(belt, Conveyor) or not isinstance(
+                belt.next_station, Core
+            ):
+                continue
+            expected = sum(edge.total() for edge in node.outputs) * ticks
+            moved = belt.moved - self._moved.get(id(belt), 0)
+            if abs(moved - expected) > 1 + self.tolerance * expected:
+                return False
+        return True
+
+    def _groups(self):
+        # Loaded chunks, grouped by the belts between them
+        keys = [key for key, chunk in self.chunks.items() if chunk.region is None]
+        parent = {key: key for key in keys}
+
+        def find(key):
+            while parent[key] != key:
+                parent[key] = parent[parent[key]]
+                key = parent[key]
+            return key
+
+        for key in keys:
+            for station in self.chunks[key].stations:
+                if isinstance(station, Conveyor):
+                    linked = list(station.input_stations)
+                    if station.next_station is not None:
+                        linked.append(station.next_station)
+                    for other in linked:
+                        other_key = self.key(other.x, other.y)
+                        if other_key != key and other_key in parent:
+                            parent[find(other_key)] = find(key)
+
+        groups = {}
+        for key in keys:
+            groups.setdefault(find(key), []).append(key)
+        return list(groups.values())
+
+    def _part(self, keys):
+        # The stations of some chunks, as a World of their own
+        from world import World
+
+        world = self.world
+        leaving = {id(station) for key in keys for station in self.chunks[key].stations}
+        part = World()
+        part.tick = world.tick
+        # In world order, which is the order they step in
+        part.stations = [s for s in world.stations if id(s) in leaving]
+        part.grid.extend(part.stations)
+        return part
+
+    def _unload(self, keys, part, report):
+        from snapshot import save
+        from throughput import TICK_RATE
+
+        world = self.world
+        members = set(keys)
+        leaving = {id(station) for station in part.stations}
+        rates = {
+            Item(name).id: rate / TICK_RATE for name, rate in report.output().items()
+        }
+
+        self._regions += 1
+        path = os.path.join(self.directory, f"region{self._regions}.snap")
+        save(part, path)
+        region = Region(keys, path, rates)
+        for key in members:
+            chunk = self.chunks[key]
+            chunk.stations = []
+            chunk.region = region
+        for station in part.stations:
+            world.grid.remove(station)
+        world.stations = [s for s in world.stations if id(s) not in leaving]
+        for item_id, rate in rates.items():
+            self.rates[item_id] = self.rates.get(item_id, 0.0) + rate
+
+    def _load(self, region):
+        from snapshot import load
+
+        world = self.world
+        # Read it all in before the file goes
+        part = load(region.path, use_mmap=False)
+        os.remove(region.path)
+        for station in part.stations:
+            if isinstance(station, Core):
+                station.inventory = world.inventory
+        world.grid.extend(part.stations)
+        world.stations.extend(part.stations)
+        for key in region.keys:
+            chunk = self.chunks[key]
+            chunk.region = None
+            chunk.changed = world.tick
+        for station in part.stations:
+            self.chunks[self.key(station.x, station.y)].stations.append(station)
+        for item_id, rate in region.rates.items():
+            left = self.rates[item_id] - rate
+            if left > 1e-12:
+                self.rates[item_id] = left
+            else:
+                del self.rates[item_id]
@@ -0,0 +1,298 @@
+from collections import deque
+import numpy as np
+from station import Station
+from extractor import Extractor
+from crafter import Crafter
+from conveyor import Conveyor
+from core import Core
+from item import Item
+from spatial import SpatialGrid
+from world import World
+
+
+class ColumnarWorld:
+    """Structure-of-arrays backend for very large factories.
+
+    Every station becomes a row in per-resource count arrays (`inputs` and
+    `outputs`, shape stations x resources), and each station type is
+    stepped as one batch of NumPy operations per tick. Buffers are counts,
+    so FIFO order inside a buffer isn't kept, and types are stepped in
+    phases (extract, craft, convey) rather than in list order. Belts are
+    modelled as capped buffers without travel time.
+
+    `stations` holds StationView objects that read straight from the
+    arrays, so drawing and tooltips work as they do on World.
+    """
+
+    def __init__(self, world):
+        self.camera_offset = world.camera_offset
+        self.tick = world.tick
+        self._base_inventory = world.inventory.copy()
+        self.profiler = None  # never sampled; --profile needs a World
+
+        stations = world.stations
+        for station in stations:
+            self._intern_station_items(station)
+
+        # Columns are Item ids
+        n = len(stations)
+        r = len(Item.by_id)
+        self.inputs = np.zeros((n, r), dtype=np.int64)
+        self.outputs = np.zeros((n, r), dtype=np.int64)
+        for i, station in enumerate(stations):
+            for item in station.inputs:
+                self.inputs[i, item.id] += 1
+            for item in station.output_buffer:
+                self.outputs[i, item.id] += 1
+
+        index = {id(station): i for i, station in enumerate(stations)}
+
+        def of_type(cls):
+            return [i for i, s in enumerate(stations) if type(s) is cls]
+
+        # Extractors
+        self.ext_rows = np.array(of_type(Extractor), dtype=np.int64)
+        self.ext_timer = np.array(
+            [stations[i].timer for i in self.ext_rows], dtype=np.int64
+        )
+        self.ext_resource = np.array(
+            [Item(stations[i].resource).id for i in self.ext_rows],
+            dtype=np.int64,
+        )
+        self._ext_slot = {int(row): k for k, row in enumerate(self.ext_rows)}
+
+        # Crafters (furnaces, assemblers): every distinct recipe is a pair of
+        # input/output vectors plus the crafter slots that may use it
+        crafter_rows = [i for i, s in enumerate(stations) if isinstance(s, Crafter)]
+        self.crafter_rows = np.array(crafter_rows, dtype=np.int64)
+        recipes = {}
+        slots = []
+        for slot, i in enumerate(crafter_rows):
+            for recipe in stations[i].recipes:
+                if id(recipe) not in recipes:
+                    recipes[id(recipe)] = len(slots)
+                    slots.append((recipe, []))
+                slots[recipes[id(recipe)]][1].append(slot)
+        self.recipes = [recipe for recipe, _ in slots]
+        self.recipe_slots = [np.array(s, dtype=np.int64) for _, s in slots]
+        self.recipe_in = []
+        self.recipe_out = np.zeros((len(self.recipes), r), dtype=np.int64)
+        for k, recipe in enumerate(self.recipes):
+            cols = np.array([item_id for item_id, _ in recipe.inputs], dtype=np.int64)
+            counts = np.array([count for _, count in recipe.inputs], dtype=np.int64)
+            self.recipe_in.append((cols, counts))
+            for item, count in recipe.outputs:
+                self.recipe_out[k, item.id] += count
+
+        # Conveyors: (belt, source row) edges plus a target per belt, with
+        # belts numbered by their place in belt_rows
+        conveyor_rows = of_type(Conveyor)
+        self.belt_rows = np.array(conveyor_rows, dtype=np.int64)
+        self.belt_target = np.array(
+            [index.get(id(stations[i].next_station), -1) for i in conveyor_rows],
+            dtype=np.int64,
+        )
+        edges = [
+            (k, index[id(source)])
+            for k, i in enumerate(conveyor_rows)
+            for source in stations[i].input_stations
+        ]
+        self.edge_belt = np.array([e[0] for e in edges], dtype=np.int64)
+        self.edge_source = np.array([e[1] for e in edges], dtype=np.int64)
+
+        self.core_rows = np.array(of_type(Core), dtype=np.int64)
+
+        # Buffer limits: inputs are capped per item type (belts cap their
+        # total instead), outputs are capped in total
+        unlimited = np.iinfo(np.int64).max
+        self.input_cap = np.array([s.input_capacity for s in stations], dtype=np.int64)
+        self.input_cap[self.core_rows] = unlimited
+        self.total_cap = np.full(n, unlimited, dtype=np.int64)
+        self.total_cap[self.belt_rows] = [
+            stations[i].inputs.capacity for i in conveyor_rows
+        ]
+        self.input_cap[self.belt_rows] = unlimited
+        self.output_cap = np.array(
+            [s.output_buffer.capacity for s in stations], dtype=np.int64
+        )
+        self.stalled = np.array([s.stalled_ticks for s in stations], dtype=np.int64)
+
+        self.stations = [
+            StationView(self, i, station) for i, station in enumerate(stations)
+        ]
+        self.grid = SpatialGrid()
+        for view in self.stations:
+            self.grid.add(view)
+
+    def _intern_station_items(self, station):
+        # Make sure every item this station can hold has an id (= column).
+        # Recipe items were interned when the recipes were compiled.
+        if isinstance(station, Extractor):
+            Item(station.resource)
+
+    @property
+    def inventory(self):
+        inventory = self._base_inventory.copy()
+        if len(self.core_rows):
+            totals = self.inputs[self.core_rows].sum(axis=0)
+            for item_id in np.flatnonzero(totals):
+                inventory.add(int(item_id), int(totals[item_id]))
+        return inventory
+
+    def step(self):
+        self._step_extractors()
+        self._step_crafters()
+        self._step_conveyors()
+        self.tick += 1
+
+    def run(self, ticks):
+        for _ in range(ticks):
+            self.step()
+
+    def _output_room(self, rows):
+        return self.output_cap[rows] - self.outputs[rows].sum(axis=1)
+
+    def _step_extractors(self):
+        rows = self.ext_rows
+        if not len(rows):
+            return
+        np.minimum(self.ext_timer + 1, Extractor.INTERVAL, out=self.ext_timer)
+        ready = self.ext_timer >= Extractor.INTERVAL
+        fired = ready & (self._output_room(rows) > 0)
+        self.outputs[rows[fired], self.ext_resource[fired]] += 1
+        self.ext_timer[fired] = 0
+        self.stalled[rows[ready & ~fired]] += 1
+
+    def _step_crafters(self):
+        # At most one craft per station per tick, recipes tried in order
+        pending = np.ones(len(self.crafter_rows), dtype=bool)
+        for k, slots in enumerate(self.recipe_slots):
+            slots = slots[pending[slots]]
+            if not len(slots):
+                continue
+            rows = self.crafter_rows[slots]
+            cols, counts = self.recipe_in[k]
+            ready = (self.inputs[np.ix_(rows, cols)] >= counts).all(axis=1)
+            room = self._output_room(rows) >= self.recipe_out[k].sum()
+            crafted = rows[ready & room]
+            self.inputs[np.ix_(crafted, cols)] -= counts
+            self.outputs[crafted] += self.recipe_out[k]
+            self.stalled[rows[ready & ~room]] += 1
+            pending[slots[ready]] = False
+
+    def _step_conveyors(self):
+        # Each belt pulls at most one item from each source while it has
+        # room, lowest item id first. All edges are settled at once: belts
+        # take from their first sources with stock, up to their room, and
+        # sources then supply the first of those edges, up to their stock.
+        # Unless a belt with several sources shares one with another belt,
+        # that is the same as taking items one edge at a time. Edges cut
+        # only because of an edge that was cut itself get another round,
+        # so the rounds don't grow with the number of sources.
+        belts = self.edge_belt
+        sources = self.edge_source
+        while len(sources):
+            rows = self.belt_rows
+            room = (self.total_cap[rows] - self.inputs[rows].sum(axis=1))[belts]
+            open_ = room > 0
+            belts = belts[open_]
+            sources = sources[open_]
+            room = room[open_]
+            stock = self.outputs[sources].sum(axis=1)
+            wanted = stock > 0
+            taking = wanted.copy()
+            taking[wanted] = _ranks(belts[wanted]) < room[wanted]
+            rank = _ranks(sources[taking])
+            supplied = rank < stock[taking]
+            taking[taking] = supplied
+            if not taking.any():
+                break
+            take_rows = rows[belts[taking]]
+            take_sources = sources[taking]
+            held = np.cumsum(self.outputs[take_sources], axis=1)
+            resource = (held > rank[supplied][:, None]).argmax(axis=1)
+            np.subtract.at(self.outputs, (take_sources, resource), 1)
+            np.add.at(self.inputs, (take_rows, resource), 1)
+            belts = belts[~taking]
+            sources = sources[~taking]
+
+        # Then each belt hands its first item on to its target, if the target
+        # has room for it; belts without a target drop the item
+        carried = self.inputs[self.belt_rows] > 0
+        has_item = carried.any(axis=1)
+        rows = self.belt_rows[has_item]
+        targets = self.belt_target[has_item]
+        resource = carried.argmax(axis=1)[has_item]
+
+        dropping = targets < 0
+        self.inputs[rows[dropping], resource[dropping]] -= 1
+        rows = rows[~dropping]
+        targets = targets[~dropping]
+        resource = resource[~dropping]
+
+        # Targets take items in belt order while they have room for that
+        # item and in total. Clipping by (target, item) and then by target
+        # is the same as handing the items over one at a time, since a
+        # target that is full stays full.
+        space = self.input_cap[targets] - self.inputs[targets, resource]
+        accepted = _ranks(targets * self.inputs.shape[1] + resource) < space
+        total = self.total_cap[targets] - self.inputs[targets].sum(axis=1)
+        accepted[accepted] = _ranks(targets[accepted]) < total[accepted]
+        self.inputs[rows[accepted], resource[accepted]] -= 1
+        np.add.at(self.inputs, (targets[accepted], resource[accepted]), 1)
+        self.stalled[rows[~accepted]] += 1
+
+    def items(self, counts):
+        return [
+            Item.by_id[item_id]
+            for item_id in np.flatnonzero(counts)
+            for _ in range(int(counts[item_id]))
+        ]
+
+    # Drawing and picking work the same as on World
+    draw = World.draw
+    visible_stations = World.visible_stations
+    station_at = World.station_at
+    station_at_pixel = World.station_at_pixel
+    pan_camera = World.pan_camera
+
+
+def _ranks(keys):
+    """How many earlier entries of `keys` are equal to each entry"""
+    order = np.argsort(keys, kind="stable")
+    ordered = keys[order]
+    starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+    lengths = np.diff(np.r_[starts, len(keys)])
+    ranks = np.empty(len(keys), dtype=np.int64)
+    ranks[order] = np.arange(len(keys)) - np.repeat(starts, lengths)
+    return ranks
+
+
+class StationView(Station):
+    """A station whose buffers and timer live in a ColumnarWorld row"""
+
+    def __init__(self, backend, row, station):
+        self._backend = backend
+        self._row = row
+        self._station = station
+        self.name = station.name
+        self.x = station.x
+        self.y = station.y
+        self.color = station.color
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        if attr == "stalled_ticks":
+            return int(self._backend.stalled[self._row])
+        if attr == "timer" and self._row in self._backend._ext_slot:
+            return int(self._backend.ext_timer[self._backend._ext_slot[self._row]])
+        return getattr(self._station, attr)
+
+    @property
+    def inputs(self):
+        return self._backend.items(self._backend.inputs[self._row])
+
+    @property
+    def output_buffer(self):
+        return deque(self._backend.items(self._backend.outputs[self._row]))
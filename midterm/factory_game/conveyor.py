@@ -1,19 +1,123 @@
-from station import Station
+from station import Station, TILE_SIZE
+from lane import Lane
 
 
 class Conveyor(Station):
-    def __init__(self, name, x, y, input_stations=None, next_station=None):
+    # Belt units per tile (items move one unit per tick) and the minimum
+    # distance between two items on the belt
+    TILE_LENGTH = 8
+    SPACING = 2
+
+    def __init__(self, name, x, y, input_stations=None, next_station=None, length=1):
         super().__init__(name, x, y)
-        self.input_stations = input_stations
-        self.inputs = []
+        self.input_stations = input_stations or []
+        self.inputs = Lane(length * self.TILE_LENGTH, self.SPACING)
         self.next_station = next_station
+        self.direction = None  # set for conveyors placed with World.add_conveyor
+        self.moved = 0  # items handed on so far
+        self._received = False
+
+    def can_insert(self, item):
+        return self.inputs.can_accept()
+
+    def insert_item(self, item):
+        if not self.inputs.push(item):
+            return False
+        self._received = True
+        return True
 
     def step(self):
+        lane = self.inputs
+        lane.advance()
+
+        item = lane.head()
+        if item is not None:
+            if self.next_station is None or self.next_station.insert_item(item):
+                lane.pop()
+                self.moved += 1
+            else:
+                self.stalled_ticks += 1
+
         for station in self.input_stations:
-            self.inputs.append(station.output_item())
-        if self.inputs:
-            item = self.inputs.pop(0)
-            if self.next_station:
-                accepted = self.next_station.insert_item(item)
-                if not accepted:
-                    self.inputs.insert(0, item)
+            if not lane.can_accept():
+                break
+            item = station.output_item()
+            if item is not None:
+                lane.push(item)
+
+        self._received = False
+        self._update_blocked()
+
+    def _update_blocked(self):
+        item = self.inputs.head()
+        self.blocked = (
+            item is not None
+            and self.next_station is not None
+            and not self.next_station.can_insert(item)
+        )
+
+    def _has_supply(self):
+        return any(station.output_buffer for station in self.input_stations)
+
+    def next_wake(self):
+        wake = None
+        until_head = self.inputs.ticks_until_head()
+        if until_head:
+            wake = until_head
+        elif until_head == 0 and not self.blocked:
+            wake = 1
+        if self._has_supply():
+            until_space = self.inputs.ticks_until_space()
+            if until_space is not None:
+                until_space = max(until_space, 1)
+                wake = until_space if wake is None else min(wake, until_space)
+        return wake
+
+    def can_progress(self):
+        if self._received:
+            return True
+        item = self.inputs.head()
+        if item is not None:
+            if not self.blocked or self.next_station is None:
+                return True
+            if self.next_station.can_insert(item):
+                return True
+        return self._has_supply() and self.inputs.ticks_until_space() is not None
+
+    def skip(self, ticks):
+        super().skip(ticks)
+        self.inputs.advance(ticks)
+
+    def _flow(self):
+        # Direction items travel across the tile: towards the station fed
+        target = self.next_station
+        if target is None:
+            return 1, 0
+        dx = (target.x > self.x) - (target.x < self.x)
+        dy = (target.y > self.y) - (target.y < self.y)
+        return (dx, dy) if dx or dy else (1, 0)
+
+    def _item_offsets(self, alpha):
+        # Item centres relative to the tile centre, kept far enough from the
+        # edges that the icons stay inside the tile
+        dx, dy = self._flow()
+        span = TILE_SIZE - 14
+        length = self.inputs.length
+        lane = self.inputs
+        offsets = []
+        for item, distance in zip(lane, lane.positions(alpha)):
+            # dx and dy are -1, 0 or 1, and round() is symmetric about 0
+            offset = round((0.5 - distance / length) * span)
+            offsets.append((item, dx * offset, dy * offset))
+        return offsets
+
+    def render_key(self, alpha=0.0):
+        return (self.name, self.color, tuple(self._item_offsets(alpha)))
+
+    def sprites(self, camera_offset, alpha=0.0):
+        blits = super().sprites(camera_offset, alpha)
+        x = self.x * TILE_SIZE - camera_offset[0] + TILE_SIZE // 2
+        y = self.y * TILE_SIZE - camera_offset[1] + TILE_SIZE // 2
+        for item, dx, dy in self._item_offsets(alpha):
+            blits.append(item.icon(x + dx, y + dy))
+        return blits
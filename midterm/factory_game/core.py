@@ -7,5 +7,8 @@ class Core(Station):
         self.inventory = inventory
 
     def insert_item(self, item):
-        self.inventory[item.name] = self.inventory.get(item.name, 0) + 1
+        self.inventory.add(item.id)
+        return True
+
+    def can_insert(self, item):
         return True
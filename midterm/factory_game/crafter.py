@@ -0,0 +1,79 @@
+from collections import deque
+from station import Station
+from recipes import default_registry
+
+
+class Crafter(Station):
+    """A station that crafts recipes for its machine type from its inputs.
+
+    Instead of rescanning the whole buffer each tick, arriving items look
+    up the recipes that use them and queue those as candidates; only the
+    queued candidates are ever checked.
+    """
+
+    MACHINE = None
+
+    def __init__(self, name, x, y, recipes=None):
+        super().__init__(name, x, y)
+        if recipes is None:
+            recipes = default_registry().for_machine(self.MACHINE)
+        self.recipes = recipes
+        self.ready = deque()
+        self._queued = set()
+
+    def insert_item(self, item):
+        if not super().insert_item(item):
+            return False
+        for recipe in self.recipes.candidates(item.id):
+            self._queue(recipe)
+        return True
+
+    def _queue(self, recipe):
+        if recipe.key not in self._queued:
+            self._queued.add(recipe.key)
+            self.ready.append(recipe)
+
+    def rescan(self):
+        """Rebuild the candidate queue after inputs were changed directly"""
+        self.ready.clear()
+        self._queued.clear()
+        for recipe in self.recipes:
+            if recipe.craftable(self.inputs):
+                self._queue(recipe)
+
+    def next_recipe(self):
+        while self.ready:
+            recipe = self.ready[0]
+            if recipe.craftable(self.inputs):
+                return recipe
+            self.ready.popleft()
+            self._queued.discard(recipe.key)
+        return None
+
+    def step(self):
+        recipe = self.next_recipe()
+        if recipe is not None:
+            if self.output_buffer.free() >= recipe.output_count:
+                recipe.craft(self.inputs, self.output_buffer)
+            else:
+                self.stalled_ticks += 1
+        self._update_blocked()
+
+    def _update_blocked(self):
+        recipe = self.next_recipe()
+        self.blocked = (
+            recipe is not None and self.output_buffer.free() < recipe.output_count
+        )
+
+    def next_wake(self):
+        if self.blocked or self.next_recipe() is None:
+            return None
+        return 1
+
+    def can_progress(self):
+        # Also wake to notice a newly satisfiable recipe is blocked, so the
+        # stall is counted from the right tick
+        recipe = self.next_recipe()
+        if recipe is None:
+            return False
+        return not self.blocked or self.output_buffer.free() >= recipe.output_count
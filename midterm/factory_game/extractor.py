@@ -3,13 +3,34 @@ from item import Item
 
 
 class Extractor(Station):
+    INTERVAL = 60
+
     def __init__(self, name, x, y, resource):
         super().__init__(name, x, y)
         self.resource = resource
         self.timer = 0
 
     def step(self):
-        self.timer += 1
-        if self.timer >= 60:
-            self.output_buffer.append(Item(self.resource))
-            self.timer = 0
+        if self.timer < self.INTERVAL:
+            self.timer += 1
+        if self.timer >= self.INTERVAL:
+            # Hold the finished item until there is room for it
+            self.blocked = not self.output_buffer.append(Item(self.resource))
+            if self.blocked:
+                self.stalled_ticks += 1
+            else:
+                self.timer = 0
+
+    def next_wake(self):
+        if self.blocked:
+            return None
+        return self.INTERVAL - self.timer
+
+    def can_progress(self):
+        return self.blocked and not self.output_buffer.is_full()
+
+    def skip(self, ticks):
+        if self.blocked:
+            self.stalled_ticks += ticks
+        else:
+            self.timer += ticks
@@ -0,0 +1,59 @@
+from item import Item
+
+
+class Inventory:
+    """Multiset of items, stored as a count per interned item id"""
+
+    __slots__ = ("counts", "total")
+
+    def __init__(self, items=()):
+        self.counts = []
+        self.total = 0
+        for item in items:
+            self.add(item.id)
+
+    def _grow(self, item_id):
+        self.counts.extend([0] * (item_id + 1 - len(self.counts)))
+
+    def add(self, item_id, count=1):
+        if item_id >= len(self.counts):
+            self._grow(item_id)
+        self.counts[item_id] += count
+        self.total += count
+
+    def remove(self, item_id, count=1):
+        if not self.has(item_id, count):
+            return False
+        self.counts[item_id] -= count
+        self.total -= count
+        return True
+
+    def has(self, item_id, count=1):
+        return item_id < len(self.counts) and self.counts[item_id] >= count
+
+    def count(self, item_id):
+        return self.counts[item_id] if item_id < len(self.counts) else 0
+
+    def items(self):
+        for item_id, count in enumerate(self.counts):
+            if count:
+                yield Item.by_id[item_id], count
+
+    def copy(self):
+        inventory = Inventory()
+        inventory.counts = list(self.counts)
+        inventory.total = self.total
+        return inventory
+
+    def __len__(self):
+        return self.total
+
+    def __iter__(self):
+        # One (shared) Item per unit, for tooltips and icons
+        for item, count in self.items():
+            for _ in range(count):
+                yield item
+
+    def __repr__(self):
+        contents = ", ".join(f"{item.name}: {count}" for item, count in self.items())
+        return f"Inventory({contents})"
@@ -1,7 +1,8 @@
-import pygame
+from sprites import sprite_cache
 
 
 class Item:
+    ICON_RADIUS = 6
     COLORS = {
         "Iron Ore": (180, 180, 180),
         "Copper Ore": (255, 100, 100),
@@ -10,12 +11,37 @@ class Item:
         "Product": (0, 255, 0),
     }
 
-    def __init__(self, name):
-        self.name = name
+    # Items are interned: Item(name) always returns the one shared instance
+    # for that item type, and each type gets a small integer id
+    by_id = []
+    _by_name = {}
+
+    def __new__(cls, name):
+        item = cls._by_name.get(name)
+        if item is None:
+            item = super().__new__(cls)
+            item.name = name
+            item.id = len(cls.by_id)
+            item.sprite = None  # the icon, made the first time it's drawn
+            cls.by_id.append(item)
+            cls._by_name[name] = item
+        return item
 
     def __repr__(self):
         return f"Item({self.name})"
 
+    def __reduce__(self):
+        return (Item, (self.name,))
+
+    def icon(self, x, y):
+        """The icon centred on (x, y), as a (surface, position) pair for
+        Surface.blits"""
+        sprite = self.sprite
+        if sprite is None:
+            color = self.COLORS.get(self.name, (255, 255, 255))
+            sprite = self.sprite = sprite_cache.icon(color, self.ICON_RADIUS)
+        offset = self.ICON_RADIUS + 1
+        return sprite, (x - offset, y - offset)
+
     def draw_icon(self, surface, x, y):
-        color = self.COLORS.get(self.name, (255, 255, 255))
-        pygame.draw.circle(surface, color, (x, y), 6)
+        surface.blit(*self.icon(x, y))
@@ -0,0 +1,126 @@
+from collections import deque
+
+
+class Lane:
+    """Items travelling along a belt, stored as gaps rather than positions.
+
+    gaps[0] is the distance from the first item to the end of the lane and
+    gaps[i] the free space between item i - 1 and item i. Moving the belt
+    one unit only shrinks the first non-zero gap: everything behind it
+    moves along for free, and items queued up at the end don't move at
+    all, so a step costs the same however many items are on the lane.
+    """
+
+    __slots__ = ("items", "gaps", "length", "spacing", "slack", "entry", "moving")
+
+    def __init__(self, length, spacing):
+        self.items = deque()
+        self.gaps = deque()
+        self.length = length
+        self.spacing = spacing
+        self.slack = 0  # sum of gaps: how far the last item can still move
+        self.entry = length  # how far the last item is from the start
+        self.moving = 0  # index of the first item that isn't queued up
+
+    @property
+    def capacity(self):
+        return self.length // self.spacing + 1
+
+    def can_accept(self):
+        return self.entry >= self.spacing
+
+    def push(self, item):
+        if self.entry < self.spacing:
+            return False
+        gap = self.length if not self.items else self.entry - self.spacing
+        self.items.append(item)
+        self.gaps.append(gap)
+        self.slack += gap
+        self.entry = 0
+        return True
+
+    def head(self):
+        # The item waiting at the end of the lane, if there is one
+        if self.items and self.gaps[0] == 0:
+            return self.items[0]
+        return None
+
+    def pop(self):
+        item = self.items.popleft()
+        self.gaps.popleft()
+        if self.items:
+            self.gaps[0] += self.spacing
+            self.slack += self.spacing
+        else:
+            self.slack = 0
+            self.entry = self.length
+        self.moving = 0
+        return item
+
+    def advance(self, distance=1):
+        while distance and self.slack:
+            while self.gaps[self.moving] == 0:
+                self.moving += 1
+            moved = min(distance, self.gaps[self.moving])
+            self.gaps[self.moving] -= moved
+            self.slack -= moved
+            self.entry += moved
+            distance -= moved
+
+    def resize(self, length):
+        """Change the length, keeping items as far from the end as they
+        were; if that doesn't leave room, the last ones are moved up"""
+        self.entry += length - self.length
+        self.length = length
+        k = len(self.gaps) - 1
+        while self.entry < 0 and k >= 0:
+            moved = min(self.gaps[k], -self.entry)
+            self.gaps[k] -= moved
+            self.slack -= moved
+            self.entry += moved
+            k -= 1
+        if self.entry < 0:  # packed too tightly to fit, so stay longer
+            self.length -= self.entry
+            self.entry = 0
+        if not self.items:
+            self.entry = self.length
+        self.moving = 0
+
+    def ticks_until_head(self):
+        return self.gaps[0] if self.items else None
+
+    def ticks_until_space(self):
+        # None if the lane is queued up too tightly to make room by moving
+        needed = self.spacing - self.entry
+        if needed <= 0:
+            return 0
+        return needed if needed <= self.slack else None
+
+    def first_moving(self):
+        # Index of the first item the next advance() will move; everything
+        # from there to the back of the lane moves with it
+        if not self.slack:
+            return len(self.items)
+        i = self.moving
+        while self.gaps[i] == 0:
+            i += 1
+        return i
+
+    def positions(self, alpha=0.0):
+        """Distance of each item from the end of the lane, front first.
+
+        With alpha between 0 and 1, items the next advance() will move are
+        shown that fraction of a unit further along, for drawing between
+        ticks.
+        """
+        first = self.first_moving() if alpha else len(self.items)
+        position = 0
+        for i, gap in enumerate(self.gaps):
+            position += gap + (self.spacing if i else 0)
+            yield position - alpha if i >= first else position
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
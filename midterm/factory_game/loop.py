@@ -0,0 +1,104 @@
+import threading
+import time
+
+
+class FixedStepLoop:
+    """Steps a simulation at a fixed tick rate, however fast frames are drawn.
+
+    advance() is called with the wall-clock seconds since its last call.
+    That time, scaled by the speed, is added to an accumulator and spent
+    on whole ticks; what's left over carries into the next call, and
+    alpha says how far (0 to 1) the simulation is into its next tick.
+
+    A call runs at most max_steps ticks. If the simulation can't keep up,
+    the time it couldn't catch up on is dropped, so a heavy factory runs
+    slower than real time rather than falling further and further behind.
+    At speed None ("max") it instead steps for up to frame_budget seconds
+    per call, as fast as the CPU allows.
+    """
+
+    SPEEDS = (1, 4, None)
+
+    def __init__(self, step, tick_rate=60, speed=1, max_steps=240, frame_budget=1 / 60):
+        self.step = step
+        self.tick_rate = tick_rate
+        self.speed = speed
+        self.max_steps = max_steps
+        self.frame_budget = frame_budget
+        self.accumulator = 0.0  # in ticks
+        self.ticks = 0
+        self.dropped = 0  # ticks skipped because the simulation fell behind
+
+    @property
+    def alpha(self):
+        return self.accumulator
+
+    def set_speed(self, speed):
+        self.speed = speed
+        self.accumulator = 0.0
+
+    def advance(self, elapsed):
+        """Run the ticks that elapsed seconds of real time are worth"""
+        if self.speed is None:
+            return self._advance_max()
+
+        self.accumulator += elapsed * self.speed * self.tick_rate
+        steps = min(int(self.accumulator), self.max_steps)
+        for _ in range(steps):
+            self.step()
+        self.accumulator -= steps
+        if self.accumulator >= 1:
+            behind = int(self.accumulator)
+            self.dropped += behind
+            self.accumulator -= behind
+        self.ticks += steps
+        return steps
+
+    def _advance_max(self):
+        self.accumulator = 0.0
+        deadline = time.perf_counter() + self.frame_budget
+        steps = 0
+        while True:
+            self.step()
+            steps += 1
+            if steps % 16 == 0 and time.perf_counter() >= deadline:
+                break
+        self.ticks += steps
+        return steps
+
+    def time_to_next_tick(self):
+        """Seconds of real time until the next tick is due"""
+        if self.speed is None:
+            return 0.0
+        return (1 - self.accumulator) / (self.tick_rate * self.speed)
+
+
+class SimulationThread(threading.Thread):
+    """Runs a FixedStepLoop on its own thread, apart from rendering.
+
+    The simulation only steps while holding lock; hold it too while
+    reading or changing the world (drawing, handling input) to see it
+    between ticks rather than halfway through one.
+    """
+
+    def __init__(self, loop, lock=None):
+        super().__init__(daemon=True)
+        self.loop = loop
+        self.lock = lock or threading.Lock()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        last = time.perf_counter()
+        while not self._stop_event.is_set():
+            now = time.perf_counter()
+            with self.lock:
+                self.loop.advance(now - last)
+                wait = self.loop.time_to_next_tick()
+            last = now
+            # Always give up the GIL, even at max speed, so the render
+            # thread gets to take the lock between batches
+            time.sleep(wait)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
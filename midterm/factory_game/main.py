@@ -1,59 +1,287 @@
-import pygame
+import argparse
+import gc
+import threading
+import time
 from world import World
 from extractor import Extractor
 from furnace import Furnace
 from conveyor import Conveyor
 from assembler import Assembler
 from core import Core
+from renderer import Renderer
+from loop import FixedStepLoop, SimulationThread
+from profiler import Profiler
 
-pygame.init()
-screen = pygame.display.set_mode((800, 600))
-clock = pygame.time.Clock()
-
-world = World()
-core = Core("PlayerCore", 5, 3, world.inventory)
-
-
-ironExtractor = Extractor("IronExtractor", 1, 1, "Iron Ore")
-world.add_station(ironExtractor)
-furnace1 = Furnace("Furnace1", 3, 1)
-world.add_station(furnace1)
-# world.add_station(Conveyor("", 2, 1, [ironExtractor], furnace1))
-
-copperExtractor = Extractor("CopperExtractor", 1, 5, "Copper Ore")
-world.add_station(copperExtractor)
-furnace2 = Furnace("Furnace2", 3, 5)
-world.add_station(furnace2)
-# world.add_station(Conveyor("", 2, 5, [copperExtractor], furnace2))
-
-assembler = Assembler("Assembler1", 3, 3, recipe={"Iron": 2, "Copper": 1})
-# world.add_station(Conveyor("", 3, 2, [furnace1], assembler))
-# world.add_station(Conveyor("", 3, 4, [furnace2], assembler))
-world.add_station(assembler)
-
-world.add_station(core)
-
-# world.add_station(Conveyor("", 3, 4, [assembler], core))
-
-running = True
-while running:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-
-    keys = pygame.key.get_pressed()
-    if keys[pygame.K_w]:
-        world.pan_camera(0, 5)
-    if keys[pygame.K_s]:
-        world.pan_camera(0, -5)
-    if keys[pygame.K_a]:
-        world.pan_camera(5, 0)
-    if keys[pygame.K_d]:
-        world.pan_camera(-5, 0)
-
-    world.step()
-    world.draw(screen)
-    pygame.display.flip()
-    clock.tick(60)
-
-pygame.quit()
+
+def build_world():
+    world = World()
+    core = Core("PlayerCore", 5, 3, world.inventory)
+
+    ironExtractor = Extractor("IronExtractor", 1, 1, "Iron Ore")
+    world.add_station(ironExtractor)
+    furnace1 = Furnace("Furnace1", 3, 1)
+    world.add_station(furnace1)
+    world.add_station(Conveyor("", 2, 1, [ironExtractor], furnace1))
+
+    copperExtractor = Extractor("CopperExtractor", 1, 5, "Copper Ore")
+    world.add_station(copperExtractor)
+    furnace2 = Furnace("Furnace2", 3, 5)
+    world.add_station(furnace2)
+    world.add_station(Conveyor("", 2, 5, [copperExtractor], furnace2))
+
+    assembler = Assembler("Assembler1", 3, 3, recipe="PRODUCT")
+    world.add_station(Conveyor("", 3, 2, [furnace1], assembler))
+    world.add_station(Conveyor("", 3, 4, [furnace2], assembler))
+    world.add_station(assembler)
+
+    world.add_station(core)
+
+    world.add_station(Conveyor("", 4, 3, [assembler], core))
+    return world
+
+
+def play(world, speed=1, threaded=False, profile_out=None):
+    import pygame
+
+    pygame.init()
+    screen = pygame.display.set_mode((800, 600))
+    clock = pygame.time.Clock()
+    renderer = Renderer(world)
+
+    # Steps leave no new objects for the collector to track (items are
+    # interned and buffers preallocated), so collections only come from
+    # drawing. Freeze the world so those never walk all of it.
+    gc.collect()
+    gc.freeze()
+
+    # The simulation runs at 60 ticks per second of game time whatever the
+    # frame rate; 1, 2 and 3 switch between 1x, 4x and max speed. F3
+    # turns the profiler and its overlay on and off.
+    loop = FixedStepLoop(world.step, speed=speed)
+    speed_keys = dict(zip((pygame.K_1, pygame.K_2, pygame.K_3), loop.SPEEDS))
+    sim_thread = None
+    lock = threading.Lock()
+    if threaded:
+        sim_thread = SimulationThread(loop, lock)
+        sim_thread.start()
+
+    overlay = None
+    frame = 0
+    last = time.perf_counter()
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN and event.key in speed_keys:
+                with lock:
+                    loop.set_speed(speed_keys[event.key])
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                with lock:
+                    world.profiler = None if world.profiler else Profiler()
+
+        keys = pygame.key.get_pressed()
+        if keys[pygame.K_w]:
+            world.pan_camera(0, 5)
+        if keys[pygame.K_s]:
+            world.pan_camera(0, -5)
+        if keys[pygame.K_a]:
+            world.pan_camera(5, 0)
+        if keys[pygame.K_d]:
+            world.pan_camera(-5, 0)
+
+        now = time.perf_counter()
+        with lock:
+            steps = 0
+            if sim_thread is None:
+                steps = loop.advance(now - last)
+            updated = time.perf_counter()
+            profiler = world.profiler
+            # The overlay sums over every station, so refresh it a few
+            # times a second rather than every frame
+            if profiler is None:
+                overlay = None
+            elif overlay is None or frame % 15 == 0:
+                overlay = profiler.overlay_lines(world)
+            dirty = renderer.draw(screen, loop.alpha, overlay)
+            if profiler is not None:
+                profiler.frame(steps, updated - now, time.perf_counter() - updated)
+        last = now
+        frame += 1
+        pygame.display.update(dirty)
+        clock.tick(60)
+
+    if sim_thread is not None:
+        sim_thread.stop()
+    if profile_out and world.profiler is not None:
+        world.profiler.dump(profile_out, world)
+    pygame.quit()
+
+
+def simulate(world, ticks, event_driven=False, workers=None):
+    start = time.perf_counter()
+    if event_driven or workers:
+        world.run(ticks, event_driven=event_driven, workers=workers)
+    else:
+        world.run(ticks)
+    elapsed = time.perf_counter() - start
+
+    print(f"Simulated {ticks} ticks in {elapsed:.3f}s", end="")
+    if elapsed > 0:
+        print(f" ({ticks / elapsed:,.0f} ticks/s)")
+    else:
+        print()
+    for item, count in sorted(world.inventory.items(), key=lambda pair: pair[0].name):
+        print(f"  {item.name}: {count}")
+
+
+def print_profile(summary):
+    print(f"Profiled {summary['samples']} of {summary['tick']} ticks:")
+    for name, us in sorted(summary["step_us"].items()):
+        print(
+            f"  {name}: {us:.2f} us/step, "
+            f"stalled {summary['stalled_ticks'].get(name, 0)} ticks, "
+            f"output buffers {summary['output_occupancy'].get(name)}"
+        )
+    print(f"  Items moved per tick: {summary['items_moved_per_tick']:.3f}")
+
+
+def report_throughput(world, ticks):
+    from throughput import analyze, measure
+
+    report = analyze(world)
+    print(report.format())
+    predicted = report.output()
+    measured = measure(world, ticks)
+    print(f"Simulated over {ticks} ticks:")
+    for name in sorted(set(predicted) | set(measured)):
+        print(
+            f"  {name}: {measured.get(name, 0.0):.3f}/s "
+            f"(predicted {predicted.get(name, 0.0):.3f}/s)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Factory game")
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="run the simulation without a window and print the results",
+    )
+    parser.add_argument(
+        "--ticks",
+        type=int,
+        default=60 * 60 * 60,
+        help="ticks to simulate in headless mode (default: one hour at 60 TPS)",
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="step the headless simulation with the NumPy columnar backend",
+    )
+    parser.add_argument(
+        "--event-driven",
+        action="store_true",
+        help="skip idle ticks with the next-event scheduler in headless mode",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="run independent production lines in this many processes "
+        "in headless mode",
+    )
+    parser.add_argument(
+        "--chunks",
+        metavar="DIR",
+        nargs="?",
+        const="",
+        help="write chunks far from the camera out to DIR (default: a "
+        "temporary directory) and only summarize them while they are out; "
+        "Core totals can differ from a full run by up to about one item per "
+        "belt into a Core",
+    )
+    parser.add_argument(
+        "--load",
+        metavar="PATH",
+        help="start from a saved snapshot instead of the demo factory",
+    )
+    parser.add_argument(
+        "--save",
+        metavar="PATH",
+        help="save a snapshot of the world after a headless run",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="time station steps and sample buffers every few ticks, and "
+        "print a summary after a headless run (F3 in the game window)",
+    )
+    parser.add_argument(
+        "--profile-out",
+        metavar="PATH",
+        help="write the profile to PATH as CSV (.csv) or JSON when done",
+    )
+    parser.add_argument(
+        "--analyze",
+        action="store_true",
+        help="print the steady-state throughput of every link and check it "
+        "against a simulation of --ticks ticks",
+    )
+    parser.add_argument(
+        "--speed",
+        choices=("1", "4", "max"),
+        default="1",
+        help="simulation speed in the game window (default: 1)",
+    )
+    parser.add_argument(
+        "--sim-thread",
+        action="store_true",
+        help="step the simulation on its own thread, apart from rendering",
+    )
+    args = parser.parse_args()
+    if args.columnar and args.event_driven:
+        parser.error("--columnar and --event-driven can't be combined")
+    if args.columnar and args.save:
+        parser.error("--columnar worlds can't be saved")
+    if args.columnar and args.workers:
+        parser.error("--columnar and --workers can't be combined")
+    if args.columnar and args.analyze:
+        parser.error("--columnar and --analyze can't be combined")
+    if args.columnar and args.chunks is not None:
+        parser.error("--columnar and --chunks can't be combined")
+    profiling = args.profile or args.profile_out
+    if profiling and (args.columnar or args.event_driven or args.workers):
+        parser.error("--profile only works with the plain serial simulation")
+
+    world = World.load(args.load) if args.load else build_world()
+    if args.chunks is not None:
+        from chunks import ChunkManager
+
+        world.chunks = ChunkManager(world, args.chunks or None)
+    if args.columnar:
+        from columnar import ColumnarWorld
+
+        world = ColumnarWorld(world)
+    if profiling:
+        world.profiler = Profiler()
+    if args.analyze:
+        report_throughput(world, args.ticks)
+    elif args.headless:
+        simulate(world, args.ticks, args.event_driven, args.workers)
+        if args.save:
+            world.save(args.save)
+        if world.profiler is not None:
+            print_profile(world.profiler.summary(world))
+            if args.profile_out:
+                world.profiler.dump(args.profile_out, world)
+    else:
+        play(
+            world,
+            None if args.speed == "max" else int(args.speed),
+            args.sim_thread,
+            args.profile_out,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from station import Station
+from conveyor import Conveyor
+from core import Core
+from inventory import Inventory
+from item import Item
+
+# Attributes that point at other parts of the world rather than holding a
+# station's own state; they stay as they are when results come back
+_LINKS = frozenset(("input_stations", "next_station", "inventory", "recipes"))
+
+
+class ParallelRunner:
+    """Steps the independent production lines of a world in worker processes.
+
+    Stations are split into connected components of the belt graph, not
+    counting Cores: a Core accepts everything and only adds to the shared
+    inventory, so lines that merely deliver to the same Core don't affect
+    each other. No item can move between two components, so each one is
+    run for all the ticks in its own process and the results are copied
+    back at the end, the only synchronisation point. Components keep their
+    stations in world order, so the end state is the same as stepping the
+    whole world serially.
+    """
+
+    def __init__(self, world, workers=None):
+        self.world = world
+        self.workers = workers or os.cpu_count() or 1
+        self.components = self._components()
+
+    def _components(self):
+        stations = self.world.stations
+        index = {id(station): i for i, station in enumerate(stations)}
+        parent = list(range(len(stations)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        def union(a, b):
+            j = index.get(id(b))
+            if j is not None and not isinstance(b, Core):
+                parent[find(j)] = find(a)
+
+        for i, station in enumerate(stations):
+            if isinstance(station, Conveyor):
+                union(i, station.next_station)
+                for source in station.input_stations:
+                    union(i, source)
+
+        components = {}
+        for i in range(len(stations)):
+            components.setdefault(find(i), []).append(i)
+        # Parts with nothing to step (a lone Core) don't need a worker
+        return [
+            component
+            for component in components.values()
+            if any(type(stations[i]).step is not Station.step for i in component)
+        ]
+
+    def _batches(self):
+        # Largest components first, each onto the least loaded worker
+        batches = [[] for _ in range(min(self.workers, len(self.components)))]
+        sizes = [0] * len(batches)
+        for component in sorted(self.components, key=len, reverse=True):
+            k = sizes.index(min(sizes))
+            batches[k].extend(component)
+            sizes[k] += len(component)
+        return [sorted(batch) for batch in batches if batch]
+
+    def run(self, ticks, event_driven=False):
+        world = self.world
+        batches = self._batches()
+        if len(batches) < 2:
+            world.run(ticks, event_driven=event_driven)
+            return
+
+        names = [item.name for item in Item.by_id]
+        with ProcessPoolExecutor(
+            len(batches), initializer=_init_worker, initargs=(names,)
+        ) as pool:
+            jobs = [
+                pool.submit(
+                    _run_batch,
+                    [world.stations[i] for i in batch],
+                    ticks,
+                    event_driven,
+                )
+                for batch in batches
+            ]
+            results = [job.result() for job in jobs]
+
+        for batch, (stepped, produced) in zip(batches, results):
+            for i, new in zip(batch, stepped):
+                station = world.stations[i]
+                for attr, value in vars(new).items():
+                    if attr not in _LINKS:
+                        setattr(station, attr, value)
+            for item_id, count in enumerate(produced):
+                if count:
+                    world.inventory.add(item_id, count)
+        world.tick += ticks
+
+
+def _init_worker(names):
+    # Give items the same ids as in the parent, since inventories and
+    # compiled recipes refer to items by id
+    for name in names:
+        Item(name)
+
+
+def _run_batch(stations, ticks, event_driven):
+    from world import World
+
+    part = World()
+    part.stations = stations
+    # Count what reaches the Cores here; the parent adds it to its inventory
+    produced = Inventory()
+    for station in stations:
+        if isinstance(station, Conveyor) and isinstance(station.next_station, Core):
+            station.next_station.inventory = produced
+    part.run(ticks, event_driven=event_driven)
+    return stations, produced.counts
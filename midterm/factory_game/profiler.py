@@ -0,0 +1,161 @@
+import csv
+import json
+import time
+from collections import deque
+from conveyor import Conveyor
+
+
+class Profiler:
+    """Opt-in instrumentation for a World and the frames that show it.
+
+    Set world.profiler to one and every `sample_every`th tick is stepped
+    one station at a time under a timer. On those ticks it also records
+    how full every buffer is, which stations are blocked and how many
+    items the conveyors moved since the last sample. The ticks in between
+    run exactly as without a profiler, so the overhead is about
+    1 / sample_every of the timing cost. The frame loop reports how long
+    each frame spent updating and drawing through frame().
+    """
+
+    def __init__(self, sample_every=60, history=600):
+        self.sample_every = sample_every
+        self.samples = 0
+        self.step_seconds = {}  # station type -> time spent in step()
+        self.steps = {}  # station type -> steps timed
+        # station type -> number of samples with 0, 1, 2, ... items buffered
+        self.input_occupancy = {}
+        self.output_occupancy = {}
+        self.blocked = {}  # station type -> blocked stations over all samples
+        self.moved = deque(maxlen=history)  # items moved per tick, per sample
+        self.frames = deque(maxlen=history)  # (ticks, update s, draw s)
+        self._last_moved = None  # (tick, items moved so far)
+
+    def due(self, tick):
+        return tick % self.sample_every == 0
+
+    def step(self, world):
+        """Step every station of the world once, timing each"""
+        for station in world.stations:
+            self._time(type(station).__name__, 1, station.step)
+        self.samples += 1
+        self._sample(world)
+
+    def _time(self, name, count, step, *args):
+        # Charge one call of step(*args) to `count` steps of `name`
+        start = time.perf_counter()
+        step(*args)
+        elapsed = time.perf_counter() - start
+        self.step_seconds[name] = self.step_seconds.get(name, 0.0) + elapsed
+        self.steps[name] = self.steps.get(name, 0) + count
+
+    def _sample(self, world):
+        moved = 0
+        for station in world.stations:
+            name = type(station).__name__
+            if isinstance(station, Conveyor):
+                moved += station.moved
+            self._count(self.input_occupancy, name, len(station.inputs))
+            self._count(self.output_occupancy, name, len(station.output_buffer))
+            if station.blocked:
+                self.blocked[name] = self.blocked.get(name, 0) + 1
+
+        # The tick being stepped hasn't been counted yet
+        self._moved(world.tick + 1, moved)
+
+    def _count(self, histograms, name, fill):
+        histogram = histograms.setdefault(name, [])
+        if fill >= len(histogram):
+            histogram.extend([0] * (fill + 1 - len(histogram)))
+        histogram[fill] += 1
+
+    def _moved(self, tick, moved):
+        # `moved` items in all by `tick`; records the rate since last time
+        if self._last_moved is not None and tick > self._last_moved[0]:
+            last_tick, last_moved = self._last_moved
+            self.moved.append((moved - last_moved) / (tick - last_tick))
+        self._last_moved = (tick, moved)
+
+    def frame(self, ticks, update_seconds, draw_seconds):
+        self.frames.append((ticks, update_seconds, draw_seconds))
+
+    def stalled(self, world):
+        """{station type: ticks its stations have spent stalled}"""
+        stalled = {}
+        for station in world.stations:
+            name = type(station).__name__
+            stalled[name] = stalled.get(name, 0) + station.stalled_ticks
+        return stalled
+
+    def summary(self, world):
+        """Everything recorded so far, plus the stall counters, as plain data"""
+        frames = len(self.frames)
+        return {
+            "tick": world.tick,
+            "sample_every": self.sample_every,
+            "samples": self.samples,
+            "step_us": {
+                name: 1e6 * seconds / self.steps[name]
+                for name, seconds in self.step_seconds.items()
+            },
+            "step_seconds": dict(self.step_seconds),
+            "steps": dict(self.steps),
+            "stalled_ticks": self.stalled(world),
+            "blocked": dict(self.blocked),
+            "input_occupancy": dict(self.input_occupancy),
+            "output_occupancy": dict(self.output_occupancy),
+            "items_moved_per_tick": _mean(self.moved),
+            "frames": frames,
+            "ticks_per_frame": _mean([f[0] for f in self.frames]),
+            "update_ms": 1e3 * _mean([f[1] for f in self.frames]),
+            "draw_ms": 1e3 * _mean([f[2] for f in self.frames]),
+        }
+
+    def overlay_lines(self, world):
+        """A few lines of text for drawing over the game"""
+        summary = self.summary(world)
+        lines = [
+            f"update {summary['update_ms']:.2f} ms  draw {summary['draw_ms']:.2f} ms",
+            f"{summary['ticks_per_frame']:.1f} ticks/frame  "
+            f"{summary['items_moved_per_tick']:.2f} items moved/tick",
+        ]
+        for name, us in sorted(summary["step_us"].items()):
+            lines.append(
+                f"{name}: {us:.2f} us/step  "
+                f"stalled {summary['stalled_ticks'].get(name, 0)}"
+            )
+        return lines
+
+    def dump_json(self, path, world):
+        with open(path, "w") as f:
+            json.dump(self.summary(world), f, indent=2)
+
+    def dump_csv(self, path, world):
+        """One metric per row: metric, station type, key, value"""
+        summary = self.summary(world)
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("metric", "station_type", "key", "value"))
+            for metric in ("step_us", "steps", "stalled_ticks", "blocked"):
+                for name, value in summary[metric].items():
+                    writer.writerow((metric, name, "", value))
+            for metric in ("input_occupancy", "output_occupancy"):
+                for name, histogram in summary[metric].items():
+                    for fill, count in enumerate(histogram):
+                        writer.writerow((metric, name, fill, count))
+            for k, (ticks, update, draw) in enumerate(self.frames):
+                writer.writerow(("frame_ticks", "", k, ticks))
+                writer.writerow(("frame_update_ms", "", k, 1e3 * update))
+                writer.writerow(("frame_draw_ms", "", k, 1e3 * draw))
+            for k, moved in enumerate(self.moved):
+                writer.writerow(("items_moved_per_tick", "", k, moved))
+
+    def dump(self, path, world):
+        """Write a .csv or (anything else) .json dump"""
+        if path.endswith(".csv"):
+            self.dump_csv(path, world)
+        else:
+            self.dump_json(path, world)
+
+
+def _mean(values):
+    return sum(values) / len(values) if values else 0.0
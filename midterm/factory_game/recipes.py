@@ -0,0 +1,122 @@
+import csv
+import os
+from item import Item
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recipes.csv")
+
+
+def parse_stack_list(text):
+    """Parse "2 Iron + Copper" into {"Iron": 2, "Copper": 1}"""
+    stacks = {}
+    for part in text.split("+"):
+        part = part.strip()
+        count, _, name = part.partition(" ")
+        if count.isdigit() and name:
+            stacks[name.strip()] = stacks.get(name.strip(), 0) + int(count)
+        else:
+            stacks[part] = stacks.get(part, 0) + 1
+    return stacks
+
+
+class Recipe:
+    """A recipe compiled down to (item id, count) input and output vectors"""
+
+    __slots__ = ("key", "machine", "inputs", "outputs", "output_count", "index")
+
+    def __init__(self, key, machine, inputs, outputs):
+        self.key = key
+        self.machine = machine
+        self.inputs = tuple((Item(name).id, count) for name, count in inputs.items())
+        self.outputs = tuple((Item(name), count) for name, count in outputs.items())
+        self.output_count = sum(outputs.values())
+        self.index = -1
+
+    def craftable(self, inventory):
+        return all(inventory.has(item_id, count) for item_id, count in self.inputs)
+
+    def craft(self, inventory, output_buffer):
+        for item_id, count in self.inputs:
+            inventory.remove(item_id, count)
+        for item, count in self.outputs:
+            for _ in range(count):
+                output_buffer.append(item)
+
+    def __reduce_ex__(self, protocol):
+        # Recipes from recipes.csv unpickle as the shared registry entry, so
+        # a station sent to another process and back still uses it
+        if _default is not None and _default.by_key.get(self.key) is self:
+            return (_default_recipe, (self.key,))
+        return super().__reduce_ex__(protocol)
+
+    def __repr__(self):
+        return f"Recipe({self.key})"
+
+
+class RecipeRegistry:
+    def __init__(self, recipes=()):
+        self.recipes = []
+        self.by_key = {}
+        self.by_input = {}  # item id -> recipes that consume it
+        self._machines = {}
+        for recipe in recipes:
+            self.add(recipe)
+
+    def add(self, recipe):
+        if recipe.key in self.by_key:
+            raise ValueError(f"duplicate recipe {recipe.key!r}")
+        if recipe.index < 0:
+            recipe.index = len(self.recipes)
+        self.recipes.append(recipe)
+        self.by_key[recipe.key] = recipe
+        for item_id, _ in recipe.inputs:
+            self.by_input.setdefault(item_id, []).append(recipe)
+        self._machines.clear()
+
+    def candidates(self, item_id):
+        return self.by_input.get(item_id, ())
+
+    def for_machine(self, machine):
+        # Sub-registries keep the recipes' global indices
+        if machine not in self._machines:
+            self._machines[machine] = RecipeRegistry(
+                r for r in self.recipes if r.machine == machine
+            )
+        return self._machines[machine]
+
+    def __getitem__(self, key):
+        return self.by_key[key]
+
+    def __iter__(self):
+        return iter(self.recipes)
+
+    def __len__(self):
+        return len(self.recipes)
+
+    @classmethod
+    def load(cls, path=DEFAULT_PATH):
+        registry = cls()
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                registry.add(
+                    Recipe(
+                        row["Internal"],
+                        row["Machine"],
+                        parse_stack_list(row["Inputs"]),
+                        parse_stack_list(row["Outputs"]),
+                    )
+                )
+        return registry
+
+
+_default = None
+
+
+def default_registry():
+    global _default
+    if _default is None:
+        _default = RecipeRegistry.load()
+    return _default
+
+
+def _default_recipe(key):
+    return default_registry()[key]
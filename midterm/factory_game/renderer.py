@@ -0,0 +1,121 @@
+from station import TILE_SIZE
+from text import text_cache
+
+
+class Renderer:
+    """Draws a world incrementally for pygame.display.update(rects).
+
+    Only stations inside the viewport are drawn. The first frame, and any
+    frame after the camera moves, is drawn in full; after that only the
+    stations whose render_key() changed or that were removed, and the area
+    under the old and new tooltip, are repainted. draw() returns the rects
+    that changed. Lines of `overlay` text (e.g. from
+    Profiler.overlay_lines) are drawn over the top left corner.
+
+    alpha is how far the simulation is into its next tick (see
+    FixedStepLoop.alpha), so belts can show items between tick positions.
+    """
+
+    BACKGROUND = (50, 50, 50)
+    OVERLAY_BACKGROUND = (0, 0, 0)
+    OVERLAY_TEXT = (255, 255, 0)
+
+    def __init__(self, world):
+        self.world = world
+        self._camera = None
+        self._size = None
+        # id(station) -> (station, render key, rect it was drawn in). Holding
+        # on to the station keeps its id from going to a new one meanwhile
+        self._drawn = {}
+        self._tooltip_rect = None
+        self._overlay_rect = None
+
+    def draw(self, surface, alpha=0.0, overlay=None):
+        import pygame
+
+        world = self.world
+        camera = tuple(world.camera_offset)
+        screen = surface.get_rect()
+        if camera != self._camera or screen.size != self._size:
+            self._camera = camera
+            self._size = screen.size
+            self._drawn.clear()
+            self._tooltip_rect = None
+            self._overlay_rect = None
+            dirty = [screen]
+        else:
+            dirty = []
+            seen = set()
+            for station in world.visible_stations(screen):
+                seen.add(id(station))
+                drawn = self._drawn.get(id(station))
+                if drawn is None:
+                    # New, so not only its tile but also its label
+                    sprites = station.sprites(world.camera_offset, alpha)
+                    dirty.append(self._extent(station, sprites).clip(screen))
+                elif drawn[1] != station.render_key(alpha):
+                    dirty.append(drawn[2].clip(screen))
+            # Stations drawn before that aren't there any more are erased
+            for station_id in self._drawn.keys() - seen:
+                rect = self._drawn.pop(station_id)[2].clip(screen)
+                if rect:
+                    dirty.append(rect)
+            if self._tooltip_rect is not None:
+                dirty.append(self._tooltip_rect)
+            if self._overlay_rect is not None:
+                dirty.append(self._overlay_rect)
+
+        for rect in dirty:
+            self._repaint(surface, rect, alpha)
+
+        mouse = pygame.mouse.get_pos()
+        hovered = world.station_at_pixel(*mouse)
+        self._tooltip_rect = None
+        if hovered is not None:
+            tooltip = hovered.draw_tooltip(surface, world.camera_offset, mouse)
+            self._tooltip_rect = tooltip.clip(screen)
+            dirty.append(self._tooltip_rect)
+
+        self._overlay_rect = None
+        if overlay:
+            self._overlay_rect = self._draw_overlay(surface, overlay).clip(screen)
+            dirty.append(self._overlay_rect)
+        return dirty
+
+    def _draw_overlay(self, surface, lines):
+        import pygame
+
+        labels = [text_cache.render(line, self.OVERLAY_TEXT, size=14) for line in lines]
+        width = max(label.get_width() for label in labels) + 8
+        height = sum(label.get_height() for label in labels) + 8
+        rect = pygame.Rect(0, 0, width, height)
+        surface.fill(self.OVERLAY_BACKGROUND, rect)
+        y = 4
+        for label in labels:
+            surface.blit(label, (4, y))
+            y += label.get_height()
+        return rect
+
+    def _repaint(self, surface, rect, alpha):
+        world = self.world
+        surface.set_clip(rect)
+        surface.fill(self.BACKGROUND, rect)
+        # Station names can run a couple of tiles past their station
+        spill = 2 * TILE_SIZE
+        area = (rect.x - spill, rect.y, rect.width + spill, rect.height)
+        # Everything in one Surface.blits call, in drawing order
+        blits = []
+        for station in world.visible_stations(area):
+            sprites = station.sprites(world.camera_offset, alpha)
+            blits.extend(sprites)
+            drawn = self._extent(station, sprites)
+            self._drawn[id(station)] = (station, station.render_key(alpha), drawn)
+        surface.blits(blits, False)
+        surface.set_clip(None)
+
+    def _extent(self, station, sprites):
+        # The rect its sprites cover, which labels can make wider than a tile
+        rect = station.screen_rect(self.world.camera_offset)
+        return rect.unionall(
+            [sprite.get_rect(topleft=position) for sprite, position in sprites]
+        )
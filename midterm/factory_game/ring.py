@@ -0,0 +1,49 @@
+class RingBuffer:
+    """Fixed-capacity FIFO backed by a preallocated list"""
+
+    __slots__ = ("slots", "capacity", "head", "size")
+
+    def __init__(self, capacity):
+        self.slots = [None] * capacity
+        self.capacity = capacity
+        self.head = 0
+        self.size = 0
+
+    def append(self, item):
+        if self.size == self.capacity:
+            return False
+        self.slots[(self.head + self.size) % self.capacity] = item
+        self.size += 1
+        return True
+
+    def popleft(self):
+        if not self.size:
+            return None
+        item = self.slots[self.head]
+        self.slots[self.head] = None
+        self.head = (self.head + 1) % self.capacity
+        self.size -= 1
+        return item
+
+    def peek(self):
+        return self.slots[self.head] if self.size else None
+
+    def free(self):
+        return self.capacity - self.size
+
+    def is_full(self):
+        return self.size == self.capacity
+
+    def clear(self):
+        while self.size:
+            self.popleft()
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self.slots[(self.head + i) % self.capacity]
+
+    def __repr__(self):
+        return f"RingBuffer({list(self)}, capacity={self.capacity})"
@@ -0,0 +1,85 @@
+import heapq
+from conveyor import Conveyor
+
+
+class EventScheduler:
+    """Next-event alternative to stepping every station every tick.
+
+    Stations are only stepped on ticks where they can do something: when
+    their own next_wake() comes due, or when a neighbour hands them work or
+    frees up space they were blocked on.
+    Ticks skipped in between are replayed in bulk with skip(), so the end
+    state is identical to calling World.step() once per tick.
+    """
+
+    def __init__(self, world):
+        self.world = world
+        self.stations = list(world.stations)
+        self.index = {id(station): i for i, station in enumerate(self.stations)}
+        self.listeners = self._build_listeners()
+
+    def _build_listeners(self):
+        # listeners[i] are the stations that may have new work after i steps.
+        # Every belt link goes both ways: items arriving wake the receiver,
+        # and space freed by taking items wakes a blocked sender.
+        listeners = [[] for _ in self.stations]
+
+        def link(a, b):
+            j = self.index.get(id(b))
+            if j is not None:
+                listeners[a].append(j)
+                listeners[j].append(a)
+
+        for i, station in enumerate(self.stations):
+            if not isinstance(station, Conveyor):
+                continue
+            for source in station.input_stations:
+                link(i, source)
+            if station.next_station is not None:
+                link(i, station.next_station)
+        return listeners
+
+    def run(self, ticks):
+        stations = self.stations
+        listeners = self.listeners
+        start = self.world.tick
+        end = start + ticks
+        never = float("inf")
+
+        last_step = [start - 1] * len(stations)
+        wake_at = [start] * len(stations)
+        # (tick, index) keeps stations in world order within a tick
+        heap = [(start, i) for i in range(len(stations))]
+        heapq.heapify(heap)
+
+        def schedule(i, tick):
+            if tick < wake_at[i]:
+                wake_at[i] = tick
+                heapq.heappush(heap, (tick, i))
+
+        while heap and heap[0][0] < end:
+            tick, i = heapq.heappop(heap)
+            if wake_at[i] != tick:
+                continue  # superseded by an earlier wake-up
+            wake_at[i] = never
+
+            station = stations[i]
+            idle = tick - last_step[i] - 1
+            if idle:
+                station.skip(idle)
+            station.step()
+            last_step[i] = tick
+
+            delay = station.next_wake()
+            if delay is not None:
+                schedule(i, tick + delay)
+            for j in listeners[i]:
+                # Later stations still get stepped this tick, earlier ones next
+                if stations[j].can_progress():
+                    schedule(j, tick if j > i else tick + 1)
+
+        for i, station in enumerate(stations):
+            idle = end - last_step[i] - 1
+            if idle:
+                station.skip(idle)
+        self.world.tick = end
@@ -0,0 +1,591 @@
+import gc
+import mmap
+import struct
+import sys
+from array import array
+from collections import deque
+from contextlib import contextmanager
+from station import Station
+from extractor import Extractor
+from crafter import Crafter
+from furnace import Furnace
+from assembler import Assembler
+from conveyor import Conveyor
+from core import Core
+from inventory import Inventory
+from item import Item
+from lane import Lane
+from recipes import Recipe, RecipeRegistry, default_registry
+from ring import RingBuffer
+
+MAGIC = b"FGSNAP"
+VERSION = 2
+
+# magic, version, tick, camera x, camera y, column count
+HEADER = struct.Struct("<6sHqqqI")
+# name length, typecode, item count; followed by the name and the data
+COLUMN = struct.Struct("<BcQ")
+
+STATION_TYPES = {
+    cls.__name__: cls
+    for cls in (Station, Extractor, Crafter, Furnace, Assembler, Conveyor, Core)
+}
+DIRECTIONS = ("east", "south", "west", "north")
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def save(world, path):
+    with open(path, "wb") as f:
+        f.write(dumps(world))
+
+
+def load(path, use_mmap=True):
+    """Read a snapshot, memory-mapping the file rather than reading it in"""
+    with open(path, "rb") as f:
+        if not use_mmap:
+            return loads(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            with memoryview(data) as view:
+                return loads(view)
+
+
+def dumps(world):
+    """Pack a World into a compact binary snapshot.
+
+    The snapshot is a header followed by named, typed columns (flat
+    arrays): one row per station for what every station has, and extra
+    columns per station type. Variable-length data (buffers, belt
+    contents, links) is stored flat with an end offset per row. Items,
+    names and recipes are stored once in tables and referred to by index.
+    Loading a snapshot repeatedly gives independent copies of the world,
+    e.g. to fork what-if runs from one checkpoint.
+    """
+    with _gc_paused():
+        return _Writer(world).pack()
+
+
+def loads(data):
+    with _gc_paused():
+        return _Reader(data).world()
+
+
+@contextmanager
+def _gc_paused():
+    # Packing and unpacking allocate a few objects per station and none of
+    # them are garbage, so don't let the cyclic collector keep rescanning
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class _Writer:
+    def __init__(self, world):
+        self.world = world
+        self.strings = {}
+        self.columns = {}
+
+    def string(self, text):
+        index = self.strings.get(text)
+        if index is None:
+            index = self.strings[text] = len(self.strings)
+        return index
+
+    def put(self, name, typecode, values):
+        self.columns[name] = array(typecode, values)
+
+    def pack(self):
+        world = self.world
+        stations = world.stations
+        string = self.string
+
+        self.put("items", "i", [string(item.name) for item in Item.by_id])
+        self.put("inventory", "q", _pairs(world.inventory))
+
+        types = {cls: k for k, cls in enumerate(dict.fromkeys(map(type, stations)))}
+        for cls in types:
+            if STATION_TYPES.get(cls.__name__) is not cls:
+                raise SnapshotError(f"can't snapshot a {cls.__name__}")
+        self.put("types", "i", [string(cls.__name__) for cls in types])
+        self.put("kind", "b", [types[type(station)] for station in stations])
+        self.put("name", "i", [string(station.name) for station in stations])
+        self.put("x", "q", [station.x for station in stations])
+        self.put("y", "q", [station.y for station in stations])
+        self.put("color", "B", [c for station in stations for c in station.color])
+        self.put("stalled", "q", [station.stalled_ticks for station in stations])
+        self.put("blocked", "b", [station.blocked for station in stations])
+        self.put("input_cap", "q", [station.input_capacity for station in stations])
+        self.put(
+            "output_cap", "q", [station.output_buffer.capacity for station in stations]
+        )
+
+        # Conveyor inputs are belt lanes, stored with the conveyors
+        inputs = []
+        inputs_end = []
+        outputs = []
+        outputs_end = []
+        for station in stations:
+            if type(station.inputs) is Inventory and station.inputs.total:
+                inputs.extend(_pairs(station.inputs))
+            inputs_end.append(len(inputs))
+            if station.output_buffer.size:
+                outputs.extend(item.id for item in station.output_buffer)
+            outputs_end.append(len(outputs))
+        self.put("inputs", "q", inputs)
+        self.put("inputs_end", "q", inputs_end)
+        self.put("outputs", "q", outputs)
+        self.put("outputs_end", "q", outputs_end)
+
+        def rows(cls):
+            return [i for i, station in enumerate(stations) if isinstance(station, cls)]
+
+        self._pack_extractors(rows(Extractor))
+        self._pack_crafters(rows(Crafter))
+        self._pack_conveyors(rows(Conveyor))
+
+        # The string table goes last, once everything has added to it
+        encoded = [text.encode("utf-8") for text in self.strings]
+        ends = []
+        total = 0
+        for text in encoded:
+            total += len(text)
+            ends.append(total)
+        self.put("string_ends", "q", ends)
+        self.columns["strings"] = array("B", b"".join(encoded))
+
+        out = [
+            HEADER.pack(
+                MAGIC,
+                VERSION,
+                world.tick,
+                world.camera_offset[0],
+                world.camera_offset[1],
+                len(self.columns),
+            )
+        ]
+        for column_name, values in self.columns.items():
+            name = column_name.encode("ascii")
+            out.append(COLUMN.pack(len(name), values.typecode.encode(), len(values)))
+            out.append(name)
+            if sys.byteorder == "big" and values.itemsize > 1:
+                values = array(values.typecode, values)
+                values.byteswap()
+            out.append(values.tobytes())
+        return b"".join(out)
+
+    def _pack_extractors(self, rows):
+        stations = self.world.stations
+        self.put("ext_station", "q", rows)
+        self.put("ext_resource", "i", [self.string(stations[i].resource) for i in rows])
+        self.put("ext_timer", "q", [stations[i].timer for i in rows])
+
+    def _pack_crafters(self, rows):
+        stations = self.world.stations
+        default = default_registry()
+        recipes = {}
+        recipe_key = []
+        recipe_machine = []
+        recipe_shared = []
+        recipe_in = []
+        recipe_in_end = []
+        recipe_out = []
+        recipe_out_end = []
+
+        def recipe_index(recipe):
+            k = recipes.get(id(recipe))
+            if k is None:
+                k = recipes[id(recipe)] = len(recipes)
+                recipe_key.append(self.string(recipe.key))
+                recipe_machine.append(self.string(recipe.machine or ""))
+                recipe_shared.append(default.by_key.get(recipe.key) is recipe)
+                for item_id, count in recipe.inputs:
+                    recipe_in.extend((item_id, count))
+                recipe_in_end.append(len(recipe_in))
+                for item, count in recipe.outputs:
+                    recipe_out.extend((item.id, count))
+                recipe_out_end.append(len(recipe_out))
+            return k
+
+        registries = {}
+        registry_recipes = []
+        registry_end = []
+        registry_shared = []
+        crafter_registry = []
+        ready = []
+        ready_end = []
+        for i in rows:
+            station = stations[i]
+            registry = station.recipes
+            k = registries.get(id(registry))
+            if k is None:
+                k = registries[id(registry)] = len(registries)
+                registry_recipes.extend(recipe_index(r) for r in registry)
+                registry_end.append(len(registry_recipes))
+                machines = {recipe.machine for recipe in registry}
+                registry_shared.append(
+                    len(machines) == 1
+                    and default.for_machine(machines.pop()) is registry
+                )
+            crafter_registry.append(k)
+            if station.ready:
+                ready.extend(recipe_index(recipe) for recipe in station.ready)
+            ready_end.append(len(ready))
+
+        self.put("recipe_key", "i", recipe_key)
+        self.put("recipe_machine", "i", recipe_machine)
+        self.put("recipe_shared", "b", recipe_shared)
+        self.put("recipe_in", "q", recipe_in)
+        self.put("recipe_in_end", "q", recipe_in_end)
+        self.put("recipe_out", "q", recipe_out)
+        self.put("recipe_out_end", "q", recipe_out_end)
+        self.put("registry_recipes", "q", registry_recipes)
+        self.put("registry_end", "q", registry_end)
+        self.put("registry_shared", "b", registry_shared)
+        self.put("crafter_station", "q", rows)
+        self.put("crafter_registry", "q", crafter_registry)
+        self.put("ready", "q", ready)
+        self.put("ready_end", "q", ready_end)
+
+    def _pack_conveyors(self, rows):
+        stations = self.world.stations
+        index = {id(station): i for i, station in enumerate(stations)}
+        conveyors = [stations[i] for i in rows]
+        self.put("conveyor_station", "q", rows)
+        self.put(
+            "conveyor_next",
+            "q",
+            [index.get(id(conveyor.next_station), -1) for conveyor in conveyors],
+        )
+        sources = []
+        sources_end = []
+        for conveyor in conveyors:
+            sources.extend(
+                index[id(source)]
+                for source in conveyor.input_stations
+                if id(source) in index
+            )
+            sources_end.append(len(sources))
+        self.put("conveyor_sources", "q", sources)
+        self.put("conveyor_sources_end", "q", sources_end)
+        self.put(
+            "conveyor_direction",
+            "b",
+            [
+                DIRECTIONS.index(conveyor.direction) if conveyor.direction else -1
+                for conveyor in conveyors
+            ],
+        )
+        self.put(
+            "conveyor_received", "b", [conveyor._received for conveyor in conveyors]
+        )
+        self.put("conveyor_moved", "q", [conveyor.moved for conveyor in conveyors])
+
+        # length, spacing, slack, entry, moving per lane, then its items
+        lanes = [conveyor.inputs for conveyor in conveyors]
+        self.put(
+            "lane_state",
+            "q",
+            [
+                value
+                for lane in lanes
+                for value in (
+                    lane.length,
+                    lane.spacing,
+                    lane.slack,
+                    lane.entry,
+                    lane.moving,
+                )
+            ],
+        )
+        items = []
+        gaps = []
+        ends = []
+        for lane in lanes:
+            if lane.items:
+                items.extend(item.id for item in lane.items)
+                gaps.extend(lane.gaps)
+            ends.append(len(items))
+        self.put("lane_items", "q", items)
+        self.put("lane_gaps", "q", gaps)
+        self.put("lane_end", "q", ends)
+
+
+def _pairs(inventory):
+    # Flat (item id, count) pairs of the non-zero counts
+    return [
+        value
+        for item_id, count in enumerate(inventory.counts)
+        if count
+        for value in (item_id, count)
+    ]
+
+
+class _Reader:
+    def __init__(self, data):
+        data = memoryview(data)
+        if len(data) < HEADER.size:
+            raise SnapshotError("not a snapshot: too short")
+        magic, version, tick, camera_x, camera_y, count = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise SnapshotError("not a snapshot")
+        if version != VERSION:
+            raise SnapshotError(f"unsupported snapshot version {version}")
+        self.tick = tick
+        self.camera_offset = [camera_x, camera_y]
+
+        self.columns = {}
+        offset = HEADER.size
+        for _ in range(count):
+            name_length, typecode, length = COLUMN.unpack_from(data, offset)
+            offset += COLUMN.size
+            name = bytes(data[offset : offset + name_length]).decode("ascii")
+            offset += name_length
+            values = array(typecode.decode())
+            size = length * values.itemsize
+            values.frombytes(data[offset : offset + size])
+            if sys.byteorder == "big" and values.itemsize > 1:
+                values.byteswap()
+            offset += size
+            self.columns[name] = values
+
+        blob = self.columns["strings"].tobytes()
+        self.strings = []
+        start = 0
+        for end in self.columns["string_ends"]:
+            self.strings.append(blob[start:end].decode("utf-8"))
+            start = end
+        # Item ids in this process can differ from the ones saved
+        self.item_ids = [Item(self.strings[i]).id for i in self.columns["items"]]
+
+    def inventory(self, pairs, start, end):
+        inventory = Inventory()
+        item_ids = self.item_ids
+        for k in range(start, end, 2):
+            inventory.add(item_ids[pairs[k]], pairs[k + 1])
+        return inventory
+
+    def world(self):
+        from world import World
+
+        c = self.columns
+        strings = self.strings
+        items = [Item.by_id[item_id] for item_id in self.item_ids]
+
+        world = World()
+        world.tick = self.tick
+        world.camera_offset = self.camera_offset
+        world.inventory = self.inventory(c["inventory"], 0, len(c["inventory"]))
+
+        # Stations are built without calling their __init__, from columns
+        # turned into lists up front, since indexing an array makes a new
+        # int every time
+        types = [STATION_TYPES[strings[i]] for i in c["types"]]
+        kinds = c["kind"].tolist()
+        color = c["color"]
+        rows = zip(
+            [types[kind] for kind in kinds],
+            [strings[i] for i in c["name"]],
+            self._inputs(types, kinds),
+            c["input_cap"].tolist(),
+            self._outputs(items),
+            c["x"].tolist(),
+            c["y"].tolist(),
+            zip(color[0::3].tolist(), color[1::3].tolist(), color[2::3].tolist()),
+            [bool(blocked) for blocked in c["blocked"].tolist()],
+            c["stalled"].tolist(),
+        )
+        new = object.__new__
+        stations = []
+        append = stations.append
+        for cls, name, inputs, cap, buffer, x, y, rgb, blocked, stalled in rows:
+            # Set in the order Station.__init__ sets them, so the stations
+            # share their attribute layout with ones built the usual way
+            station = new(cls)
+            station.name = name
+            station.inputs = inputs
+            station.input_capacity = cap
+            station.output_buffer = buffer
+            station.x = x
+            station.y = y
+            station.color = rgb
+            station.blocked = blocked
+            station.stalled_ticks = stalled
+            append(station)
+        for station in stations:
+            if type(station) is Core:
+                station.inventory = world.inventory
+
+        for i, resource, timer in zip(
+            c["ext_station"].tolist(),
+            c["ext_resource"].tolist(),
+            c["ext_timer"].tolist(),
+        ):
+            station = stations[i]
+            station.resource = strings[resource]
+            station.timer = timer
+
+        self._load_crafters(stations)
+        self._load_conveyors(stations, items)
+
+        world.stations = stations
+        world.grid.extend(stations)
+        return world
+
+    def _inputs(self, types, kinds):
+        # An Inventory per station, or None for a conveyor, whose lane is
+        # loaded with the rest of it
+        pairs = self.columns["inputs"].tolist()
+        is_conveyor = [cls is Conveyor for cls in types]
+        new = object.__new__
+        inventories = []
+        start = 0
+        for kind, end in zip(kinds, self.columns["inputs_end"].tolist()):
+            if end > start:
+                inventory = self.inventory(pairs, start, end)
+                start = end
+            elif is_conveyor[kind]:
+                inventory = None
+            else:
+                inventory = new(Inventory)
+                inventory.counts = []
+                inventory.total = 0
+            inventories.append(inventory)
+        return inventories
+
+    def _outputs(self, items):
+        # Each station's output buffer, filled from the front
+        c = self.columns
+        outputs = [items[k] for k in c["outputs"]]
+        new = object.__new__
+        buffers = []
+        start = 0
+        for cap, end in zip(c["output_cap"].tolist(), c["outputs_end"].tolist()):
+            buffer = new(RingBuffer)
+            if end > start:
+                slots = outputs[start:end]
+                slots.extend([None] * (cap - len(slots)))
+                buffer.slots = slots
+                buffer.size = end - start
+                start = end
+            else:
+                buffer.slots = [None] * cap
+                buffer.size = 0
+            buffer.capacity = cap
+            buffer.head = 0
+            buffers.append(buffer)
+        return buffers
+
+    def _load_crafters(self, stations):
+        c = self.columns
+        strings = self.strings
+        item_ids = self.item_ids
+        shared = default_registry()
+
+        recipes = []
+        in_start = out_start = 0
+        for k, key in enumerate(c["recipe_key"]):
+            key = strings[key]
+            in_end = c["recipe_in_end"][k]
+            out_end = c["recipe_out_end"][k]
+            if c["recipe_shared"][k] and key in shared.by_key:
+                recipe = shared[key]
+            else:
+                pairs_in = c["recipe_in"]
+                pairs_out = c["recipe_out"]
+                recipe = Recipe(
+                    key,
+                    strings[c["recipe_machine"][k]] or None,
+                    {
+                        Item.by_id[item_ids[pairs_in[j]]].name: pairs_in[j + 1]
+                        for j in range(in_start, in_end, 2)
+                    },
+                    {
+                        Item.by_id[item_ids[pairs_out[j]]].name: pairs_out[j + 1]
+                        for j in range(out_start, out_end, 2)
+                    },
+                )
+            in_start, out_start = in_end, out_end
+            recipes.append(recipe)
+
+        # Crafters that shared a registry share it again, and the default
+        # per-machine registries are reused as they are
+        registries = []
+        start = 0
+        for end, is_shared in zip(c["registry_end"], c["registry_shared"]):
+            members = [recipes[k] for k in c["registry_recipes"][start:end]]
+            start = end
+            registry = None
+            if is_shared:
+                registry = shared.for_machine(members[0].machine)
+                if list(registry) != members:
+                    registry = None
+            registries.append(registry or RecipeRegistry(members))
+
+        ready = [recipes[k] for k in c["ready"]]
+        start = 0
+        for i, registry, end in zip(
+            c["crafter_station"].tolist(),
+            c["crafter_registry"].tolist(),
+            c["ready_end"].tolist(),
+        ):
+            station = stations[i]
+            station.recipes = registries[registry]
+            if end > start:
+                station.ready = deque(ready[start:end])
+                station._queued = {recipe.key for recipe in station.ready}
+                start = end
+            else:
+                station.ready = deque()
+                station._queued = set()
+
+    def _load_conveyors(self, stations, items):
+        c = self.columns
+        sources = [stations[j] for j in c["conveyor_sources"]]
+        lane_state = c["lane_state"]
+        lane_items = [items[j] for j in c["lane_items"]]
+        lane_gaps = c["lane_gaps"].tolist()
+        directions = DIRECTIONS + (None,)  # -1 for none
+        new = object.__new__
+        sources_start = lane_start = 0
+        rows = zip(
+            c["conveyor_station"].tolist(),
+            c["conveyor_next"].tolist(),
+            c["conveyor_sources_end"].tolist(),
+            c["conveyor_direction"].tolist(),
+            c["conveyor_received"].tolist(),
+            c["conveyor_moved"].tolist(),
+            c["lane_end"].tolist(),
+            # length, spacing, slack, entry, moving
+            *(lane_state[k::5].tolist() for k in range(5)),
+        )
+        for row in rows:
+            i, target, sources_end, direction, received, moved, lane_end = row[:7]
+            length, spacing, slack, entry, moving = row[7:]
+            station = stations[i]
+            station.next_station = stations[target] if target >= 0 else None
+            station.input_stations = sources[sources_start:sources_end]
+            sources_start = sources_end
+            station.direction = directions[direction]
+            station._received = bool(received)
+            station.moved = moved
+
+            # An empty lane is saved in the state Lane() starts in
+            lane = station.inputs = new(Lane)
+            lane.length = length
+            lane.spacing = spacing
+            lane.slack = slack
+            lane.entry = entry
+            lane.moving = moving
+            if lane_end > lane_start:
+                lane.items = deque(lane_items[lane_start:lane_end])
+                lane.gaps = deque(lane_gaps[lane_start:lane_end])
+            else:
+                lane.items = deque()
+                lane.gaps = deque()
+            lane_start = lane_end
@@ -0,0 +1,78 @@
+class SpatialGrid:
+    """Hash grid from tile coordinates to the station on that tile.
+
+    Tiles live in a dict for O(1) lookups. Stations are also bucketed into
+    CHUNK x CHUNK chunks, so a rectangle query only visits the chunks it
+    overlaps rather than every station or every tile.
+    """
+
+    CHUNK = 16
+    NEIGHBOR_OFFSETS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+
+    def __init__(self):
+        self.tiles = {}
+        self.chunks = {}
+
+    def _chunk_key(self, x, y):
+        return (x // self.CHUNK, y // self.CHUNK)
+
+    def add(self, station):
+        key = (station.x, station.y)
+        if key in self.tiles:
+            taken = self.tiles[key]
+            raise ValueError(f"tile {key} is already taken by a {type(taken).__name__}")
+        self.tiles[key] = station
+        self.chunks.setdefault(self._chunk_key(*key), []).append(station)
+
+    def extend(self, stations):
+        """add() every one of `stations`, in one pass"""
+        stations = list(stations)
+        keys = [(station.x, station.y) for station in stations]
+        added = dict(zip(keys, stations))
+        if len(added) < len(stations) or not self.tiles.keys().isdisjoint(added):
+            for station in stations:
+                self.add(station)  # raises at the first tile that's taken
+        self.tiles.update(added)
+        size = self.CHUNK
+        setdefault = self.chunks.setdefault
+        for (x, y), station in zip(keys, stations):
+            setdefault((x // size, y // size), []).append(station)
+
+    def remove(self, station):
+        key = (station.x, station.y)
+        if self.tiles.get(key) is not station:
+            raise KeyError(key)
+        del self.tiles[key]
+        chunk_key = self._chunk_key(*key)
+        chunk = self.chunks[chunk_key]
+        chunk.remove(station)
+        if not chunk:
+            del self.chunks[chunk_key]
+
+    def at(self, x, y):
+        return self.tiles.get((x, y))
+
+    def neighbors(self, x, y):
+        """Stations on the four tiles next to (x, y)"""
+        found = []
+        for dx, dy in self.NEIGHBOR_OFFSETS:
+            station = self.tiles.get((x + dx, y + dy))
+            if station is not None:
+                found.append(station)
+        return found
+
+    def query(self, x0, y0, x1, y1):
+        """Stations on tiles x0 <= x <= x1 and y0 <= y <= y1"""
+        cx0, cy0 = self._chunk_key(x0, y0)
+        cx1, cy1 = self._chunk_key(x1, y1)
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                for station in self.chunks.get((cx, cy), ()):
+                    if x0 <= station.x <= x1 and y0 <= station.y <= y1:
+                        yield station
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def __contains__(self, key):
+        return key in self.tiles
@@ -0,0 +1,63 @@
+class SpriteCache:
+    """Pre-rendered surfaces for the shapes every frame draws many times.
+
+    A station's tile looks the same for every station of its colour and
+    an item's icon the same for every item of its type, so each is drawn
+    once with pygame.draw and from then on only blitted, which
+    Surface.blits does for a whole screen of them in one call. There are
+    only a few colours and item types, so nothing is ever evicted.
+    """
+
+    def __init__(self):
+        self.tiles = {}
+        self.frames = {}
+        self.icons = {}
+
+    def tile(self, color, size, border=2, border_color=(0, 0, 0)):
+        """A size x size square of `color` with a `border` pixels wide border"""
+        key = (tuple(color), size, border, tuple(border_color))
+        surface = self.tiles.get(key)
+        if surface is None:
+            import pygame
+
+            surface = self.tiles[key] = pygame.Surface((size, size))
+            surface.fill(color)
+            if border:
+                pygame.draw.rect(surface, border_color, surface.get_rect(), border)
+        return surface
+
+    def frame(self, color, size, border):
+        """Just the border of a size x size square, transparent inside"""
+        key = (tuple(color), size, border)
+        surface = self.frames.get(key)
+        if surface is None:
+            import pygame
+
+            surface = self.frames[key] = pygame.Surface((size, size))
+            transparent = (0, 0, 0) if tuple(color) == (255, 0, 255) else (255, 0, 255)
+            surface.fill(transparent)
+            pygame.draw.rect(surface, color, surface.get_rect(), border)
+            surface.set_colorkey(transparent, pygame.RLEACCEL)
+        return surface
+
+    def icon(self, color, radius):
+        """A filled circle of `radius` on a transparent square, centred on
+        pixel (radius + 1, radius + 1)"""
+        key = (tuple(color), radius)
+        surface = self.icons.get(key)
+        if surface is None:
+            import pygame
+
+            # Transparent by colour key rather than per-pixel alpha: the
+            # edge is hard anyway, and run-length encoded colour key blits
+            # are about twice as fast as drawing the circle
+            size = 2 * radius + 3
+            surface = self.icons[key] = pygame.Surface((size, size))
+            transparent = (0, 0, 0) if tuple(color) == (255, 0, 255) else (255, 0, 255)
+            surface.fill(transparent)
+            pygame.draw.circle(surface, color, (radius + 1, radius + 1), radius)
+            surface.set_colorkey(transparent, pygame.RLEACCEL)
+        return surface
+
+
+sprite_cache = SpriteCache()
@@ -1,19 +1,37 @@
-from collections import deque
-import pygame
-from item import Item
+from inventory import Inventory
+from ring import RingBuffer
+from sprites import sprite_cache
+from text import text_cache
+
+TILE_SIZE = 40
 
 
 class Station:
+    # Inputs are capped per item type so a surplus of one ingredient can't
+    # starve a recipe of the others; outputs are a fixed-size FIFO
+    INPUT_CAPACITY = 8
+    OUTPUT_CAPACITY = 8
+
     def __init__(self, name, x, y):
         self.name = name
-        self.inputs = []
-        self.output_buffer = deque()
+        self.inputs = Inventory()
+        self.input_capacity = self.INPUT_CAPACITY
+        self.output_buffer = RingBuffer(self.OUTPUT_CAPACITY)
         self.x = x
         self.y = y
         self.color = (180, 180, 180)
+        # Set when the next step can't make progress because a buffer
+        # downstream is full; stalled_ticks counts every such tick
+        self.blocked = False
+        self.stalled_ticks = 0
+
+    def can_insert(self, item):
+        return self.inputs.count(item.id) < self.input_capacity
 
     def insert_item(self, item):
-        self.inputs.append(item)
+        if not self.can_insert(item):
+            return False
+        self.inputs.add(item.id)
         return True
 
     def output_item(self):
@@ -24,41 +42,82 @@ class Station:
     def step(self):
         pass
 
-    def draw(self, surface, camera_offset):
-        rect = pygame.Rect(
-            self.x * 40 - camera_offset[0], self.y * 40 - camera_offset[1], 40, 40
+    # Used by the event scheduler: ticks until this station next has work to
+    # do on its own, or None if it is idle until something else wakes it
+    def next_wake(self):
+        return None
+
+    # Whether a neighbour's change (an item arriving, space freeing up) has
+    # given this station work that its own next_wake() didn't plan for
+    def can_progress(self):
+        return False
+
+    # Fast-forward over ticks on which step() would have been a no-op
+    def skip(self, ticks):
+        if self.blocked:
+            self.stalled_ticks += ticks
+
+    def screen_rect(self, camera_offset):
+        import pygame
+
+        return pygame.Rect(
+            self.x * TILE_SIZE - camera_offset[0],
+            self.y * TILE_SIZE - camera_offset[1],
+            TILE_SIZE,
+            TILE_SIZE,
         )
-        pygame.draw.rect(surface, self.color, rect)
-        pygame.draw.rect(surface, (0, 0, 0), rect, 2)
-
-        font = pygame.font.SysFont(None, 16)
-        name_surface = font.render(self.name, True, (255, 255, 255))
-        surface.blit(name_surface, (rect.x + 2, rect.y + 2))
-
-        mouse_x, mouse_y = pygame.mouse.get_pos()
-        if rect.collidepoint(mouse_x, mouse_y):
-            tooltip_lines = (
-                ["In:"]
-                + [item.name for item in self.inputs]
-                + ["Out:"]
-                + [item.name for item in self.output_buffer]
-            )
-            tooltip_surfaces = [
-                font.render(line, True, (255, 255, 255)) for line in tooltip_lines
-            ]
-            max_width = max(surf.get_width() for surf in tooltip_surfaces)
-            tooltip_rect = pygame.Rect(
-                mouse_x + 10,
-                mouse_y + 10,
-                max_width + 8,
-                8 + 16 * len(tooltip_surfaces),
-            )
-            pygame.draw.rect(surface, (0, 0, 0), tooltip_rect)
-            pygame.draw.rect(surface, (255, 255, 255), tooltip_rect, 1)
-            for i, surf in enumerate(tooltip_surfaces):
-                surface.blit(surf, (tooltip_rect.x + 4, tooltip_rect.y + 4 + i * 16))
-
-            for i, item in enumerate(self.inputs):
-                item.draw_icon(surface, rect.x + 10 + i * 14, rect.y + 30)
-            for i, item in enumerate(self.output_buffer):
-                item.draw_icon(surface, rect.x + 10 + i * 14, rect.y + 40)
+
+    # Anything draw() shows that can change; the renderer only redraws a
+    # station when this changes. alpha is how far the simulation is into
+    # the next tick, for stations that draw moving things in between.
+    def render_key(self, alpha=0.0):
+        return (self.name, self.color)
+
+    def sprites(self, camera_offset, alpha=0.0):
+        """What draw() shows, as (surface, position) pairs for
+        Surface.blits, so a renderer can draw many stations in one call"""
+        x = self.x * TILE_SIZE - camera_offset[0]
+        y = self.y * TILE_SIZE - camera_offset[1]
+        return [
+            (sprite_cache.tile(self.color, TILE_SIZE), (x, y)),
+            (text_cache.render(self.name, (255, 255, 255)), (x + 2, y + 2)),
+        ]
+
+    def draw(self, surface, camera_offset, alpha=0.0):
+        surface.blits(self.sprites(camera_offset, alpha), False)
+
+    def draw_tooltip(self, surface, camera_offset, mouse_pos):
+        import pygame
+
+        rect = self.screen_rect(camera_offset)
+        mouse_x, mouse_y = mouse_pos
+        tooltip_lines = (
+            ["In:"]
+            + [item.name for item in self.inputs]
+            + ["Out:"]
+            + [item.name for item in self.output_buffer]
+        )
+        tooltip_surfaces = [
+            text_cache.render(line, (255, 255, 255)) for line in tooltip_lines
+        ]
+        max_width = max(surf.get_width() for surf in tooltip_surfaces)
+        tooltip_rect = pygame.Rect(
+            mouse_x + 10,
+            mouse_y + 10,
+            max_width + 8,
+            8 + 16 * len(tooltip_surfaces),
+        )
+        pygame.draw.rect(surface, (0, 0, 0), tooltip_rect)
+        pygame.draw.rect(surface, (255, 255, 255), tooltip_rect, 1)
+        for i, surf in enumerate(tooltip_surfaces):
+            surface.blit(surf, (tooltip_rect.x + 4, tooltip_rect.y + 4 + i * 16))
+
+        for i, item in enumerate(self.inputs):
+            item.draw_icon(surface, rect.x + 10 + i * 14, rect.y + 30)
+        for i, item in enumerate(self.output_buffer):
+            item.draw_icon(surface, rect.x + 10 + i * 14, rect.y + 40)
+
+        # Everything this drew on, so it can be erased again
+        icon_count = max(len(self.inputs), len(self.output_buffer), 1)
+        icons_rect = pygame.Rect(rect.x, rect.y + 24, 18 + icon_count * 14, 24)
+        return tooltip_rect.union(icons_rect)
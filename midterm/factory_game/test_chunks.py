@@ -0,0 +1,41 @@
+import pytest
+
+from chunks import ChunkManager
+from conveyor import Conveyor
+from core import Core
+from station import TILE_SIZE
+from test_snapshot import chains
+
+
+def products(world):
+    return {item.name: count for item, count in world.inventory.items()}
+
+
+@pytest.mark.parametrize("length", [1, 20])
+@pytest.mark.parametrize("pan", [False, True])
+def test_chunked_run_is_within_an_item_per_belt_of_a_full_run(length, pan):
+    # 16 chains to a chunk: with no chunks kept around the view, the
+    # second 16 go out once they have settled
+    ticks = 2000
+    full = chains(32, length)
+    full.run(ticks)
+    world = chains(32, length)
+    world.chunks = ChunkManager(world, radius=0)
+    if pan:
+        # Bring the far chunks back halfway and let the near ones go out
+        world.run(ticks // 2)
+        assert len(world.stations) < len(full.stations)
+        world.camera_offset = [0, ChunkManager.SIZE * TILE_SIZE]
+        world.run(ticks - ticks // 2)
+    else:
+        world.run(ticks)
+    assert len(world.stations) < len(full.stations)
+
+    belts = sum(
+        isinstance(station, Conveyor) and isinstance(station.next_station, Core)
+        for station in full.stations
+    )
+    expected, got = products(full), products(world)
+    assert expected
+    for item in set(expected) | set(got):
+        assert abs(got.get(item, 0) - expected.get(item, 0)) <= belts
@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+from world import World
+from extractor import Extractor
+from furnace import Furnace
+from assembler import Assembler
+from conveyor import Conveyor
+from core import Core
+from columnar import ColumnarWorld
+
+ORES = ("Iron Ore", "Copper Ore")
+
+
+def chains(n):
+    """n iron/copper extractor -> furnace -> assembler -> core chains"""
+    world = World()
+    for i in range(n):
+        y = 2 * i
+        iron = Extractor(f"Iron{i}", 0, y, "Iron Ore")
+        copper = Extractor(f"Copper{i}", 0, y + 1, "Copper Ore")
+        iron_furnace = Furnace(f"IronFurnace{i}", 2, y)
+        copper_furnace = Furnace(f"CopperFurnace{i}", 2, y + 1)
+        assembler = Assembler(f"Assembler{i}", 4, y, recipe="PRODUCT")
+        core = Core(f"Core{i}", 6, y, world.inventory)
+        for station in (iron, copper, iron_furnace, copper_furnace, assembler, core):
+            world.add_station(station)
+        for x, y, sources, target in (
+            (1, y, [iron], iron_furnace),
+            (1, y + 1, [copper], copper_furnace),
+            (3, y, [iron_furnace], assembler),
+            (3, y + 1, [copper_furnace], assembler),
+            (5, y, [assembler], core),
+        ):
+            world.add_station(Conveyor("", x, y, sources, target))
+    return world
+
+
+def fan_in(n):
+    """n extractors of both ores all feeding one belt into one furnace"""
+    world = World()
+    extractors = [Extractor(f"Ore{i}", i, 0, ORES[i % 2]) for i in range(n)]
+    furnace = Furnace("Furnace", 0, 2)
+    core = Core("Core", 0, 4, world.inventory)
+    for station in extractors + [furnace, core]:
+        world.add_station(station)
+    world.add_station(Conveyor("", 0, 1, extractors, furnace))
+    world.add_station(Conveyor("", 0, 3, [furnace], core))
+    return world
+
+
+def fan_out(n):
+    """One extractor feeding n belts, each into a furnace of its own"""
+    world = World()
+    extractor = Extractor("Ore", 0, 0, "Iron Ore")
+    core = Core("Core", 0, 4, world.inventory)
+    world.add_station(extractor)
+    world.add_station(core)
+    for i in range(n):
+        furnace = Furnace(f"Furnace{i}", i, 2)
+        world.add_station(furnace)
+        world.add_station(Conveyor("", i, 1, [extractor], furnace))
+        world.add_station(Conveyor("", i, 3, [furnace], core))
+    return world
+
+
+def step_conveyors_one_at_a_time(c):
+    """ColumnarWorld._step_conveyors, handing items over one edge and then
+    one belt at a time"""
+    for belt, source in zip(c.edge_belt, c.edge_source):
+        row = c.belt_rows[belt]
+        held = np.flatnonzero(c.outputs[source])
+        if len(held) and c.inputs[row].sum() < c.total_cap[row]:
+            c.outputs[source, held[0]] -= 1
+            c.inputs[row, held[0]] += 1
+    for row, target in zip(c.belt_rows, c.belt_target):
+        held = np.flatnonzero(c.inputs[row])
+        if not len(held):
+            continue
+        item = held[0]
+        if target < 0:
+            c.inputs[row, item] -= 1
+        elif (
+            c.inputs[target, item] < c.input_cap[target]
+            and c.inputs[target].sum() < c.total_cap[target]
+        ):
+            c.inputs[row, item] -= 1
+            c.inputs[target, item] += 1
+        else:
+            c.stalled[row] += 1
+
+
+@pytest.mark.parametrize("build, n", [(fan_in, 3), (fan_in, 40), (fan_out, 5)])
+def test_conveyors_match_one_at_a_time(build, n):
+    vectorised = ColumnarWorld(build(n))
+    reference = ColumnarWorld(build(n))
+    for _ in range(600):
+        vectorised.step()
+        reference._step_extractors()
+        reference._step_crafters()
+        step_conveyors_one_at_a_time(reference)
+        reference.tick += 1
+        assert np.array_equal(vectorised.inputs, reference.inputs)
+        assert np.array_equal(vectorised.outputs, reference.outputs)
+        assert np.array_equal(vectorised.stalled, reference.stalled)
+
+
+@pytest.mark.parametrize("ticks", [500, 2000, 5000])
+def test_chains_keep_up_with_world(ticks):
+    # Columnar belts have no travel time, so each chain may be at most one
+    # product ahead of the World it was built from
+    world = chains(4)
+    columnar = ColumnarWorld(chains(4))
+    world.run(ticks)
+    columnar.run(ticks)
+    ahead = columnar.inventory.total - world.inventory.total
+    assert world.inventory.total > 0
+    assert 0 <= ahead <= 4
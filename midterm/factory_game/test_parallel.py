@@ -0,0 +1,41 @@
+import pytest
+
+from core import Core
+from parallel import ParallelRunner
+from snapshot import dumps
+from test_snapshot import chains, mixed
+
+
+def test_chains_are_separate_components():
+    world = chains(6, length=2)
+    components = ParallelRunner(world, 2).components
+    assert len(components) == 6
+    assert sorted(i for component in components for i in component) == [
+        i for i, station in enumerate(world.stations) if not isinstance(station, Core)
+    ]
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+@pytest.mark.parametrize("build", [lambda: chains(8, length=3), mixed])
+def test_parallel_run_matches_serial(build, workers):
+    serial, parallel = build(), build()
+    for ticks in (300, 700):
+        serial.run(ticks)
+        parallel.run(ticks, workers=workers)
+    assert parallel.tick == serial.tick
+    assert parallel.inventory.counts == serial.inventory.counts
+    assert dumps(parallel) == dumps(serial)
+
+
+def test_parallel_event_driven_run_matches_serial():
+    serial, parallel = chains(8, length=3), chains(8, length=3)
+    serial.run(1000)
+    parallel.run(1000, event_driven=True, workers=2)
+    assert dumps(parallel) == dumps(serial)
+
+
+def test_parallel_runs_cannot_be_profiled():
+    world = chains(2)
+    world.profiler = object()
+    with pytest.raises(ValueError):
+        world.run(10, workers=2)
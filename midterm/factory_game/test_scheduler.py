@@ -0,0 +1,25 @@
+import pytest
+
+from snapshot import dumps
+from test_snapshot import chains, mixed
+
+
+@pytest.mark.parametrize(
+    "build", [lambda: chains(1), lambda: chains(8, length=3), mixed]
+)
+def test_event_driven_run_matches_serial(build):
+    serial, scheduled = build(), build()
+    for ticks in (1, 299, 700):
+        serial.run(ticks)
+        scheduled.run(ticks, event_driven=True)
+    assert scheduled.tick == serial.tick
+    assert scheduled.inventory.counts == serial.inventory.counts
+    assert dumps(scheduled) == dumps(serial)
+
+
+def test_event_driven_run_continues_serially():
+    serial, resumed = chains(4, length=2), chains(4, length=2)
+    serial.run(1000)
+    resumed.run(400, event_driven=True)
+    resumed.run(600)
+    assert dumps(resumed) == dumps(serial)
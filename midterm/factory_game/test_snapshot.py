@@ -0,0 +1,100 @@
+import pytest
+
+from world import World
+from station import Station
+from extractor import Extractor
+from furnace import Furnace
+from assembler import Assembler
+from conveyor import Conveyor
+from core import Core
+from snapshot import SnapshotError, dumps, loads
+
+
+def chains(n, length=1):
+    """n iron/copper extractor -> furnace -> assembler -> core chains"""
+    world = World()
+    for i in range(n):
+        y = 2 * i
+        iron = Extractor(f"Iron{i}", 0, y, "Iron Ore")
+        copper = Extractor(f"Copper{i}", 0, y + 1, "Copper Ore")
+        iron_furnace = Furnace(f"IronFurnace{i}", 2, y)
+        copper_furnace = Furnace(f"CopperFurnace{i}", 2, y + 1)
+        assembler = Assembler(f"Assembler{i}", 4, y, recipe="PRODUCT")
+        core = Core(f"Core{i}", 6, y, world.inventory)
+        for station in (iron, copper, iron_furnace, copper_furnace, assembler, core):
+            world.add_station(station)
+        for x, y, sources, target in (
+            (1, y, [iron], iron_furnace),
+            (1, y + 1, [copper], copper_furnace),
+            (3, y, [iron_furnace], assembler),
+            (3, y + 1, [copper_furnace], assembler),
+            (5, y, [assembler], core),
+        ):
+            world.add_station(Conveyor("", x, y, sources, target, length))
+    return world
+
+
+def mixed():
+    """Placed conveyors, a plain Station and a belt with nowhere to go"""
+    world = chains(3, length=4)
+    world.add_station(Extractor("Ore", 20, 0, "Iron Ore"))
+    world.add_conveyor("Belt", 21, 0, "east")
+    world.add_station(Furnace("Furnace", 22, 0))
+    world.add_station(Station("Crate", 20, 2))
+    world.add_station(Conveyor("Spill", 20, 3, [world.station_at(20, 0)]))
+    return world
+
+
+@pytest.mark.parametrize("build", [lambda: chains(20, length=3), mixed])
+def test_round_trip(build):
+    world = build()
+    world.run(400)
+    data = dumps(world)
+    copy = loads(data)
+    assert dumps(copy) == data
+    assert copy.tick == world.tick
+    assert copy.inventory.counts == world.inventory.counts
+    for station, loaded in zip(world.stations, copy.stations):
+        assert type(loaded) is type(station)
+        assert copy.station_at(station.x, station.y) is loaded
+        assert list(loaded.output_buffer) == list(station.output_buffer)
+    assert len(copy.grid) == len(world.grid)
+    assert sorted(id(s) for s in copy.grid.query(0, 0, 6, 5)) == sorted(
+        id(copy.station_at(s.x, s.y)) for s in world.grid.query(0, 0, 6, 5)
+    )
+
+
+@pytest.mark.parametrize("build", [lambda: chains(20, length=3), mixed])
+def test_loaded_world_runs_the_same(build):
+    world = build()
+    world.run(400)
+    copy = loads(dumps(world))
+    world.run(600)
+    copy.run(600)
+    assert dumps(copy) == dumps(world)
+
+
+def test_loads_are_independent():
+    world = chains(2)
+    world.run(200)
+    data = dumps(world)
+    first, second = loads(data), loads(data)
+    first.run(300)
+    assert dumps(second) == data
+    assert first.stations[0].output_buffer is not second.stations[0].output_buffer
+
+
+def test_sources_outside_the_world_are_left_out():
+    world = chains(1)
+    stray = Extractor("Stray", 9, 9, "Iron Ore")
+    belt = world.stations[6]
+    belt.input_stations.append(stray)
+    copy = loads(dumps(world))
+    assert [s.name for s in copy.stations[6].input_stations] == ["Iron0"]
+
+
+def test_rejects_other_data():
+    with pytest.raises(SnapshotError):
+        loads(b"not a snapshot at all, just some bytes")
+    with pytest.raises(SnapshotError):
+        loads(b"FG")
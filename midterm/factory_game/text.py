@@ -0,0 +1,64 @@
+from collections import OrderedDict
+
+
+class TextCache:
+    """Shared fonts plus an LRU cache of rendered text surfaces.
+
+    Labels and tooltips mostly show the same few strings every frame, so
+    rendering them again is wasted work. Surfaces are keyed by
+    (font, text, color) and evicted least recently used first once they
+    take up more than max_bytes. Text is rendered in font_name (pygame's
+    default font if None) unless a call names another.
+    """
+
+    def __init__(self, max_bytes=4 * 1024 * 1024, font_name=None):
+        self.font_name = font_name
+        self.fonts = {}
+        self.surfaces = OrderedDict()
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def font(self, name=None, size=16):
+        if name is None:
+            name = self.font_name
+        key = (name, size)
+        font = self.fonts.get(key)
+        if font is None:
+            import pygame
+
+            if not pygame.font.get_init():
+                pygame.font.init()
+            font = self.fonts[key] = pygame.font.SysFont(name, size)
+        return font
+
+    def render(self, text, color, name=None, size=16):
+        if name is None:
+            name = self.font_name
+        key = (name, size, text, tuple(color))
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = self.font(name, size).render(text, True, color)
+        self.surfaces[key] = surface
+        self.used_bytes += self._size_of(surface)
+        while self.used_bytes > self.max_bytes and len(self.surfaces) > 1:
+            _, evicted = self.surfaces.popitem(last=False)
+            self.used_bytes -= self._size_of(evicted)
+        return surface
+
+    def clear(self):
+        self.surfaces.clear()
+        self.used_bytes = 0
+
+    @staticmethod
+    def _size_of(surface):
+        return surface.get_pitch() * surface.get_height()
+
+
+text_cache = TextCache()
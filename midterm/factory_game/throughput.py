@@ -0,0 +1,327 @@
+import math
+from extractor import Extractor
+from crafter import Crafter
+from conveyor import Conveyor
+from core import Core
+from item import Item
+
+TICK_RATE = 60  # ticks per second of game time
+SATURATED = 0.999  # utilization at which a station counts as a bottleneck
+EPSILON = 1e-12
+MAX_ROUNDS = 100
+
+
+class Node:
+    """What one station can do with the items that reach it, per tick.
+
+    kind is "source" (makes `supply` out of nothing), "crafter" (runs
+    `recipes`, each an (inputs, outputs, ticks) triple, for up to `rate`
+    of every tick), "belt" (passes up to `rate` items on) or "sink"
+    (takes up to `rate` items and keeps them). A crafter with
+    shared_input has one queue for all its links, so an item it never
+    takes holds up every one of them rather than just its own.
+    """
+
+    def __init__(
+        self, station, kind, rate=math.inf, supply=None, recipes=(), shared_input=False
+    ):
+        self.station = station
+        self.kind = kind
+        self.rate = rate
+        self.supply = supply or {}
+        self.recipes = recipes
+        self.shared_input = shared_input
+        self.inputs = []
+        self.outputs = []
+        # Filled in by the solver
+        self.consumed = {}
+        self.produced = {}
+        self.busy = 0.0
+        self.throttle = 1.0  # share of what it produces that gets taken
+
+
+class Edge:
+    """A link items move along, at up to `capacity` items per tick"""
+
+    def __init__(self, source, target, capacity=math.inf):
+        self.source = source
+        self.target = target
+        self.capacity = capacity
+        self.flow = {}  # item -> items per tick
+        self.jammed = False  # carries an item the target can never take
+
+    def total(self):
+        return sum(self.flow.values())
+
+
+def solve(nodes, edges):
+    """Find the steady-state flow on every edge.
+
+    Supply is pushed forward through the graph, each node passing on what
+    its capacity allows, then what every node actually takes is pushed
+    back: an edge only moves as much as its target uses, and since items
+    queue up in order, one item the target doesn't want holds back
+    everything behind it on that edge. Where several edges compete for
+    the same items or the same room, they are served in the order the
+    game steps them. Edges are capped at what was taken
+    and the two passes repeat until nothing changes, which is the state
+    the simulation settles into once its buffers have filled up.
+    """
+    for edge in edges:
+        edge.source.outputs.append(edge)
+        edge.target.inputs.append(edge)
+    order = _topological_order(nodes)
+    for _ in range(MAX_ROUNDS):
+        for node in order:
+            _push_forward(node)
+        changed = False
+        for node in reversed(order):
+            changed |= _push_back(node)
+        if not changed:
+            break
+
+
+def _topological_order(nodes):
+    # Nodes on cycles (which the game doesn't build) go last, in order
+    pending = {id(node): len(node.inputs) for node in nodes}
+    order = [node for node in nodes if not node.inputs]
+    for node in order:
+        for edge in node.outputs:
+            pending[id(edge.target)] -= 1
+            if pending[id(edge.target)] == 0:
+                order.append(edge.target)
+    if len(order) < len(nodes):
+        seen = {id(node) for node in order}
+        order.extend(node for node in nodes if id(node) not in seen)
+    return order
+
+
+def _add(totals, flow, scale=1.0):
+    for item, rate in flow.items():
+        totals[item] = totals.get(item, 0.0) + rate * scale
+
+
+def _push_forward(node):
+    arriving = {}
+    for edge in node.inputs:
+        _add(arriving, edge.flow)
+    total = sum(arriving.values())
+
+    if node.kind == "source":
+        node.consumed = {}
+        node.produced = dict(node.supply)
+        node.busy = 1.0 if node.supply else 0.0
+    elif node.kind in ("belt", "sink"):
+        scale = min(1.0, node.rate / total) if total > EPSILON else 0.0
+        node.consumed = {item: rate * scale for item, rate in arriving.items()}
+        node.produced = dict(node.consumed) if node.kind == "belt" else {}
+        node.busy = total * scale / node.rate if node.rate else 0.0
+    else:
+        # Recipes take their ingredients in order, then all of them slow
+        # down together if the station can't keep up
+        left = dict(arriving)
+        crafts = []
+        for inputs, outputs, ticks in node.recipes:
+            count = min(
+                (left.get(item, 0.0) / need for item, need in inputs.items()),
+                default=0.0,
+            )
+            for item, need in inputs.items():
+                left[item] = left.get(item, 0.0) - count * need
+            crafts.append(count)
+        busy = sum(c * r[2] for c, r in zip(crafts, node.recipes))
+        scale = min(1.0, node.rate / busy) if busy > EPSILON else 0.0
+        node.consumed, node.produced = {}, {}
+        for count, (inputs, outputs, ticks) in zip(crafts, node.recipes):
+            if count <= EPSILON:
+                continue
+            _add(node.consumed, inputs, count * scale)
+            _add(node.produced, outputs, count * scale)
+        node.busy = busy * scale
+
+    _split(node)
+
+
+def _split(node):
+    # Conveyors take from a station in the order they are stepped, so the
+    # first edge gets all it can carry, then the next, and so on
+    produced = sum(node.produced.values())
+    left = produced
+    for edge in node.outputs:
+        share = min(edge.capacity, left)
+        left -= share
+        fraction = share / produced if produced > EPSILON else 0.0
+        edge.flow = {item: rate * fraction for item, rate in node.produced.items()}
+
+
+def _push_back(node):
+    # How much of its output is taken decides how much of its input the
+    # node really uses
+    produced = sum(node.produced.values())
+    if produced > EPSILON:
+        taken = sum(edge.total() for edge in node.outputs)
+        node.throttle = min(1.0, taken / produced)
+    else:
+        node.throttle = 1.0
+    if node.kind in ("source", "crafter", "belt"):
+        node.busy *= node.throttle
+        used = {item: rate * node.throttle for item, rate in node.consumed.items()}
+    else:
+        used = node.consumed
+
+    arriving = {}
+    for edge in node.inputs:
+        _add(arriving, edge.flow)
+    left = sum(used.values())
+    blocked = node.shared_input and any(
+        rate > EPSILON and not _usable(node, item) for item, rate in arriving.items()
+    )
+    changed = False
+    for edge in node.inputs:
+        total = edge.total()
+        if node.kind in ("belt", "sink"):
+            # A belt takes from its sources in order while it has room
+            scale = min(1.0, left / total) if total > EPSILON else 1.0
+            left -= total * scale
+        else:
+            scale = 0.0 if blocked else 1.0
+            for item, rate in edge.flow.items():
+                if rate > EPSILON:
+                    scale = min(scale, used.get(item, 0.0) / arriving[item])
+                    if not _usable(node, item):
+                        edge.jammed = True
+        if scale < 1.0 and total * (1.0 - scale) > EPSILON:
+            edge.capacity = min(edge.capacity, total * scale)
+            changed = True
+    return changed
+
+
+def _usable(node, item):
+    if node.kind != "crafter":
+        return True
+    return any(item in inputs for inputs, _, _ in node.recipes)
+
+
+def station_node(station):
+    if isinstance(station, Extractor):
+        return Node(station, "source", supply={station.resource: 1 / station.INTERVAL})
+    if isinstance(station, Crafter):
+        recipes = [
+            (
+                {Item.by_id[item_id].name: count for item_id, count in recipe.inputs},
+                {item.name: count for item, count in recipe.outputs},
+                1,
+            )
+            for recipe in station.recipes
+        ]
+        return Node(station, "crafter", rate=1, recipes=recipes)
+    if isinstance(station, Conveyor):
+        # One item gets on every `spacing` ticks; with nowhere to go they
+        # fall off the end
+        kind = "belt" if station.next_station is not None else "sink"
+        return Node(station, kind, rate=1 / station.inputs.spacing)
+    if isinstance(station, Core):
+        return Node(station, "sink")
+    # A plain Station fills its inputs and never empties them
+    return Node(station, "crafter", rate=1)
+
+
+class ThroughputReport:
+    """Steady-state rates of a world, in items per second of game time"""
+
+    OUTPUTS = (Core,)  # stations whose intake counts as output
+
+    def __init__(self, nodes, edges):
+        self.nodes = nodes
+        self.edges = edges
+
+    def flows(self):
+        """(from station, to station, {item name: items/s}) for every link"""
+        for edge in self.edges:
+            yield (
+                edge.source.station,
+                edge.target.station,
+                {
+                    item: rate * TICK_RATE
+                    for item, rate in edge.flow.items()
+                    if rate > EPSILON
+                },
+            )
+
+    def utilization(self):
+        """{station: share of the time it is working}"""
+        return {node.station: node.busy for node in self.nodes}
+
+    def output(self):
+        """{item name: items/s} reaching the Cores"""
+        totals = {}
+        for node in self.nodes:
+            if isinstance(node.station, self.OUTPUTS):
+                _add(totals, node.consumed, TICK_RATE)
+        return {item: rate for item, rate in totals.items() if rate > EPSILON}
+
+    def bottlenecks(self):
+        """Stations working flat out, or stuck on an item they can't use.
+
+        Extractors running flat out aren't listed: with no bottlenecks,
+        output is limited by how much the extractors supply.
+        """
+        return [
+            node.station
+            for node in self.nodes
+            if (node.kind != "source" and node.busy >= SATURATED)
+            or any(edge.jammed for edge in node.inputs)
+        ]
+
+    def format(self):
+        lines = ["Output:"]
+        for item, rate in sorted(self.output().items()):
+            lines.append(f"  {item}: {rate:.3f}/s")
+        lines.append("Links:")
+        for source, target, flow in self.flows():
+            rates = ", ".join(f"{item} {rate:.3f}/s" for item, rate in flow.items())
+            lines.append(f"  {_label(source)} -> {_label(target)}: {rates or 'idle'}")
+        lines.append("Utilization:")
+        for station, busy in self.utilization().items():
+            lines.append(f"  {_label(station)}: {busy:.0%}")
+        bottlenecks = ", ".join(_label(station) for station in self.bottlenecks())
+        lines.append(f"Bottlenecks: {bottlenecks or 'none, limited by supply'}")
+        return "\n".join(lines)
+
+
+def _label(station):
+    return f"{station.name or type(station).__name__} ({station.x}, {station.y})"
+
+
+def analyze(world):
+    """Work out a world's steady-state throughput without simulating it"""
+    nodes = {id(station): station_node(station) for station in world.stations}
+    edges = []
+    for station in world.stations:
+        if isinstance(station, Conveyor):
+            belt = nodes[id(station)]
+            for source in station.input_stations:
+                if id(source) in nodes:
+                    edges.append(Edge(nodes[id(source)], belt))
+            target = nodes.get(id(station.next_station))
+            if target is not None:
+                edges.append(Edge(belt, target))
+    nodes = list(nodes.values())
+    solve(nodes, edges)
+    return ThroughputReport(nodes, edges)
+
+
+def measure(world, ticks=10 * 60 * TICK_RATE, warmup=60 * TICK_RATE):
+    """Simulate a copy of the world and return {item name: items/s}
+    reaching its Cores once it has settled, to check analyze() against"""
+    from snapshot import dumps, loads
+
+    copy = loads(dumps(world))
+    copy.run(warmup)
+    before = copy.inventory.copy()
+    copy.run(ticks)
+    return {
+        item.name: (count - before.count(item.id)) * TICK_RATE / ticks
+        for item, count in copy.inventory.items()
+        if count > before.count(item.id)
+    }
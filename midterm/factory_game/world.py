@@ -1,24 +1,207 @@
-import pygame
+from station import Station, TILE_SIZE
+from conveyor import Conveyor
+from core import Core
+from inventory import Inventory
+from spatial import SpatialGrid
+
+DIRECTIONS = {"east": (1, 0), "south": (0, 1), "west": (-1, 0), "north": (0, -1)}
 
 
 class World:
     def __init__(self):
         self.stations = []
-        self.inventory = {}
+        self.inventory = Inventory()
         self.camera_offset = [0, 0]
+        self.tick = 0
+        self.grid = SpatialGrid()
+        self.profiler = None  # a Profiler samples every few ticks when set
+        self.chunks = None  # a ChunkManager pages far chunks out when set
 
     def add_station(self, station):
+        if self.chunks is not None:
+            # Anything it could link up with has to be loaded first
+            self.chunks.loaded(station.x, station.y)
+        self.grid.add(station)
         self.stations.append(station)
+        if self.chunks is not None:
+            self.chunks.added(station)
+        self._relink_around(station)
+
+    def remove_station(self, station):
+        self.grid.remove(station)
+        self.stations.remove(station)
+        if self.chunks is not None:
+            self.chunks.removed(station)
+        for other in self.stations:
+            if isinstance(other, Conveyor):
+                if other.next_station is station:
+                    other.next_station = None
+                if station in other.input_stations:
+                    other.input_stations.remove(station)
+        self._relink_around(station)
+
+    def station_at(self, x, y):
+        return self.grid.at(x, y)
+
+    def station_at_pixel(self, px, py):
+        return self.grid.at(
+            (px + self.camera_offset[0]) // TILE_SIZE,
+            (py + self.camera_offset[1]) // TILE_SIZE,
+        )
+
+    def add_conveyor(self, name, x, y, direction, length=1):
+        """Place a conveyor that links itself up with its neighbours.
+
+        It feeds the station on the tile it faces ("east", "south", ...) and
+        takes from the other stations next to it, and is linked again
+        whenever a station next to it is added or removed.
+        """
+        conveyor = Conveyor(name, x, y, length=length)
+        conveyor.direction = direction
+        self.add_station(conveyor)
+        self.autolink(conveyor)
+        return conveyor
+
+    def autolink(self, conveyor):
+        dx, dy = DIRECTIONS[conveyor.direction]
+        target = self.grid.at(conveyor.x + dx, conveyor.y + dy)
+        conveyor.next_station = target
+        conveyor.input_stations = [
+            station
+            for station in self.grid.neighbors(conveyor.x, conveyor.y)
+            if station is not target and not isinstance(station, (Conveyor, Core))
+        ]
+
+    def _relink_around(self, station):
+        for neighbor in self.grid.neighbors(station.x, station.y):
+            if isinstance(neighbor, Conveyor) and neighbor.direction is not None:
+                self.autolink(neighbor)
 
     def step(self):
-        for station in self.stations:
-            station.step()
+        if self.profiler is not None and self.profiler.due(self.tick):
+            self.profiler.step(self)
+        else:
+            for station in self.stations:
+                station.step()
+        self.tick += 1
+        if self.chunks is not None:
+            self.chunks.advance(1)
+
+    def run(self, ticks, render=False, surface=None, event_driven=False, workers=None):
+        """Advance the world by `ticks` fixed steps.
+
+        Headless runs (the default) never touch pygame and step as fast as
+        the CPU allows. With `render=True` every tick is also drawn to
+        `surface` (or the current display) without any frame rate cap.
+        `event_driven=True` uses the EventScheduler, which skips idle ticks
+        and ends in the same state as stepping every tick. `workers=N` runs
+        disconnected production lines in up to N processes (ParallelRunner),
+        again ending in the same state. With a profiler attached, runs step
+        every tick serially. With chunks, the run stops every so often for
+        the ChunkManager to page chunks in and out.
+        """
+        if (render or self.profiler is not None) and (event_driven or workers):
+            raise ValueError("only serial runs can be rendered or profiled")
+        if render:
+            self._run_rendered(ticks, surface)
+            return
+        chunks = self.chunks
+        if chunks is None:
+            self._run(ticks, event_driven, workers)
+            return
+        while ticks > 0:
+            part = min(ticks, chunks.until_check())
+            self._run(part, event_driven, workers)
+            chunks.advance(part)
+            ticks -= part
+
+    def _run(self, ticks, event_driven, workers):
+        if workers is not None and workers > 1:
+            from parallel import ParallelRunner
+
+            ParallelRunner(self, workers).run(ticks, event_driven)
+            return
+        if event_driven:
+            from scheduler import EventScheduler
+
+            EventScheduler(self).run(ticks)
+            return
+
+        # Stations that don't override step() (e.g. Core) have nothing to do
+        steps = [
+            station.step
+            for station in self.stations
+            if type(station).step is not Station.step
+        ]
+        profiler = self.profiler
+        if profiler is not None:
+            for _ in range(ticks):
+                if profiler.due(self.tick):
+                    profiler.step(self)
+                else:
+                    for step in steps:
+                        step()
+                self.tick += 1
+            return
+        for _ in range(ticks):
+            for step in steps:
+                step()
+        self.tick += ticks
+
+    def save(self, path):
+        """Write a binary snapshot of the world (see snapshot.dumps),
+        unloaded chunks included"""
+        from snapshot import save
+
+        if self.chunks is not None:
+            self.chunks.load_all()
+        save(self, path)
+
+    @staticmethod
+    def load(path):
+        from snapshot import load
+
+        return load(path)
+
+    def _run_rendered(self, ticks, surface):
+        import pygame
+
+        if surface is None:
+            surface = pygame.display.get_surface()
+        for _ in range(ticks):
+            pygame.event.pump()
+            self.step()
+            self.draw(surface)
+            pygame.display.flip()
+
+    def visible_stations(self, rect):
+        """Stations overlapping a screen-space rect (x, y, width, height)"""
+        x, y, width, height = rect
+        left = x + self.camera_offset[0]
+        top = y + self.camera_offset[1]
+        return self.grid.query(
+            left // TILE_SIZE,
+            top // TILE_SIZE,
+            (left + width - 1) // TILE_SIZE,
+            (top + height - 1) // TILE_SIZE,
+        )
 
     def draw(self, surface):
+        import pygame
+
         surface.fill((50, 50, 50))
-        for station in self.stations:
-            station.draw(surface, self.camera_offset)
+        blits = []
+        for station in self.visible_stations(surface.get_rect()):
+            blits.extend(station.sprites(self.camera_offset))
+        surface.blits(blits, False)
+
+        mouse = pygame.mouse.get_pos()
+        hovered = self.station_at_pixel(*mouse)
+        if hovered is not None:
+            hovered.draw_tooltip(surface, self.camera_offset, mouse)
 
     def pan_camera(self, dx, dy):
         self.camera_offset[0] += dx
         self.camera_offset[1] += dy
+        if self.chunks is not None:
+            self.chunks.load_near_camera()
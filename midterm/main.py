@@ -1,9 +1,33 @@
+import gc
+import hashlib
+import heapq
+import math
+import os
 import pygame
 import sys
 import random
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_right
 from collections import deque
 from typing import List, Dict, Optional, Tuple
 
+# The helpers both games use live with factory_game, whose modules import
+# each other by bare name. Appended rather than prepended so that its
+# main.py never stands in for this one.
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "factory_game")
+)
+from lane import Lane
+from loop import FixedStepLoop, SimulationThread
+from spatial import SpatialGrid
+from sprites import sprite_cache
+from text import TextCache
+import profiler as profiling
+import throughput
+
 # Initialize pygame
 pygame.init()
 
@@ -14,6 +38,7 @@ BACKGROUND_COLOR = (50, 50, 50)
 UI_COLOR = (30, 30, 30)
 TEXT_COLOR = (255, 255, 255)
 ACCENT_COLOR = (80, 180, 250)
+OUTLINE_COLOR = (20, 20, 20)
 MATERIAL_COLORS = {
     "iron": (200, 200, 200),
     "copper": (184, 115, 51),
@@ -23,18 +48,20 @@ MATERIAL_COLORS = {
     "product": (255, 165, 0),
 }
 
-# Game window setup
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Factory Simulation Game")
-clock = pygame.time.Clock()
-font = pygame.font.SysFont("Arial", 16)
-large_font = pygame.font.SysFont("Arial", 24)
+# Throughput analysis works in materials per frame, 60 frames a second
+FRAMES_PER_SECOND = 60
+BELT_FRAMES_PER_TILE = 25  # frames a material takes to cross one tile
+
+FONT_NAME = "Arial"
+text_cache = TextCache(font_name=FONT_NAME)
 
 
 # Data Structures
 class Queue:
     """Implementation of Queue data structure for managing materials waiting to be processed"""
 
+    __slots__ = ("items", "max_size")
+
     def __init__(self, max_size: int = 10):
         self.items = deque()
         self.max_size = max_size
@@ -68,6 +95,8 @@ class Queue:
 class Stack:
     """Implementation of Stack data structure for temporary storage"""
 
+    __slots__ = ("items", "max_size")
+
     def __init__(self, max_size: int = 10):
         self.items = []
         self.max_size = max_size
@@ -98,91 +127,174 @@ class Stack:
         return len(self.items)
 
 
-class TreeNode:
-    """Node for the binary tree structure representing production stations"""
-
-    def __init__(self, station_type: str, x: int, y: int):
-        self.station_type = station_type
-        self.x = x
-        self.y = y
-        self.left = None
-        self.right = None
-        self.parent = None
-        self.station_instance = None
+class ProductionGraph:
+    """Stations and the conveyors linking them, as a directed graph.
 
-
-class BinaryTree:
-    """Binary tree representing production stations and their relationships"""
+    Every station has lists of the conveyors into and out of it, so it can
+    have any number of either. The stations are also kept in topological
+    order, each after all the stations feeding it. A new link against that
+    order only reorders the stations ranked between its two ends (Pearce
+    and Kelly's algorithm), so editing a large factory doesn't re-sort all
+    of it, and a link that would close a loop is refused.
+    """
 
     def __init__(self):
-        self.root = None
-
-    def insert(
-        self, station_type: str, x: int, y: int, parent=None, is_left=True
-    ) -> TreeNode:
-        new_node = TreeNode(station_type, x, y)
-
-        if parent is None:
-            if self.root is None:
-                self.root = new_node
-        else:
-            new_node.parent = parent
-            if is_left:
-                parent.left = new_node
+        self.inputs: Dict["Station", List["Conveyor"]] = {}
+        self.outputs: Dict["Station", List["Conveyor"]] = {}
+        self.order: List[Optional["Station"]] = []  # None where one was removed
+        self.rank: Dict["Station", int] = {}  # station -> index in order
+        self._removed = 0
+        self._downstream_first = None  # cached until the links change
+
+    def add_station(self, station: "Station"):
+        self.inputs[station] = []
+        self.outputs[station] = []
+        self.rank[station] = len(self.order)
+        self.order.append(station)
+
+    def remove_station(self, station: "Station"):
+        """Remove a station and every link to or from it"""
+        for conveyor in self.inputs[station] + self.outputs[station]:
+            self.remove_link(conveyor)
+        del self.inputs[station], self.outputs[station]
+        self.order[self.rank.pop(station)] = None
+        self._removed += 1
+        if 2 * self._removed > len(self.order):
+            self.restore_order([s for s in self.order if s is not None])
+
+    def add_link(self, conveyor: "Conveyor"):
+        """Link two stations, raising ValueError if that would close a loop"""
+        source, target = conveyor.from_station, conveyor.to_station
+        if self.rank[target] <= self.rank[source]:
+            self._reorder(source, target)
+        self.outputs[source].append(conveyor)
+        self.inputs[target].append(conveyor)
+        self._downstream_first = None
+
+    def remove_link(self, conveyor: "Conveyor"):
+        self.outputs[conveyor.from_station].remove(conveyor)
+        self.inputs[conveyor.to_station].remove(conveyor)
+        self._downstream_first = None
+
+    def _reorder(self, source: "Station", target: "Station"):
+        # Stations the target leads to and stations leading to the source,
+        # among those ranked between the two, swap places: the ones leading
+        # to the source take the lowest of their ranks, in their old order
+        lower, upper = self.rank[target], self.rank[source]
+        after = self._reachable(target, forward=True, bound=upper)
+        if source in after:
+            raise ValueError(
+                f"a conveyor from {source.station_type} ({source.x}, {source.y})"
+                f" to {target.station_type} ({target.x}, {target.y})"
+                " would close a loop"
+            )
+        before = self._reachable(source, forward=False, bound=lower)
+        moved = sorted(before, key=self.rank.get) + sorted(after, key=self.rank.get)
+        for station, rank in zip(moved, sorted(self.rank[s] for s in moved)):
+            self.rank[station] = rank
+            self.order[rank] = station
+
+    def _reachable(self, start: "Station", forward: bool, bound: int) -> List:
+        """Stations reachable from start ranked no further than bound"""
+        found = {start: None}
+        pending = [start]
+        while pending:
+            station = pending.pop()
+            if forward:
+                linked = [c.to_station for c in self.outputs[station]]
             else:
-                parent.right = new_node
-
-        return new_node
-
-    def find_node_at_position(self, x: int, y: int) -> Optional[TreeNode]:
-        """Find a node at the given grid position"""
-        return self._find_node_at_position_helper(self.root, x, y)
-
-    def _find_node_at_position_helper(
-        self, node: TreeNode, x: int, y: int
-    ) -> Optional[TreeNode]:
-        if node is None:
-            return None
-
-        if node.x == x and node.y == y:
-            return node
-
-        left_result = self._find_node_at_position_helper(node.left, x, y)
-        if left_result:
-            return left_result
-
-        return self._find_node_at_position_helper(node.right, x, y)
-
-    def traverse_in_order(self):
-        """In-order traversal of the tree"""
-        result = []
-        self._traverse_in_order_helper(self.root, result)
-        return result
-
-    def _traverse_in_order_helper(self, node: TreeNode, result: List):
-        if node:
-            self._traverse_in_order_helper(node.left, result)
-            result.append(node)
-            self._traverse_in_order_helper(node.right, result)
+                linked = [c.from_station for c in self.inputs[station]]
+            for other in linked:
+                rank = self.rank[other]
+                if other not in found and (rank <= bound if forward else rank >= bound):
+                    found[other] = None
+                    pending.append(other)
+        return list(found)
+
+    def restore_order(self, stations: List["Station"]):
+        """Take the order of a saved graph (or compact this one's)"""
+        self.order = list(stations)
+        self.rank = {station: k for k, station in enumerate(self.order)}
+        self._removed = 0
+        self._downstream_first = None
+
+    def stations(self) -> List["Station"]:
+        """Every station, each after the ones feeding it"""
+        return [station for station in self.order if station is not None]
+
+    def downstream_first(self) -> List["Conveyor"]:
+        """Every conveyor, those leaving the stations furthest down the
+        line first"""
+        if self._downstream_first is None:
+            self._downstream_first = [
+                conveyor
+                for station in reversed(self.order)
+                if station is not None
+                for conveyor in self.outputs[station]
+            ]
+        return self._downstream_first
 
 
 # Game Classes
 class Material:
-    """Represents materials that flow through the factory"""
+    """Represents materials that flow through the factory.
+
+    A material is nothing but its type, so each type has one shared
+    instance (Material("iron") always returns the same object) and queues
+    and conveyors full of materials only hold references to them. Types
+    get small ids, in the order they are first seen, for comparing cheaply.
+    """
+
+    __slots__ = ("material_type", "type_id", "sprites")
+    _by_type: Dict[str, "Material"] = {}
+    types: List[str] = []  # type id -> material type
+
+    def __new__(cls, material_type: str):
+        material = cls._by_type.get(material_type)
+        if material is None:
+            material = object.__new__(cls)
+            material.material_type = sys.intern(material_type)
+            material.type_id = len(cls.types)
+            material.sprites = {}  # size -> pre-rendered square
+            cls.types.append(material.material_type)
+            cls._by_type[material.material_type] = material
+        return material
 
-    def __init__(self, material_type: str):
-        self.material_type = material_type
-        self.processing_time = 0
+    def __reduce__(self):
+        # Pickled and copied by type, so they come back as the shared instance
+        return (Material, (self.material_type,))
+
+    def sprite(self, size: int = 20) -> pygame.Surface:
+        """The material as a size x size square, drawn once per size"""
+        sprite = self.sprites.get(size)
+        if sprite is None:
+            color = MATERIAL_COLORS.get(self.material_type, (255, 255, 255))
+            sprite = self.sprites[size] = sprite_cache.tile(
+                color, size, 1, OUTLINE_COLOR
+            )
+        return sprite
 
     def draw(self, surface, x: int, y: int, size: int = 20):
-        color = MATERIAL_COLORS.get(self.material_type, (255, 255, 255))
-        pygame.draw.rect(surface, color, (x, y, size, size))
-        pygame.draw.rect(surface, (20, 20, 20), (x, y, size, size), 1)
+        surface.blit(self.sprite(size), (x, y))
 
 
 class Station:
     """Base class for production stations"""
 
+    # Subclasses list the attributes they add, so no station has a __dict__
+    __slots__ = (
+        "station_type",
+        "x",
+        "y",
+        "input_queue",
+        "output_queue",
+        "storage_stack",
+        "processing",
+        "processing_time",
+        "processing_total",
+        "active",
+    )
+
     def __init__(self, station_type: str, x: int, y: int):
         self.station_type = station_type
         self.x = x
@@ -217,64 +329,87 @@ class Station:
         # Default behavior: pass through
         return material
 
-    def draw(self, surface):
-        """Draw the station on the surface"""
-        # Draw station background
-        station_color = self._get_station_color()
-        pygame.draw.rect(
-            surface,
-            station_color,
-            (self.x * GRID_SIZE, self.y * GRID_SIZE, GRID_SIZE, GRID_SIZE),
-        )
-        pygame.draw.rect(
-            surface,
-            (20, 20, 20),
-            (self.x * GRID_SIZE, self.y * GRID_SIZE, GRID_SIZE, GRID_SIZE),
-            2,
+    def flow_node(self, materials: List[str]) -> throughput.Node:
+        """Steady-state counterpart of process_item, for analyze().
+
+        `materials` are all the materials that can reach the station. Each
+        is taken off the one input queue and transformed on its own.
+        """
+        recipes = [
+            (
+                {m: 1},
+                {self.transform_material(Material(m)).material_type: 1},
+                self.processing_total,
+            )
+            for m in materials
+        ]
+        return throughput.Node(
+            self,
+            "crafter",
+            rate=1 if self.active else 0,
+            recipes=recipes,
+            shared_input=True,
         )
 
-        # Draw station label
-        label = font.render(self.station_type, True, TEXT_COLOR)
-        surface.blit(label, (self.x * GRID_SIZE + 5, self.y * GRID_SIZE + 5))
-
-        # Draw input queue
-        if not self.input_queue.is_empty():
-            for i, item in enumerate(self.input_queue.items):
-                item.draw(
-                    surface,
-                    self.x * GRID_SIZE + 10,
-                    self.y * GRID_SIZE + GRID_SIZE - 25 - i * 5,
-                    15,
-                )
-
-        # Draw output queue
-        if not self.output_queue.is_empty():
-            for i, item in enumerate(self.output_queue.items):
-                item.draw(
-                    surface,
-                    self.x * GRID_SIZE + GRID_SIZE - 25,
-                    self.y * GRID_SIZE + 10 + i * 5,
-                    15,
-                )
+    def render_key(self) -> Tuple:
+        """Everything draw() shows that can change between frames"""
+        progress = -1
+        if self.processing:
+            progress = int(
+                (GRID_SIZE - 20) * min(self.processing_time / self.processing_total, 1)
+            )
+        return (
+            tuple(m.type_id for m in self.input_queue.items),
+            tuple(m.type_id for m in self.output_queue.items),
+            self.processing.type_id if self.processing else -1,
+            progress,
+        )
 
-        # Draw processing item
+    def sprites(self) -> List[Tuple]:
+        """What draw() shows, as (surface, position[, area]) tuples for
+        Surface.blits, so a whole area of stations is drawn in one call"""
+        x = self.x * GRID_SIZE
+        y = self.y * GRID_SIZE
+        blits = [
+            (
+                sprite_cache.tile(
+                    self._get_station_color(), GRID_SIZE, 2, OUTLINE_COLOR
+                ),
+                (x, y),
+            ),
+            (text_cache.render(self.station_type, TEXT_COLOR), (x + 5, y + 5)),
+        ]
+
+        # Input queue up the left, output queue down the right
+        for i, item in enumerate(self.input_queue.items):
+            blits.append((item.sprite(15), (x + 10, y + GRID_SIZE - 25 - i * 5)))
+        for i, item in enumerate(self.output_queue.items):
+            blits.append((item.sprite(15), (x + GRID_SIZE - 25, y + 10 + i * 5)))
+
+        # Processing item, over a bar that fills up as it's processed (and
+        # stays full while the output queue is)
         if self.processing:
-            progress = self.processing_time / self.processing_total
-            pygame.draw.rect(
-                surface,
-                (100, 200, 100),
+            progress = min(self.processing_time / self.processing_total, 1)
+            # A borderless tile, of which the area shows the bar
+            bar = sprite_cache.tile((100, 200, 100), GRID_SIZE - 20, border=0)
+            blits.append(
                 (
-                    self.x * GRID_SIZE + 10,
-                    self.y * GRID_SIZE + GRID_SIZE - 8,
-                    (GRID_SIZE - 20) * progress,
-                    6,
-                ),
+                    bar,
+                    (x + 10, y + GRID_SIZE - 8),
+                    (0, 0, int((GRID_SIZE - 20) * progress), 6),
+                )
             )
-            self.processing.draw(
-                surface,
-                self.x * GRID_SIZE + GRID_SIZE // 2 - 10,
-                self.y * GRID_SIZE + GRID_SIZE // 2 - 10,
+            blits.append(
+                (
+                    self.processing.sprite(),
+                    (x + GRID_SIZE // 2 - 10, y + GRID_SIZE // 2 - 10),
+                )
             )
+        return blits
+
+    def draw(self, surface):
+        """Draw the station on the surface"""
+        surface.blits(self.sprites(), False)
 
     def _get_station_color(self):
         """Get color based on station type"""
@@ -299,6 +434,8 @@ class Station:
 class Extractor(Station):
     """Extracts raw materials"""
 
+    __slots__ = ("material_type", "extraction_timer", "extraction_rate")
+
     def __init__(self, x: int, y: int, material_type: str):
         super().__init__("extractor", x, y)
         self.material_type = material_type
@@ -316,16 +453,22 @@ class Extractor(Station):
 
         self.process_item()
 
-    def draw(self, surface):
-        super().draw(surface)
-        # Draw material type
-        label = font.render(f"Type: {self.material_type}", True, TEXT_COLOR)
-        surface.blit(label, (self.x * GRID_SIZE + 5, self.y * GRID_SIZE + 25))
+    def flow_node(self, materials: List[str]) -> throughput.Node:
+        supply = {self.material_type: 1 / self.extraction_rate} if self.active else {}
+        return throughput.Node(self, "source", supply=supply)
+
+    def sprites(self) -> List[Tuple]:
+        label = text_cache.render(f"Type: {self.material_type}", TEXT_COLOR)
+        return super().sprites() + [
+            (label, (self.x * GRID_SIZE + 5, self.y * GRID_SIZE + 25))
+        ]
 
 
 class Furnace(Station):
     """Processes raw materials into refined materials"""
 
+    __slots__ = ()
+
     def __init__(self, x: int, y: int):
         super().__init__("furnace", x, y)
         self.processing_total = 90  # slower processing
@@ -343,6 +486,8 @@ class Furnace(Station):
 class Assembler(Station):
     """Combines materials to create components"""
 
+    __slots__ = ("required_materials",)
+
     def __init__(self, x: int, y: int):
         super().__init__("assembler", x, y)
         self.processing_total = 120
@@ -385,10 +530,29 @@ class Assembler(Station):
         """Combine materials into components"""
         return Material("circuit")
 
+    def flow_node(self, materials: List[str]) -> throughput.Node:
+        # One of each required material per component, taken off the queue
+        # one a frame before processing starts
+        product = self.transform_material(Material("component")).material_type
+        recipe = (
+            {m: 1 for m in self.required_materials},
+            {product: 1},
+            self.processing_total + len(self.required_materials) - 1,
+        )
+        return throughput.Node(
+            self,
+            "crafter",
+            rate=1 if self.active else 0,
+            recipes=[recipe],
+            shared_input=True,
+        )
+
 
 class Packager(Station):
     """Packages components into final products"""
 
+    __slots__ = ()
+
     def __init__(self, x: int, y: int):
         super().__init__("packager", x, y)
         self.processing_total = 80
@@ -404,6 +568,8 @@ class Packager(Station):
 class OutputStation(Station):
     """Final output for completed products"""
 
+    __slots__ = ("products_completed",)
+
     def __init__(self, x: int, y: int):
         super().__init__("output", x, y)
         self.products_completed = 0
@@ -415,82 +581,135 @@ class OutputStation(Station):
             if material.material_type == "product":
                 self.products_completed += 1
 
-    def draw(self, surface):
-        super().draw(surface)
-        # Draw product count
-        label = font.render(f"Products: {self.products_completed}", True, TEXT_COLOR)
-        surface.blit(label, (self.x * GRID_SIZE + 5, self.y * GRID_SIZE + 30))
+    def flow_node(self, materials: List[str]) -> throughput.Node:
+        # Takes one material a frame, whatever it is
+        recipes = [({m: 1}, {}, 1) for m in materials]
+        return throughput.Node(self, "crafter", rate=1, recipes=recipes)
+
+    def render_key(self) -> Tuple:
+        return super().render_key() + (self.products_completed,)
+
+    def sprites(self) -> List[Tuple]:
+        label = text_cache.render(f"Products: {self.products_completed}", TEXT_COLOR)
+        return super().sprites() + [
+            (label, (self.x * GRID_SIZE + 5, self.y * GRID_SIZE + 30))
+        ]
 
 
 class Conveyor:
     """Connects stations and moves materials between them"""
 
-    def __init__(self, from_station: Station, to_station: Station):
+    def __init__(
+        self,
+        from_station: Station,
+        to_station: Station,
+        length: Optional[int] = None,
+        tiles: Optional[List[Tuple[int, int]]] = None,
+    ):
         self.from_station = from_station
         self.to_station = to_station
-        self.materials = []
-        self.speed = 2  # pixels per frame
-        self.path = self._calculate_path()
+        # A material every 34 frames at most. Without a fixed `length` in
+        # frames, the belt takes BELT_FRAMES_PER_TILE to cross each tile of
+        # its path.
+        self.fixed_length = length
+        self.lane = Lane(length or 34, 34)
+        self.moved = 0  # materials handed over so far
+        self.set_tiles(tiles or self._calculate_path())
 
     def _calculate_path(self) -> List[Tuple[int, int]]:
-        """Calculate path from source to destination"""
-        start_x = self.from_station.x * GRID_SIZE + GRID_SIZE // 2
-        start_y = self.from_station.y * GRID_SIZE + GRID_SIZE // 2
-        end_x = self.to_station.x * GRID_SIZE + GRID_SIZE // 2
-        end_y = self.to_station.y * GRID_SIZE + GRID_SIZE // 2
-
-        # Simple direct path for now
-        return [(start_x, start_y), (end_x, end_y)]
+        """Straight from source to destination, for conveyors not routed
+        around the other stations"""
+        return [
+            (self.from_station.x, self.from_station.y),
+            (self.to_station.x, self.to_station.y),
+        ]
+
+    def set_tiles(self, tiles: List[Tuple[int, int]]):
+        """Lay the belt over these tiles, from the source's to the
+        destination's, and set its length to match"""
+        self.tiles = tiles
+        # Screen points where the belt turns, with how far along it each is
+        corners = [tiles[0]]
+        for k in range(1, len(tiles) - 1):
+            (x0, y0), (x1, y1), (x2, y2) = tiles[k - 1 : k + 2]
+            if (x1 - x0, y1 - y0) != (x2 - x1, y2 - y1):
+                corners.append(tiles[k])
+        corners.append(tiles[-1])
+        self.path = [
+            (x * GRID_SIZE + GRID_SIZE // 2, y * GRID_SIZE + GRID_SIZE // 2)
+            for x, y in corners
+        ]
+        self._along = [0.0]
+        for (x0, y0), (x1, y1) in zip(self.path, self.path[1:]):
+            self._along.append(self._along[-1] + math.hypot(x1 - x0, y1 - y0))
+        if self.fixed_length is None:
+            tiles_long = self._along[-1] / GRID_SIZE
+            self.lane.resize(max(round(tiles_long * BELT_FRAMES_PER_TILE), 34))
+
+    def tile_length(self) -> int:
+        """Tiles the belt crosses"""
+        return len(self.tiles) - 1
 
     def update(self):
         """Move materials along conveyor and transfer between stations"""
-        # Try to get a material from source station
-        if (
-            not self.from_station.output_queue.is_empty()
-            and not self.to_station.input_queue.is_full()
-            and len(self.materials) < 3
-        ):
-            material = self.from_station.output_queue.dequeue()
-            if material:
-                # Add to conveyor with starting position
-                start_x, start_y = self.path[0]
-                self.materials.append(
-                    {"material": material, "x": start_x, "y": start_y, "progress": 0.0}
-                )
-
-        # Move materials along conveyor
-        materials_to_remove = []
-        for item in self.materials:
-            item["progress"] += 0.01  # Increment progress (0 to 1)
-
-            if item["progress"] >= 1.0:
-                # Material reached destination
-                if not self.to_station.input_queue.is_full():
-                    self.to_station.input_queue.enqueue(item["material"])
-                    materials_to_remove.append(item)
-            else:
-                # Interpolate position based on progress
-                start_x, start_y = self.path[0]
-                end_x, end_y = self.path[1]
-                item["x"] = start_x + (end_x - start_x) * item["progress"]
-                item["y"] = start_y + (end_y - start_y) * item["progress"]
-
-        # Remove delivered materials
-        for item in materials_to_remove:
-            self.materials.remove(item)
+        self.lane.advance()
+
+        # Hand the front material over once it reaches the destination;
+        # while the station is full the materials queue up behind it
+        if self.lane.head() is not None and not self.to_station.input_queue.is_full():
+            self.to_station.input_queue.enqueue(self.lane.pop())
+            self.moved += 1
+
+        # Take a material from the source station if there's room on the belt
+        if not self.from_station.output_queue.is_empty() and self.lane.can_accept():
+            self.lane.push(self.from_station.output_queue.dequeue())
+
+    def bounds(self) -> pygame.Rect:
+        """Screen area the conveyor and its materials can cover"""
+        xs = [x for x, _ in self.path]
+        ys = [y for _, y in self.path]
+        rect = pygame.Rect(
+            min(xs), min(ys), max(xs) - min(xs) + 1, max(ys) - min(ys) + 1
+        )
+        return rect.inflate(26, 26)
+
+    def point_at(self, progress: float) -> Tuple[float, float]:
+        """Screen point `progress` (0 to 1) of the way along the belt"""
+        along = self._along
+        distance = progress * along[-1]
+        k = min(max(bisect_right(along, distance) - 1, 0), len(along) - 2)
+        (x0, y0), (x1, y1) = self.path[k], self.path[k + 1]
+        span = along[k + 1] - along[k]
+        t = (distance - along[k]) / span if span else 0.0
+        return x0 + (x1 - x0) * t, y0 + (y1 - y0) * t
+
+    def material_positions(self, alpha: float = 0.0):
+        """Yield (material, x, y) for each material on the belt"""
+        lane = self.lane
+        for material, distance in zip(lane, lane.positions(alpha)):
+            x, y = self.point_at(1 - distance / self.lane.length)
+            yield material, int(x), int(y)
+
+    def render_key(self, alpha: float = 0.0) -> Tuple:
+        return tuple(
+            (material.type_id, x, y)
+            for material, x, y in self.material_positions(alpha)
+        )
 
     def draw(self, surface):
         """Draw conveyor and materials on it"""
+        self.draw_belt(surface)
+        self.draw_materials(surface)
+
+    def draw_belt(self, surface):
+        """Draw the belt itself, which never changes"""
         # Draw conveyor line
-        start_x, start_y = self.path[0]
-        end_x, end_y = self.path[1]
-        pygame.draw.line(
-            surface, (150, 150, 150), (start_x, start_y), (end_x, end_y), 5
-        )
+        pygame.draw.lines(surface, (150, 150, 150), False, self.path, 5)
 
-        # Draw direction indicator (arrow)
-        mid_x = start_x + (end_x - start_x) * 0.5
-        mid_y = start_y + (end_y - start_y) * 0.5
+        # Draw direction indicator (arrow), halfway along
+        mid_x, mid_y = self.point_at(0.5)
+        k = min(bisect_right(self._along, self._along[-1] / 2), len(self.path) - 1)
+        (start_x, start_y), (end_x, end_y) = self.path[k - 1], self.path[k]
         angle = pygame.math.Vector2(end_x - start_x, end_y - start_y).normalize()
         normal = pygame.math.Vector2(-angle.y, angle.x) * 5
 
@@ -501,30 +720,505 @@ class Conveyor:
 
         pygame.draw.polygon(surface, (200, 200, 200), [p1, p2, p3])
 
-        # Draw materials on conveyor
-        for item in self.materials:
-            item["material"].draw(surface, int(item["x"]) - 10, int(item["y"]) - 10)
+    def sprites(self, alpha: float = 0.0) -> List[Tuple]:
+        """The materials on the belt as (surface, position) pairs for
+        Surface.blits"""
+        return [
+            (material.sprite(), (x - 10, y - 10))
+            for material, x, y in self.material_positions(alpha)
+        ]
+
+    def draw_materials(self, surface, alpha: float = 0.0):
+        """Draw the materials on the belt"""
+        surface.blits(self.sprites(alpha), False)
+
+
+class Router:
+    """Lays conveyors around the stations on the grid, finding paths with A*.
+
+    Paths run between the tiles of the two stations a conveyor links,
+    through free tiles only, a step at a time in the four directions,
+    guided by the Manhattan distance to the destination (which is also
+    the length of the path when nothing is in the way). The tiles every
+    conveyor runs over are indexed, so placing a station only reroutes
+    the conveyors over its tile, and removing one only reroutes those
+    that had to go around something.
+    """
+
+    def __init__(self, grid: SpatialGrid):
+        self.grid = grid
+        self.over: Dict[Tuple[int, int], List[Conveyor]] = {}  # tile -> belts
+        self.detours: Dict[Conveyor, None] = {}  # longer than they could be
+
+    def find_path(
+        self, start: Tuple[int, int], goal: Tuple[int, int]
+    ) -> Optional[List[Tuple[int, int]]]:
+        """Shortest path of tiles from start to goal, or None if stations
+        are in the way of every one.
+
+        Beyond a tile past the outermost stations everything is free, so
+        the search never needs to go further; that only matters when the
+        goal can't be reached at all.
+        """
+        chunks = self.grid.chunks
+        size = self.grid.CHUNK
+        box = (
+            min(min(cx for cx, _ in chunks) * size, start[0], goal[0]) - 1,
+            min(min(cy for _, cy in chunks) * size, start[1], goal[1]) - 1,
+            max((max(cx for cx, _ in chunks) + 1) * size, start[0], goal[0]),
+            max((max(cy for _, cy in chunks) + 1) * size, start[1], goal[1]),
+        )
+        return self._search(start, goal, box)
+
+    def _search(
+        self,
+        start: Tuple[int, int],
+        goal: Tuple[int, int],
+        box: Tuple[int, int, int, int],
+    ) -> Optional[List[Tuple[int, int]]]:
+        # A* within the box
+        gx, gy = goal
+        x0, y0, x1, y1 = box
+        taken = self.grid.tiles
+        h = abs(start[0] - gx) + abs(start[1] - gy)
+        # Ties on the estimated length go to the tile nearest the goal,
+        # which keeps the search to a narrow band on open ground
+        frontier = [(h, h, start)]
+        cost = {start: 0}
+        came_from = {start: None}
+        while frontier:
+            f, h, tile = heapq.heappop(frontier)
+            g = cost[tile]
+            if g + h != f:  # reached more cheaply since this was queued
+                continue
+            if tile == goal:
+                path = []
+                while tile is not None:
+                    path.append(tile)
+                    tile = came_from[tile]
+                return path[::-1]
+            x, y = tile
+            g += 1
+            for step in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                if step in taken and step != goal:
+                    continue
+                sx, sy = step
+                if not (x0 <= sx <= x1 and y0 <= sy <= y1):
+                    continue
+                if g < cost.get(step, g + 1):
+                    cost[step] = g
+                    came_from[step] = tile
+                    h = abs(sx - gx) + abs(sy - gy)
+                    heapq.heappush(frontier, (g + h, h, step))
+        return None
+
+    def route(self, conveyor: Conveyor):
+        """Lay a conveyor along the shortest path, or straight across if
+        there is none"""
+        self.forget(conveyor)
+        source, target = conveyor.from_station, conveyor.to_station
+        start, goal = (source.x, source.y), (target.x, target.y)
+        tiles = self.find_path(start, goal)
+        conveyor.set_tiles(tiles or [start, goal])
+        self.track(conveyor)
+
+    def track(self, conveyor: Conveyor):
+        """Index a conveyor that already has its tiles"""
+        for tile in conveyor.tiles[1:-1]:
+            self.over.setdefault(tile, []).append(conveyor)
+        # Straight across when there was no path, which is shorter still
+        (sx, sy), (gx, gy) = conveyor.tiles[0], conveyor.tiles[-1]
+        if conveyor.tile_length() != abs(sx - gx) + abs(sy - gy):
+            self.detours[conveyor] = None
+
+    def forget(self, conveyor: Conveyor):
+        for tile in conveyor.tiles[1:-1]:
+            belts = self.over.get(tile)
+            if belts and conveyor in belts:
+                belts.remove(conveyor)
+                if not belts:
+                    del self.over[tile]
+        self.detours.pop(conveyor, None)
+
+    def station_added(self, station: Station) -> List[Conveyor]:
+        """Reroute the conveyors over the station's tile; returns them"""
+        moved = list(self.over.get((station.x, station.y), ()))
+        for conveyor in moved:
+            self.route(conveyor)
+        return moved
+
+    def station_removed(self, station: Station) -> List[Conveyor]:
+        """Reroute the conveyors that went around something, in case the
+        way through the freed tile is shorter; returns the ones that changed"""
+        x, y = station.x, station.y
+        moved = []
+        for conveyor in list(self.detours):
+            tiles = conveyor.tiles
+            (sx, sy), (gx, gy) = tiles[0], tiles[-1]
+            through = abs(sx - x) + abs(sy - y) + abs(x - gx) + abs(y - gy)
+            routed = len(tiles) > 2 or abs(sx - gx) + abs(sy - gy) == 1
+            if routed and through >= conveyor.tile_length():
+                continue  # no path through the tile can be shorter
+            self.route(conveyor)
+            if conveyor.tiles != tiles:
+                moved.append(conveyor)
+        return moved
+
+
+class Profiler(profiling.Profiler):
+    """Opt-in instrumentation for the factory and the frames that show it.
+
+    factory_game's profiler.Profiler over this game's stations: with
+    factory.profiler set, every `sample_every`th update is run a type of
+    station at a time, each under a timer, along with the conveyors and
+    finances. On those updates it also records how full every queue and
+    conveyor is, what is blocked and how many materials the conveyors
+    moved since the last sample.
+    """
+
+    def step(self, factory: "Factory"):
+        """Run one factory update a type of station at a time, timing each"""
+        for cls, update, stations in factory.station_batches():
+            self._time(cls.__name__, len(stations), update, cls, stations)
+        self._time("Conveyor", len(factory.conveyors), factory._update_conveyors)
+        self._time("finances", 1, factory._update_finances)
+        self.samples += 1
+        self._sample(factory)
+
+    def _sample(self, factory: "Factory"):
+        for station in factory.stations:
+            name = type(station).__name__
+            self._count(self.input_occupancy, name, station.input_queue.size())
+            self._count(self.output_occupancy, name, station.output_queue.size())
+            # Finished, but with nowhere to put the result
+            if (
+                station.processing is not None
+                and station.processing_time >= station.processing_total
+                and station.output_queue.is_full()
+            ):
+                self.blocked[name] = self.blocked.get(name, 0) + 1
+        moved = 0
+        for conveyor in factory.conveyors:
+            moved += conveyor.moved
+            self._count(self.input_occupancy, "Conveyor", len(conveyor.lane))
+            if conveyor.lane.head() is not None:
+                self.blocked["Conveyor"] = self.blocked.get("Conveyor", 0) + 1
+        self._moved(factory.tick, moved)
+
+    def stalled(self, factory: "Factory") -> Dict[str, int]:
+        # Stations here don't count the ticks they spend stalled
+        return {}
+
+    def overlay_lines(self, factory: "Factory") -> List[str]:
+        """Lines for the UI panel: frame split, then the costliest types"""
+        summary = self.summary(factory)
+        lines = [
+            f"Update {summary['update_ms']:.2f} ms",
+            f"Draw {summary['draw_ms']:.2f} ms",
+            f"Moved: {summary['items_moved_per_tick']:.3f}/tick",
+        ]
+        costliest = sorted(summary["step_us"].items(), key=lambda pair: -pair[1])
+        for name, us in costliest[:4]:
+            lines.append(f"{name}: {us:.1f} us")
+        return lines
+
+
+class ConveyorEdge(throughput.Edge):
+    """A conveyor in the throughput analysis"""
+
+    def __init__(self, conveyor: "Conveyor", source, target):
+        # A conveyor takes on one material every `spacing` frames
+        self.limit = 1 / conveyor.lane.spacing
+        super().__init__(source, target, capacity=self.limit)
+        self.conveyor = conveyor
+
+
+def analyze(factory: "Factory") -> "ThroughputReport":
+    """Work out a factory's steady-state throughput from its layout.
+
+    Runs factory_game's solver (throughput.solve) with every station as
+    a node and every conveyor as an edge between two of them. Stations
+    share one input queue between their conveyors, so a material a
+    station never takes off it stops everything queued behind it.
+    """
+    materials = {s.material_type for s in factory.stations if isinstance(s, Extractor)}
+    while True:
+        made = {
+            s.transform_material(Material(m)).material_type
+            for s in factory.stations
+            for m in materials
+        }
+        if made <= materials:
+            break
+        materials |= made
+    materials = sorted(materials)
+
+    nodes = {id(s): s.flow_node(materials) for s in factory.stations}
+    edges = [
+        ConveyorEdge(
+            conveyor, nodes[id(conveyor.from_station)], nodes[id(conveyor.to_station)]
+        )
+        for conveyor in factory.conveyors
+        if id(conveyor.from_station) in nodes and id(conveyor.to_station) in nodes
+    ]
+    nodes = list(nodes.values())
+    throughput.solve(nodes, edges)
+    return ThroughputReport(nodes, edges)
+
+
+class ThroughputReport(throughput.ThroughputReport):
+    """Steady-state rates of a factory, in materials per second.
+
+    Made by analyze(). Also lists stations switched off and conveyors
+    running flat out as bottlenecks.
+    """
+
+    OUTPUTS = (OutputStation,)
+
+    def bottlenecks(self) -> List:
+        found = super().bottlenecks()
+        found.extend(
+            node.station
+            for node in self.nodes
+            if not node.station.active
+            and (node.inputs or node.outputs)
+            and node.station not in found
+        )
+        found.extend(
+            edge.conveyor
+            for edge in self.edges
+            if edge.total() >= throughput.SATURATED * edge.limit
+        )
+        return found
+
+
+# Snapshots and replay logs: a header followed by named, typed columns
+# (flat arrays)
+SNAPSHOT_MAGIC = b"FSIMSNAP"
+SNAPSHOT_VERSION = 4
+REPLAY_MAGIC = b"FSIMREPL"
+REPLAY_VERSION = 1
+COLUMNS_HEADER = struct.Struct("<8sHI")  # magic, version, column count
+COLUMN_HEADER = struct.Struct("<BcQ")  # name length, typecode, item count
+
+
+def pack_columns(magic: bytes, version: int, columns: Dict[str, array]) -> bytes:
+    out = [COLUMNS_HEADER.pack(magic, version, len(columns))]
+    for name, values in columns.items():
+        encoded = name.encode("ascii")
+        out.append(
+            COLUMN_HEADER.pack(len(encoded), values.typecode.encode(), len(values))
+        )
+        out.append(encoded)
+        if sys.byteorder == "big" and values.itemsize > 1:
+            values = array(values.typecode, values)
+            values.byteswap()
+        out.append(values.tobytes())
+    return b"".join(out)
+
+
+def unpack_columns(data: bytes, magic: bytes, version: int) -> Dict[str, array]:
+    if len(data) < COLUMNS_HEADER.size:
+        raise ValueError("file is too short")
+    found_magic, found_version, count = COLUMNS_HEADER.unpack_from(data)
+    if found_magic != magic:
+        raise ValueError(f"not a {magic.decode()} file")
+    if found_version != version:
+        raise ValueError(f"unsupported {magic.decode()} version {found_version}")
+    columns = {}
+    offset = COLUMNS_HEADER.size
+    for _ in range(count):
+        name_length, typecode, length = COLUMN_HEADER.unpack_from(data, offset)
+        offset += COLUMN_HEADER.size
+        name = data[offset : offset + name_length].decode("ascii")
+        offset += name_length
+        values = array(typecode.decode())
+        size = length * values.itemsize
+        values.frombytes(data[offset : offset + size])
+        if sys.byteorder == "big" and values.itemsize > 1:
+            values.byteswap()
+        offset += size
+        columns[name] = values
+    return columns
+
+
+class ReplayLog:
+    """Append-only log of player input, plus keyframes to replay it from.
+
+    Every click is recorded with the tick it happened on, and every
+    keyframe_interval ticks the factory stores a snapshot of itself. With
+    a seeded RNG that makes any tick reproducible: restore the last
+    keyframe at or before it and replay the clicks from there, which is
+    what rewinding does. Logs can be saved and replayed by a later
+    version of the game to compare states with digest().
+
+    The last `recent` keyframes are all kept, and older ones are thinned
+    so the spacing between them doubles with every doubling of their age.
+    The log stays at about recent * (1 + log2(ticks / interval / recent)) / 2
+    keyframes, the first is never dropped, and every tick can still be
+    reconstructed, just with more replaying the further back it is.
+    """
+
+    def __init__(self, keyframe_interval: int = 600, recent: int = 8):
+        self.keyframe_interval = keyframe_interval
+        self.recent = recent
+        self.events = []  # (tick, x, y) for each click
+        self.keyframes = []  # (tick, snapshot bytes), oldest first
+
+    def record_click(self, tick: int, pos: Tuple[int, int]):
+        self.events.append((tick, pos[0], pos[1]))
+
+    def add_keyframe(self, tick: int, snapshot: bytes):
+        if not self.keyframes or self.keyframes[-1][0] < tick:
+            self.keyframes.append((tick, snapshot))
+            self._thin(tick)
+
+    def _thin(self, tick: int):
+        # A keyframe `age` intervals old is kept if its own interval number
+        # is a multiple of 2 ** (age // recent).bit_length(). That only gets
+        # stricter as it ages, so a dropped keyframe is never wanted back.
+        interval = self.keyframe_interval
+        self.keyframes = [
+            (t, snapshot)
+            for t, snapshot in self.keyframes
+            if (t // interval)
+            % (1 << ((tick - t) // interval // self.recent).bit_length())
+            == 0
+        ]
+
+    def reconstruct(self, tick: int) -> "Factory":
+        """The factory as it was after `tick` updates and that tick's clicks"""
+        keyframe = None
+        for keyframe_tick, snapshot in self.keyframes:
+            if keyframe_tick > tick:
+                break
+            keyframe = snapshot
+        if keyframe is None:
+            raise ValueError(f"no keyframe at or before tick {tick}")
+
+        factory = Factory.from_bytes(keyframe, log=None)  # replaying records nothing
+        # Keyframes are taken at the end of an update, before that tick's
+        # clicks are handled
+        events = [e for e in self.events if factory.tick <= e[0] <= tick]
+        events.reverse()
+        while True:
+            while events and events[-1][0] == factory.tick:
+                _, x, y = events.pop()
+                factory.handle_click((x, y))
+            if factory.tick >= tick:
+                return factory
+            factory.update()
+
+    def truncate(self, tick: int):
+        """Forget everything after `tick`, e.g. to carry on from a rewind"""
+        self.events = [e for e in self.events if e[0] <= tick]
+        self.keyframes = [k for k in self.keyframes if k[0] <= tick]
+
+    def to_bytes(self) -> bytes:
+        blobs = [snapshot for _, snapshot in self.keyframes]
+        ends, total = [], 0
+        for blob in blobs:
+            total += len(blob)
+            ends.append(total)
+        return pack_columns(
+            REPLAY_MAGIC,
+            REPLAY_VERSION,
+            {
+                "interval": array("q", [self.keyframe_interval]),
+                "events": array("q", [v for event in self.events for v in event]),
+                "keyframe_ticks": array("q", [t for t, _ in self.keyframes]),
+                "keyframe_ends": array("q", ends),
+                "keyframes": array("B", b"".join(blobs)),
+            },
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ReplayLog":
+        c = unpack_columns(data, REPLAY_MAGIC, REPLAY_VERSION)
+        log = cls(c["interval"][0])
+        events = c["events"]
+        log.events = [tuple(events[k : k + 3]) for k in range(0, len(events), 3)]
+        blob = c["keyframes"].tobytes()
+        start = 0
+        for tick, end in zip(c["keyframe_ticks"], c["keyframe_ends"]):
+            log.keyframes.append((tick, blob[start:end]))
+            start = end
+        return log
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str) -> "ReplayLog":
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+
+STATION_CLASSES = {
+    cls.__name__: cls
+    for cls in (Station, Extractor, Furnace, Assembler, Packager, OutputStation)
+}
+# Factory methods that update a batch of stations of one type; any other
+# type is updated with its process_item()
+BATCH_UPDATES = {Extractor: "_update_extractors", OutputStation: "_update_outputs"}
 
 
 class Factory:
     """Main factory class that manages the simulation"""
 
-    def __init__(self):
+    def __init__(
+        self,
+        initialize: bool = True,
+        seed: Optional[int] = None,
+        log: Optional[bool] = True,
+    ):
         self.stations = []
         self.conveyors = []
-        self.station_tree = BinaryTree()
+        self.grid = SpatialGrid()
+        self.graph = ProductionGraph()  # which stations feed which
+        self.router = Router(self.grid)  # lays conveyors around stations
         self.selected_station = None
         self.money = 1000
         self.production_cost = 2  # cost per product
         self.product_value = 50  # value per product
+        self.cost_chance = 0.01  # chance an active station pays it each frame
+
+        # Stations grouped by type for updating, rebuilt when the stations
+        # change, and running totals the finances are settled from
+        self._batches = None
+        self._active_count = 0
+        self._products = 0  # completed since the finances were last settled
+
+        # Everything random comes from this factory's own generator, and
+        # clicks go through the log, so runs can be replayed exactly.
+        # Headless runs pass log=None to skip the keyframe snapshots.
+        self.tick = 0
+        self.rng = random.Random(seed)
+        self.log = ReplayLog() if log else None
+        self.profiler = None  # a Profiler samples every few updates when set
+        self.profile_lines: List[str] = []  # shown in the UI panel
 
         # UI elements
         self.ui_panel_rect = pygame.Rect(WIDTH - 250, 0, 250, HEIGHT)
         self.build_mode = False
         self.build_type = None
 
+        # Rendering state: a pre-rendered background and the render keys of
+        # everything as it was last drawn, so only changes get redrawn
+        self.view_rect = pygame.Rect(0, 0, WIDTH - 250, HEIGHT)
+        self._background = None  # rebuilt whenever the layout changes
+        self._render_keys = {}
+        self._ui_key = None
+        self._full_redraw = True
+        self._alpha = 0.0  # how far into the next update conveyors are drawn
+        self._throughput = None  # (layout, ThroughputReport) for the UI
+
         # Initialize the factory layout
-        self._initialize_factory()
+        if initialize:
+            self._initialize_factory()
+            if self.log is not None:
+                self.log.add_keyframe(self.tick, self.to_bytes())
 
     def _initialize_factory(self):
         """Create initial factory layout"""
@@ -538,99 +1232,567 @@ class Factory:
         packager = Packager(14, 4)
         output = OutputStation(18, 4)
 
-        # Add stations to list
-        self.stations.extend(
-            [iron_extractor, copper_extractor, furnace, assembler, packager, output]
-        )
+        # Add stations to the factory
+        for station in [
+            iron_extractor,
+            copper_extractor,
+            furnace,
+            assembler,
+            packager,
+            output,
+        ]:
+            self.add_station(station)
 
         # Create conveyors
-        self.conveyors.extend(
+        for source, target in [
+            (iron_extractor, furnace),
+            (furnace, assembler),
+            (copper_extractor, assembler),
+            (assembler, packager),
+            (packager, output),
+        ]:
+            self.add_conveyor(Conveyor(source, target))
+
+    def add_station(self, station: Station):
+        """Place a station on the grid"""
+        self.grid.add(station)
+        self.stations.append(station)
+        self.graph.add_station(station)
+        self.router.station_added(station)
+        self._batches = None
+        self._full_redraw = True
+
+    def add_conveyor(self, conveyor: "Conveyor", route: bool = True):
+        """Link two stations, raising ValueError if that would close a loop.
+
+        The conveyor is routed around the stations in its way, unless
+        `route` is False and it keeps the tiles it has.
+        """
+        self.graph.add_link(conveyor)
+        self.conveyors.append(conveyor)
+        if route:
+            self.router.route(conveyor)
+        else:
+            self.router.track(conveyor)
+        self._full_redraw = True
+
+    def remove_station(self, station: Station):
+        """Remove a station and any conveyors attached to it"""
+        self.grid.remove(station)
+        self.stations.remove(station)
+        self.graph.remove_station(station)
+        self._batches = None
+        kept = []
+        for conveyor in self.conveyors:
+            if conveyor.from_station is station or conveyor.to_station is station:
+                self.router.forget(conveyor)
+            else:
+                kept.append(conveyor)
+        self.conveyors = kept
+        self.router.station_removed(station)
+        if self.selected_station is station:
+            self.selected_station = None
+        self._full_redraw = True
+
+    def save(self, path: str):
+        """Save a snapshot of the whole factory to a file"""
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str, log: Optional[bool] = True) -> "Factory":
+        """Load a factory saved with save()"""
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read(), log)
+
+    def to_bytes(self) -> bytes:
+        """Pack the factory into a compact binary snapshot"""
+        strings = {}
+
+        def string(text: Optional[str]) -> int:
+            if text is None:
+                return -1
+            return strings.setdefault(text, len(strings))
+
+        def materials(queues) -> Tuple[List[int], List[int]]:
+            # All materials in a row of queues, plus where each queue ends
+            items, ends = [], []
+            for queue in queues:
+                items.extend(string(m.material_type) for m in queue)
+                ends.append(len(items))
+            return items, ends
+
+        stations = self.stations
+        for station in stations:
+            if STATION_CLASSES.get(type(station).__name__) is not type(station):
+                raise ValueError(f"can't save a {type(station).__name__}")
+        index = {id(station): i for i, station in enumerate(stations)}
+        columns = {}
+
+        def put(name: str, typecode: str, values):
+            columns[name] = array(typecode, values)
+
+        put("clock", "q", [self.money, self.tick])
+        version, state, gauss = self.rng.getstate()
+        put("rng", "q", [version, *state, -1 if gauss is None else 0])
+        put("gauss", "d", [gauss or 0.0])
+        put("kind", "i", [string(type(s).__name__) for s in stations])
+        put("station_type", "i", [string(s.station_type) for s in stations])
+        put("x", "i", [s.x for s in stations])
+        put("y", "i", [s.y for s in stations])
+        put("active", "b", [s.active for s in stations])
+        put(
+            "processing",
+            "i",
+            [string(s.processing and s.processing.material_type) for s in stations],
+        )
+        put("processing_time", "q", [s.processing_time for s in stations])
+        put("processing_total", "q", [s.processing_total for s in stations])
+        put(
+            "queue_sizes",
+            "i",
             [
-                Conveyor(iron_extractor, furnace),
-                Conveyor(furnace, assembler),
-                Conveyor(copper_extractor, assembler),
-                Conveyor(assembler, packager),
-                Conveyor(packager, output),
-            ]
+                size
+                for s in stations
+                for size in (
+                    s.input_queue.max_size,
+                    s.output_queue.max_size,
+                    s.storage_stack.max_size,
+                )
+            ],
         )
-
-        # Build station tree
-        root = self.station_tree.insert("assembler", 10, 4)
-        root.station_instance = assembler
-
-        furnace_node = self.station_tree.insert("furnace", 6, 2, root, True)
-        furnace_node.station_instance = furnace
-
-        iron_node = self.station_tree.insert("extractor", 2, 2, furnace_node, True)
-        iron_node.station_instance = iron_extractor
-
-        copper_node = self.station_tree.insert("extractor", 2, 6, root, False)
-        copper_node.station_instance = copper_extractor
-
-        packager_node = self.station_tree.insert("packager", 14, 4, root, False)
-        packager_node.station_instance = packager
-
-        output_node = self.station_tree.insert("output", 18, 4, packager_node, False)
-        output_node.station_instance = output
+        for name, queues in (
+            ("input", [s.input_queue.items for s in stations]),
+            ("output", [s.output_queue.items for s in stations]),
+            ("storage", [s.storage_stack.items for s in stations]),
+        ):
+            items, ends = materials(queues)
+            put(name, "i", items)
+            put(name + "_end", "q", ends)
+
+        # Per-type state, with placeholders for the stations without it
+        put(
+            "material_type",
+            "i",
+            [string(getattr(s, "material_type", None)) for s in stations],
+        )
+        put(
+            "extraction",
+            "q",
+            [
+                value
+                for s in stations
+                for value in (
+                    getattr(s, "extraction_timer", 0),
+                    getattr(s, "extraction_rate", 0),
+                )
+            ],
+        )
+        required, required_end = [], []
+        for s in stations:
+            for material_type, count in getattr(s, "required_materials", {}).items():
+                required.extend((string(material_type), count))
+            required_end.append(len(required))
+        put("required", "q", required)
+        put("required_end", "q", required_end)
+        put("products", "q", [getattr(s, "products_completed", 0) for s in stations])
+
+        conveyors = self.conveyors
+        put("conveyor_from", "i", [index[id(c.from_station)] for c in conveyors])
+        put("conveyor_to", "i", [index[id(c.to_station)] for c in conveyors])
+        put("conveyor_length", "q", [c.fixed_length or -1 for c in conveyors])
+        put("tiles", "i", [v for c in conveyors for tile in c.tiles for v in tile])
+        tiles_end = []
+        for c in conveyors:
+            tiles_end.append((tiles_end[-1] if tiles_end else 0) + 2 * len(c.tiles))
+        put("tiles_end", "q", tiles_end)
+        put(
+            "lane_state",
+            "q",
+            [
+                value
+                for c in conveyors
+                for value in (
+                    c.lane.length,
+                    c.lane.spacing,
+                    c.lane.slack,
+                    c.lane.entry,
+                    c.lane.moving,
+                )
+            ],
+        )
+        items, ends = materials(c.lane.items for c in conveyors)
+        put("lane", "i", items)
+        put("lane_end", "q", ends)
+        put("lane_gaps", "q", [gap for c in conveyors for gap in c.lane.gaps])
+
+        # The graph's links are the conveyors, so only its order is saved
+        put("graph_order", "i", [index[id(s)] for s in self.graph.stations()])
+        put("selected", "q", [index.get(id(self.selected_station), -1)])
+
+        # The string table goes last, once everything has added to it
+        encoded = [text.encode("utf-8") for text in strings]
+        ends, total = [], 0
+        for text in encoded:
+            total += len(text)
+            ends.append(total)
+        put("string_ends", "q", ends)
+        columns["strings"] = array("B", b"".join(encoded))
+        return pack_columns(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, columns)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, log: Optional[bool] = True) -> "Factory":
+        """Rebuild a factory from a to_bytes() snapshot"""
+        c = unpack_columns(data, SNAPSHOT_MAGIC, SNAPSHOT_VERSION)
+        blob = c["strings"].tobytes()
+        strings, start = [], 0
+        for end in c["string_ends"]:
+            strings.append(blob[start:end].decode("utf-8"))
+            start = end
+
+        def materials(name: str, row: int, container):
+            start = c[name + "_end"][row - 1] if row else 0
+            for k in c[name][start : c[name + "_end"][row]]:
+                container.append(Material(strings[k]))
+            return container
+
+        factory = cls(initialize=False, log=log)
+        factory.money, factory.tick = c["clock"]
+        version, *state, gauss = c["rng"]
+        gauss = None if gauss < 0 else c["gauss"][0]
+        factory.rng.setstate((version, tuple(state), gauss))
+        stations = []
+        for i, kind in enumerate(c["kind"]):
+            station = Station.__new__(STATION_CLASSES[strings[kind]])
+            station.station_type = strings[c["station_type"][i]]
+            station.x = c["x"][i]
+            station.y = c["y"][i]
+            station.active = bool(c["active"][i])
+            processing = c["processing"][i]
+            station.processing = (
+                Material(strings[processing]) if processing >= 0 else None
+            )
+            station.processing_time = c["processing_time"][i]
+            station.processing_total = c["processing_total"][i]
+            input_size, output_size, stack_size = c["queue_sizes"][3 * i : 3 * i + 3]
+            station.input_queue = Queue(input_size)
+            materials("input", i, station.input_queue.items)
+            station.output_queue = Queue(output_size)
+            materials("output", i, station.output_queue.items)
+            station.storage_stack = Stack(stack_size)
+            materials("storage", i, station.storage_stack.items)
+
+            if isinstance(station, Extractor):
+                station.material_type = strings[c["material_type"][i]]
+                station.extraction_timer, station.extraction_rate = c["extraction"][
+                    2 * i : 2 * i + 2
+                ]
+            if isinstance(station, Assembler):
+                start = c["required_end"][i - 1] if i else 0
+                pairs = c["required"][start : c["required_end"][i]]
+                station.required_materials = {
+                    strings[pairs[k]]: pairs[k + 1] for k in range(0, len(pairs), 2)
+                }
+            if isinstance(station, OutputStation):
+                station.products_completed = c["products"][i]
+            stations.append(station)
+            factory.add_station(station)
+
+        gaps = c["lane_gaps"]
+        for k, (source, target) in enumerate(zip(c["conveyor_from"], c["conveyor_to"])):
+            start = c["tiles_end"][k - 1] if k else 0
+            flat = c["tiles"][start : c["tiles_end"][k]]
+            tiles = list(zip(flat[::2], flat[1::2]))
+            fixed_length = c["conveyor_length"][k]
+            conveyor = Conveyor(
+                stations[source],
+                stations[target],
+                fixed_length if fixed_length >= 0 else None,
+                tiles,
+            )
+            length, spacing, slack, entry, moving = c["lane_state"][5 * k : 5 * k + 5]
+            lane = conveyor.lane = Lane(length, spacing)
+            materials("lane", k, lane.items)
+            start = c["lane_end"][k - 1] if k else 0
+            lane.gaps.extend(gaps[start : c["lane_end"][k]])
+            lane.slack, lane.entry, lane.moving = slack, entry, moving
+            factory.add_conveyor(conveyor, route=False)
+
+        factory.graph.restore_order([stations[k] for k in c["graph_order"]])
+        (selected,) = c["selected"]
+        factory.selected_station = stations[selected] if selected >= 0 else None
+        if factory.log is not None:
+            factory.log.add_keyframe(factory.tick, data)
+        return factory
 
     def update(self):
         """Update the factory simulation"""
-        # Update all stations
-        for station in self.stations:
-            if isinstance(station, OutputStation):
-                station.process_item()  # Special handling for output stations
-            elif isinstance(station, Extractor):
-                station.update()
-            else:
-                station.process_item()
+        self.tick += 1
 
-        # Update all conveyors
-        for conveyor in self.conveyors:
+        if self.profiler is not None and self.profiler.due(self.tick):
+            self.profiler.step(self)
+        else:
+            self._update_stations(self.station_batches())
+            self._update_conveyors()
+            self._update_finances()
+
+        if self.log is not None and self.tick % self.log.keyframe_interval == 0:
+            self.log.add_keyframe(self.tick, self.to_bytes())
+
+    def station_batches(self) -> List[Tuple[type, object, List[Station]]]:
+        """(type, batch update, stations) for every type of station there is.
+
+        Updating stations a type at a time, with the update picked once per
+        batch from BATCH_UPDATES, leaves the per-station work to just the
+        update itself. Stations only touch their own queues while updating,
+        so the order they run in doesn't change the result.
+        """
+        if self._batches is None:
+            groups = {}
+            for station in self.stations:
+                groups.setdefault(type(station), []).append(station)
+            self._batches = [
+                (
+                    cls,
+                    getattr(self, BATCH_UPDATES.get(cls, "_update_processors")),
+                    group,
+                )
+                for cls, group in groups.items()
+            ]
+            self._active_count = sum(station.active for station in self.stations)
+        return self._batches
+
+    def toggle_station(self, station: Station):
+        """Switch a station on or off, keeping the count of active ones"""
+        station.toggle_active()
+        self._active_count += 1 if station.active else -1
+
+    @staticmethod
+    def _update_stations(batches):
+        for cls, update, stations in batches:
+            update(cls, stations)
+
+    @staticmethod
+    def _update_processors(cls, stations):
+        process = cls.process_item
+        for station in stations:
+            process(station)
+
+    @staticmethod
+    def _update_extractors(cls, stations):
+        update = cls.update
+        for station in stations:
+            update(station)
+
+    def _update_outputs(self, cls, stations):
+        # Completed products go straight into the running total
+        process = cls.process_item
+        for station in stations:
+            process(station)
+            if station.products_completed:
+                self._products += station.products_completed
+                station.products_completed = 0
+
+    def _update_conveyors(self):
+        # Stations have all updated already, so materials move one hop a
+        # frame in any order. Going downstream first settles which conveyor
+        # gets a shared queue first by the layout, not the build order.
+        for conveyor in self.graph.downstream_first():
             conveyor.update()
 
-        # Update factory finances
-        for station in self.stations:
-            if isinstance(station, OutputStation):
-                if station.products_completed > 0:
-                    self.money += station.products_completed * self.product_value
-                    station.products_completed = 0
+    def _update_finances(self):
+        if self._products:
+            self.money += self._products * self.product_value
+            self._products = 0
+        # Operating costs: each active station pays with a small chance
+        # every frame, drawn for all of them at once
+        self.money -= self.production_cost * self._operating_charges(self._active_count)
+
+    def _operating_charges(self, stations: int) -> int:
+        """How many of `stations` stations pay operating costs this frame.
+
+        Each does with probability cost_chance, so the count is binomial;
+        it is drawn with one random number per thousand stations by
+        walking the distribution until it passes that number. The walk
+        counts whichever of paying or not paying is less likely, so its
+        starting chance, (1 - q) ** 1000 with q <= 0.5, stays a normal
+        float instead of underflowing to zero.
+        """
+        p = min(self.cost_chance, 1.0)
+        q = min(p, 1 - p)
+        charges = 0
+        while stations > 0:
+            n = min(stations, 1000)
+            stations -= n
+            u = self.rng.random()
+            k = 0
+            chance = (1 - q) ** n
+            total = chance
+            while u >= total and k < n:
+                chance *= (n - k) / (k + 1) * q / (1 - q)
+                k += 1
+                total += chance
+            charges += k if q == p else n - k
+        return charges
+
+    def digest(self) -> str:
+        """Hash of the whole simulation state, for comparing runs"""
+        return hashlib.sha256(self.to_bytes()).hexdigest()
+
+    def analyze_throughput(self) -> ThroughputReport:
+        """Steady-state rates of the current layout, reused until it changes"""
+        layout = (
+            tuple((id(s), s.active) for s in self.stations),
+            tuple(id(c) for c in self.conveyors),
+        )
+        if self._throughput is None or self._throughput[0] != layout:
+            self._throughput = (layout, analyze(self))
+        return self._throughput[1]
+
+    def measure_throughput(self, frames: int = 36000, warmup: int = 3600) -> float:
+        """Products per second a simulated copy of the factory reaches once
+        it has settled, to check analyze_throughput() against"""
+        copy = Factory.from_bytes(self.to_bytes(), log=None)
+        # Count products in money, leaving out the random operating costs
+        copy.production_cost = 0
+        copy.product_value = 1
+        for _ in range(warmup):
+            copy.update()
+        before = copy.money
+        for _ in range(frames):
+            copy.update()
+        return (copy.money - before) * FRAMES_PER_SECOND / frames
+
+    def draw(self, surface, alpha: float = 0.0) -> List[pygame.Rect]:
+        """Draw the factory and return the screen areas that changed"""
+        self._alpha = alpha
+        if self._full_redraw:
+            self._full_redraw = False
+            self._background = self._render_background(surface.get_size())
+            # Record what everything looks like now; the keys are only
+            # updated here and in _dirty_rects, since a repaint may cover
+            # just part of a station or conveyor
+            self._render_keys.clear()
+            self._ui_key = None
+            self._dirty_rects()
+            dirty = [surface.get_rect()]
+        else:
+            dirty = self._dirty_rects()
 
-            if station.active:
-                # Operating costs
-                if random.random() < 0.01:  # Small chance each frame
-                    self.money -= self.production_cost
+        for rect in dirty:
+            self._repaint(surface, rect)
+        return dirty
 
-    def draw(self, surface):
-        """Draw the factory and all components"""
-        # Draw background grid
+    def _render_background(self, size) -> pygame.Surface:
+        """Pre-render the background grid and conveyor belts"""
+        background = pygame.Surface(size)
+        background.fill(BACKGROUND_COLOR)
         for x in range(0, WIDTH - 250, GRID_SIZE):
             for y in range(0, HEIGHT, GRID_SIZE):
-                pygame.draw.rect(surface, (60, 60, 60), (x, y, GRID_SIZE, GRID_SIZE), 1)
-
-        # Draw conveyors first (below stations)
+                pygame.draw.rect(
+                    background, (60, 60, 60), (x, y, GRID_SIZE, GRID_SIZE), 1
+                )
         for conveyor in self.conveyors:
-            conveyor.draw(surface)
+            conveyor.draw_belt(background)
+        return background
+
+    def _visible_stations(self, rect: pygame.Rect) -> List[Station]:
+        """Stations whose tile or label overlaps a screen rect"""
+        rect = rect.clip(self.view_rect)
+        if not rect:
+            return []
+        # Labels can run about one tile to the right of their station
+        return list(
+            self.grid.query(
+                rect.left // GRID_SIZE - 1,
+                rect.top // GRID_SIZE,
+                (rect.right - 1) // GRID_SIZE,
+                (rect.bottom - 1) // GRID_SIZE,
+            )
+        )
 
-        # Draw stations
-        for station in self.stations:
-            station.draw(surface)
+    def _ui_render_key(self) -> Tuple:
+        station = self.selected_station
+        selected = None
+        if station:
+            selected = (
+                id(station),
+                station.active,
+                station.input_queue.size(),
+                station.output_queue.size(),
+                station.storage_stack.size(),
+            )
+        return (
+            self.money,
+            selected,
+            self.analyze_throughput().output().get("product", 0.0),
+            tuple(self.profile_lines),
+            len(self.stations),
+            sum(
+                s.products_completed
+                for s in self.stations
+                if isinstance(s, OutputStation)
+            ),
+        )
 
-            # Highlight selected station
-            if station == self.selected_station:
-                pygame.draw.rect(
-                    surface,
-                    ACCENT_COLOR,
-                    (
+    def _dirty_rects(self) -> List[pygame.Rect]:
+        """Screen areas whose contents changed since the last frame"""
+        dirty = []
+        for station in self._visible_stations(self.view_rect):
+            key = (station.render_key(), station is self.selected_station)
+            if self._render_keys.get(id(station)) != key:
+                self._render_keys[id(station)] = key
+                dirty.append(
+                    pygame.Rect(
                         station.x * GRID_SIZE,
                         station.y * GRID_SIZE,
                         GRID_SIZE,
                         GRID_SIZE,
-                    ),
-                    3,
+                    ).inflate(GRID_SIZE, 0)
+                )
+
+        for conveyor in self.conveyors:
+            bounds = conveyor.bounds()
+            if not bounds.colliderect(self.view_rect):
+                continue
+            key = conveyor.render_key(self._alpha)
+            if self._render_keys.get(id(conveyor)) != key:
+                self._render_keys[id(conveyor)] = key
+                dirty.append(bounds)
+
+        ui_key = self._ui_render_key()
+        if ui_key != self._ui_key:
+            self._ui_key = ui_key
+            dirty.append(self.ui_panel_rect.inflate(4, 0))
+        return dirty
+
+    def _repaint(self, surface, rect: pygame.Rect):
+        """Redraw everything overlapping rect, clipped to it"""
+        surface.set_clip(rect)
+        surface.blit(self._background, rect, rect)
+
+        # Materials on conveyors first (below stations), then the stations
+        # with the selected one highlighted, all in one Surface.blits call
+        blits = []
+        for conveyor in self.conveyors:
+            if conveyor.bounds().colliderect(rect):
+                blits.extend(conveyor.sprites(self._alpha))
+        for station in self._visible_stations(rect):
+            blits.extend(station.sprites())
+            if station is self.selected_station:
+                blits.append(
+                    (
+                        sprite_cache.frame(ACCENT_COLOR, GRID_SIZE, 3),
+                        (station.x * GRID_SIZE, station.y * GRID_SIZE),
+                    )
                 )
+        surface.blits(blits, False)
 
         # Draw UI panel
-        self._draw_ui(surface)
+        if rect.colliderect(self.ui_panel_rect.inflate(4, 0)):
+            self._draw_ui(surface)
+
+        surface.set_clip(None)
 
     def _draw_ui(self, surface):
         """Draw UI panel with factory info and controls"""
@@ -641,18 +1803,18 @@ class Factory:
         )
 
         # Draw factory title
-        title = large_font.render("Factory Controls", True, TEXT_COLOR)
+        title = text_cache.render("Factory Controls", TEXT_COLOR, size=24)
         surface.blit(title, (WIDTH - 230, 20))
 
         # Draw money
-        money_text = font.render(f"Money: ${self.money}", True, TEXT_COLOR)
+        money_text = text_cache.render(f"Money: ${self.money}", TEXT_COLOR)
         surface.blit(money_text, (WIDTH - 230, 60))
 
         # Draw selected station info
         y_offset = 100
         if self.selected_station:
-            station_title = font.render(
-                f"Selected: {self.selected_station.station_type}", True, TEXT_COLOR
+            station_title = text_cache.render(
+                f"Selected: {self.selected_station.station_type}", TEXT_COLOR
             )
             surface.blit(station_title, (WIDTH - 230, y_offset))
             y_offset += 25
@@ -661,37 +1823,34 @@ class Factory:
             status_color = (
                 (100, 200, 100) if self.selected_station.active else (200, 100, 100)
             )
-            status_text = font.render(f"Status: {status}", True, status_color)
+            status_text = text_cache.render(f"Status: {status}", status_color)
             surface.blit(status_text, (WIDTH - 230, y_offset))
             y_offset += 25
 
             # Draw toggle button
             toggle_rect = pygame.Rect(WIDTH - 230, y_offset, 100, 30)
             pygame.draw.rect(surface, ACCENT_COLOR, toggle_rect)
-            toggle_text = font.render("Toggle Power", True, TEXT_COLOR)
+            toggle_text = text_cache.render("Toggle Power", TEXT_COLOR)
             surface.blit(toggle_text, (WIDTH - 225, y_offset + 7))
             y_offset += 40
 
             # Queue information
-            input_text = font.render(
+            input_text = text_cache.render(
                 f"Input Queue: {self.selected_station.input_queue.size()}/{self.selected_station.input_queue.max_size}",
-                True,
                 TEXT_COLOR,
             )
             surface.blit(input_text, (WIDTH - 230, y_offset))
             y_offset += 25
 
-            output_text = font.render(
+            output_text = text_cache.render(
                 f"Output Queue: {self.selected_station.output_queue.size()}/{self.selected_station.output_queue.max_size}",
-                True,
                 TEXT_COLOR,
             )
             surface.blit(output_text, (WIDTH - 230, y_offset))
             y_offset += 25
 
-            stack_text = font.render(
+            stack_text = text_cache.render(
                 f"Storage Stack: {self.selected_station.storage_stack.size()}/{self.selected_station.storage_stack.max_size}",
-                True,
                 TEXT_COLOR,
             )
             surface.blit(stack_text, (WIDTH - 230, y_offset))
@@ -699,7 +1858,7 @@ class Factory:
 
         # Factory stats
         y_offset = max(y_offset, 300)
-        stats_title = font.render("Factory Statistics", True, TEXT_COLOR)
+        stats_title = text_cache.render("Factory Statistics", TEXT_COLOR)
         surface.blit(stats_title, (WIDTH - 230, y_offset))
         y_offset += 25
 
@@ -710,8 +1869,8 @@ class Factory:
             station_counts[station_type] = station_counts.get(station_type, 0) + 1
 
         for i, (station_type, count) in enumerate(station_counts.items()):
-            count_text = font.render(
-                f"{station_type.capitalize()}: {count}", True, TEXT_COLOR
+            count_text = text_cache.render(
+                f"{station_type.capitalize()}: {count}", TEXT_COLOR
             )
             surface.blit(count_text, (WIDTH - 230, y_offset + i * 20))
 
@@ -721,21 +1880,51 @@ class Factory:
         total_output = sum(
             s.products_completed for s in self.stations if isinstance(s, OutputStation)
         )
-        output_text = font.render(f"Total Products: {total_output}", True, TEXT_COLOR)
+        output_text = text_cache.render(f"Total Products: {total_output}", TEXT_COLOR)
         surface.blit(output_text, (WIDTH - 230, y_offset))
         y_offset += 25
 
+        # Steady-state rate of the layout and what holds it back
+        report = self.analyze_throughput()
+        rate = report.output().get("product", 0.0)
+        rate_text = text_cache.render(f"Max Output: {rate:.2f}/s", TEXT_COLOR)
+        surface.blit(rate_text, (WIDTH - 230, y_offset))
+        y_offset += 25
+
+        bottlenecks = report.bottlenecks()
+        if not bottlenecks:
+            limit = "supply"
+        elif isinstance(bottlenecks[0], Conveyor):
+            limit = "conveyor"
+        else:
+            station = bottlenecks[0]
+            limit = f"{station.station_type} ({station.x}, {station.y})"
+        limit_text = text_cache.render(f"Bottleneck: {limit}", TEXT_COLOR)
+        surface.blit(limit_text, (WIDTH - 230, y_offset))
+        y_offset += 25
+
+        # Profiler readings take the place of the help text
+        if self.profile_lines:
+            y_offset += 15
+            for line in self.profile_lines:
+                profile_text = text_cache.render(line, (255, 255, 0))
+                surface.blit(profile_text, (WIDTH - 230, y_offset))
+                y_offset += 20
+            return
+
         # Help text
         y_offset = HEIGHT - 100
-        help_text = font.render("Click on stations to select", True, TEXT_COLOR)
+        help_text = text_cache.render("Click on stations to select", TEXT_COLOR)
         surface.blit(help_text, (WIDTH - 230, y_offset))
-        help_text2 = font.render("Toggle power to control", True, TEXT_COLOR)
+        help_text2 = text_cache.render("Toggle power to control", TEXT_COLOR)
         surface.blit(help_text2, (WIDTH - 230, y_offset + 20))
-        help_text3 = font.render("production", True, TEXT_COLOR)
+        help_text3 = text_cache.render("production", TEXT_COLOR)
         surface.blit(help_text3, (WIDTH - 230, y_offset + 40))
 
     def handle_click(self, pos):
         """Handle mouse click on factory grid"""
+        if self.log is not None:
+            self.log.record_click(self.tick, pos)
         x, y = pos
 
         # Check if click is in UI panel
@@ -747,14 +1936,8 @@ class Factory:
         grid_x = x // GRID_SIZE
         grid_y = y // GRID_SIZE
 
-        # Check if clicked on a station
-        for station in self.stations:
-            if station.is_at_position(grid_x, grid_y):
-                self.selected_station = station
-                return
-
-        # If no station clicked, deselect
-        self.selected_station = None
+        # Select the station on that tile, or deselect if there is none
+        self.selected_station = self.grid.at(grid_x, grid_y)
 
     def _handle_ui_click(self, pos):
         """Handle clicks on UI elements"""
@@ -764,12 +1947,64 @@ class Factory:
             # Check if toggle button clicked
             toggle_rect = pygame.Rect(WIDTH - 230, 150, 100, 30)
             if toggle_rect.collidepoint(pos):
-                self.selected_station.toggle_active()
+                self.toggle_station(self.selected_station)
+
+
+def freeze_heap():
+    """Collect garbage, then move everything still alive out of the
+    collector's reach.
+
+    Updates leave no new objects for the collector to track (there is
+    one shared Material per type and the queues and lanes are reused), so
+    collections come from drawing, and a full one would walk every
+    station, queue and conveyor of the factory. Frozen, they are skipped.
+    Call again whenever the factory is replaced, so the old one can go.
+    """
+    gc.unfreeze()
+    gc.collect()
+    gc.freeze()
 
 
 def main():
     """Main game function"""
+    # Game window setup; importing this module (e.g. to benchmark the
+    # simulation) doesn't open a window
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("Factory Simulation Game")
+    clock = pygame.time.Clock()
+
     factory = Factory()
+    freeze_heap()
+
+    # F5 saves the factory and F9 loads it back; R rewinds ten seconds
+    save_path = "factory.snap"
+    rewind_ticks = 10 * 60
+
+    # F3 turns the profiler and its panel on and off, F4 writes what it
+    # has recorded to profile.json and profile.csv
+    profiler = None
+    frame = 0
+
+    # The factory updates 60 times a second of game time on its own thread,
+    # whatever the frame rate; keys 1, 2 and 3 pick 1x, 4x or max speed.
+    # While profiling, the time updates take is added up for the next frame
+    update_seconds = 0.0
+
+    def step():
+        nonlocal update_seconds
+        if profiler is None:
+            factory.update()
+        else:
+            start = time.perf_counter()
+            factory.update()
+            update_seconds += time.perf_counter() - start
+
+    lock = threading.Lock()
+    loop = FixedStepLoop(step)
+    last_ticks = 0
+    speed_keys = dict(zip((pygame.K_1, pygame.K_2, pygame.K_3), loop.SPEEDS))
+    simulation = SimulationThread(loop, lock)
+    simulation.start()
 
     running = True
     while running:
@@ -779,19 +2014,58 @@ def main():
                 running = False
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == 1:  # Left click
-                    factory.handle_click(event.pos)
-
-        # Update factory
-        factory.update()
-
-        # Draw everything
-        screen.fill(BACKGROUND_COLOR)
-        factory.draw(screen)
-
-        # Update display
-        pygame.display.flip()
+                    with lock:
+                        factory.handle_click(event.pos)
+            elif event.type == pygame.KEYDOWN and event.key in speed_keys:
+                with lock:
+                    loop.set_speed(speed_keys[event.key])
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F5:
+                with lock:
+                    factory.save(save_path)
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F9:
+                with lock:
+                    try:
+                        factory = Factory.load(save_path)
+                    except (OSError, ValueError):
+                        continue
+                    factory.profiler = profiler
+                    freeze_heap()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_r:
+                with lock:
+                    log = factory.log
+                    tick = max(factory.tick - rewind_ticks, log.keyframes[0][0])
+                    factory = log.reconstruct(tick)
+                    log.truncate(tick)
+                    factory.log = log
+                    factory.profiler = profiler
+                    freeze_heap()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                with lock:
+                    profiler = None if profiler else Profiler()
+                    factory.profiler = profiler
+                    factory.profile_lines = []
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+                if profiler is not None:
+                    with lock:
+                        profiler.dump_json("profile.json", factory)
+                        profiler.dump_csv("profile.csv", factory)
+
+        # Draw whatever changed and update only those parts of the display
+        with lock:
+            if profiler is not None and frame % 15 == 0:
+                factory.profile_lines = profiler.overlay_lines(factory)
+            start = time.perf_counter()
+            dirty = factory.draw(screen, loop.alpha)
+            if profiler is not None:
+                draw_seconds = time.perf_counter() - start
+                profiler.frame(loop.ticks - last_ticks, update_seconds, draw_seconds)
+            last_ticks = loop.ticks
+            update_seconds = 0.0
+        pygame.display.update(dirty)
         clock.tick(60)  # 60 FPS
+        frame += 1
 
+    simulation.stop()
     pygame.quit()
     sys.exit()
 
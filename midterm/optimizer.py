@@ -0,0 +1,479 @@
+"""Searches station layouts for the midterm game's factory.
+
+Starting from the layout Factory._initialize_factory() builds, simulated
+annealing moves, adds, removes, retypes and relinks stations, looking for
+the cheapest layout (fewest stations, then shortest conveyors) that makes
+a target number of products per second:
+
+    python optimizer.py --rate 2 --rounds 300 --save factory.snap
+
+The best layout is saved as a snapshot the game loads with F9.
+
+Layouts are scored by running short headless simulations in a process
+pool, one per production line: stations that no conveyor connects can't
+affect each other's output, so a layout makes the sum of what its lines
+make, and each line is simulated once whatever else the layout holds and
+wherever it sits on the grid. Scores are memoized by line, so a move only
+costs the simulation of the line it changed. Lines are scored on their
+own, without the rest of the layout for conveyors to route around; the
+layout the search ends on is simulated whole for the rate reported.
+"""
+
+import argparse
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from main import (
+    GRID_SIZE,
+    HEIGHT,
+    STATION_CLASSES,
+    WIDTH,
+    Conveyor,
+    Factory,
+)
+
+# What the search can place, and what extractors can dig up
+KINDS = ("Extractor", "Furnace", "Assembler", "Packager", "OutputStation")
+RAW_MATERIALS = ("iron", "copper")
+# The tiles left of the UI panel
+COLUMNS = (WIDTH - 250) // GRID_SIZE
+ROWS = HEIGHT // GRID_SIZE
+
+BELT_COST = 0.1  # a conveyor tile costs this many stations
+SHORTFALL_COST = 5  # per cent of the target rate not reached, in stations
+NEARBY = 3  # tiles from an existing station that new ones are placed within
+MOVES = ("line", "add", "duplicate", "remove", "move", "retype", "link", "unlink")
+# The smallest working production line, each station feeding the next
+# (the extractors both feed the assembler). Nothing is made until a whole
+# one is in place, so rather than hope single moves happen on it the
+# search can add one in a single step.
+LINE = (
+    ("Extractor", "iron"),
+    ("Extractor", "copper"),
+    ("Assembler", None),
+    ("Packager", None),
+)
+
+
+# A layout is a pair of tuples: the stations, each (kind, x, y, material)
+# with material the extractor's material type or None, and the links, each
+# (source index, target index) into the stations. Being plain tuples they
+# can be hashed for the memo and sent to worker processes as they are.
+
+
+def layout_of(factory):
+    """The layout of a Factory"""
+    index = {station: i for i, station in enumerate(factory.stations)}
+    stations = tuple(
+        (
+            type(s).__name__,
+            s.x,
+            s.y,
+            s.material_type if type(s).__name__ == "Extractor" else None,
+        )
+        for s in factory.stations
+    )
+    links = tuple(
+        (index[c.from_station], index[c.to_station]) for c in factory.conveyors
+    )
+    return stations, links
+
+
+def build(layout, seed=0):
+    """A new Factory laid out as `layout`"""
+    stations, links = layout
+    factory = Factory(initialize=False, seed=seed, log=None)
+    placed = []
+    for kind, x, y, material in stations:
+        cls = STATION_CLASSES[kind]
+        station = cls(x, y, material) if material is not None else cls(x, y)
+        factory.add_station(station)
+        placed.append(station)
+    for source, target in links:
+        factory.add_conveyor(Conveyor(placed[source], placed[target]))
+    return factory
+
+
+def lines(layout):
+    """Split a layout into its production lines, each moved to the top
+    left corner and put in a canonical order, so the same line always
+    comes out the same wherever it is and however it was built"""
+    stations, links = layout
+    parent = list(range(len(stations)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for source, target in links:
+        parent[find(source)] = find(target)
+
+    groups = {}
+    for i in range(len(stations)):
+        groups.setdefault(find(i), []).append(i)
+    result = []
+    for members in groups.values():
+        x0 = min(stations[i][1] for i in members)
+        y0 = min(stations[i][2] for i in members)
+        members.sort(key=lambda i: _moved(stations[i], x0, y0))
+        renumber = {i: k for k, i in enumerate(members)}
+        result.append(
+            (
+                tuple(_moved(stations[i], x0, y0) for i in members),
+                tuple(
+                    sorted(
+                        (renumber[source], renumber[target])
+                        for source, target in links
+                        if source in renumber
+                    )
+                ),
+            )
+        )
+    return result
+
+
+def _moved(station, dx, dy):
+    kind, x, y, material = station
+    return kind, x - dx, y - dy, material
+
+
+def simulate(layout, frames, warmup):
+    """Products per second a layout makes and the conveyor tiles it
+    takes. Runs in the worker processes."""
+    factory = build(layout)
+    tiles = sum(conveyor.tile_length() for conveyor in factory.conveyors)
+    return factory.measure_throughput(frames, warmup), tiles
+
+
+def _simulate(args):
+    return simulate(*args)
+
+
+class Optimizer:
+    """Simulated annealing over layouts.
+
+    Every round proposes a batch of changes to the current layout, one
+    for each worker or more, and scores the lines among them not seen
+    before in parallel. One of the batch is picked, the better ones the
+    likelier the cooler it is, and replaces the current layout if it
+    scores higher, or with the Metropolis probability if not. The
+    temperature falls geometrically from `hot` to `cold` over the run.
+    """
+
+    def __init__(
+        self,
+        target,
+        workers=None,
+        frames=3600,
+        warmup=1800,
+        batch=None,
+        seed=None,
+        hot=20.0,
+        cold=0.1,
+    ):
+        self.target = target
+        self.workers = workers or os.cpu_count() or 1
+        self.frames = frames
+        self.warmup = warmup
+        self.batch = batch or 2 * self.workers
+        self.rng = random.Random(seed)
+        self.hot = hot
+        self.cold = cold
+        self.scores = {}  # line -> (products per second, conveyor tiles)
+        self.simulations = 0
+
+    def evaluate(self, layouts, executor):
+        """(products per second, conveyor tiles) of each layout, simulating
+        only the lines not scored before"""
+        pending = {}  # in the order first seen
+        for layout in layouts:
+            for line in lines(layout):
+                if line not in self.scores:
+                    pending[line] = None
+        pending = list(pending)
+        if pending:
+            chunk = max(1, len(pending) // (4 * self.workers))
+            jobs = [(line, self.frames, self.warmup) for line in pending]
+            for line, score in zip(
+                pending, executor.map(_simulate, jobs, chunksize=chunk)
+            ):
+                self.scores[line] = score
+            self.simulations += len(pending)
+
+        return [
+            tuple(map(sum, zip(*(self.scores[line] for line in lines(layout)))))
+            for layout in layouts
+        ]
+
+    def fitness(self, layout, rate, tiles):
+        """Higher is better: reaching the target comes first, then the
+        fewest stations and conveyor tiles"""
+        reached = min(rate, self.target) / self.target
+        cost = len(layout[0]) + BELT_COST * tiles
+        return SHORTFALL_COST * 100 * reached - cost
+
+    def run(self, start, rounds, log=None):
+        """Search from `start` and return the best layout found with its
+        (products per second, conveyor tiles)"""
+        with ProcessPoolExecutor(self.workers) as executor:
+            current = start
+            totals = self.evaluate([current], executor)[0]
+            score = self.fitness(current, *totals)
+            best = (score, current, totals)
+            for n in range(rounds):
+                temperature = self.hot * (self.cold / self.hot) ** (
+                    n / max(1, rounds - 1)
+                )
+                proposals = [self.propose(current) for _ in range(self.batch)]
+                proposals = [p for p in proposals if p is not None]
+                if not proposals:
+                    continue
+                scored = [
+                    (self.fitness(p, *totals), p, totals)
+                    for p, totals in zip(proposals, self.evaluate(proposals, executor))
+                ]
+                # One of the batch, the better ones likelier as it cools,
+                # then the usual Metropolis test against the current layout
+                top = max(entry[0] for entry in scored)
+                candidate = self.rng.choices(
+                    scored,
+                    [math.exp((entry[0] - top) / temperature) for entry in scored],
+                )[0]
+                if candidate[0] >= score or self.rng.random() < math.exp(
+                    (candidate[0] - score) / temperature
+                ):
+                    score, current = candidate[0], candidate[1]
+                for entry in scored:
+                    if entry[0] > best[0]:
+                        best = entry
+                if log is not None:
+                    log(n, temperature, score, best)
+        return best[1], best[2]
+
+    def propose(self, layout):
+        """A random change to the layout, or None if the one picked can't
+        be made"""
+        rng = self.rng
+        stations, links = list(layout[0]), list(layout[1])
+        move = rng.choice(MOVES)
+        i = rng.randrange(len(stations))
+        kind, x, y, material = stations[i]
+
+        if move == "line":
+            # Feeding an output, or a new one next to the station picked
+            outputs = [j for j, s in enumerate(stations) if s[0] == "OutputStation"]
+            if outputs:
+                output = rng.choice(outputs)
+            else:
+                tile = self._free_tile(stations, x, y)
+                if tile is None:
+                    return None
+                output = len(stations)
+                stations.append(("OutputStation", *tile, None))
+            x, y = stations[output][1:3]
+            first = len(stations)
+            for line_kind, line_material in reversed(LINE):
+                tile = self._free_tile(stations, x, y)
+                if tile is None:
+                    return None
+                stations.append((line_kind, *tile, line_material))
+                x, y = tile
+            # Appended packager first, so the extractors are the last two
+            packager, assembler = first, first + 1
+            links.extend(
+                [
+                    (packager, output),
+                    (assembler, packager),
+                    (first + 2, assembler),
+                    (first + 3, assembler),
+                ]
+            )
+        elif move in ("add", "duplicate"):
+            tile = self._free_tile(stations, x, y)
+            if tile is None:
+                return None
+            j = len(stations)
+            if move == "add":
+                new_kind = rng.choice(KINDS)
+                stations.append((new_kind, *tile, self._material(new_kind)))
+                # Fed by the station it was placed next to, if it can be
+                if kind != "OutputStation" and new_kind != "Extractor":
+                    links.append((i, j))
+            else:
+                # A second station doing the same job, with the same links
+                stations.append((kind, *tile, material))
+                links.extend((j, t) for s, t in layout[1] if s == i)
+                links.extend((s, j) for s, t in layout[1] if t == i)
+        elif move == "remove":
+            if len(stations) == 1:
+                return None
+            del stations[i]
+            links = [(s - (s > i), t - (t > i)) for s, t in links if i not in (s, t)]
+        elif move == "move":
+            tile = self._free_tile(stations, x, y)
+            if tile is None:
+                return None
+            stations[i] = (kind, *tile, material)
+        elif move == "retype":
+            new_kind = rng.choice(KINDS)
+            new_material = self._material(new_kind)
+            if (new_kind, new_material) == (kind, material):
+                return None
+            stations[i] = (new_kind, x, y, new_material)
+            # Extractors take nothing in and outputs pass nothing on
+            links = [
+                (s, t)
+                for s, t in links
+                if not (new_kind == "Extractor" and t == i)
+                and not (new_kind == "OutputStation" and s == i)
+            ]
+        elif move == "link":
+            j = rng.randrange(len(stations))
+            if (
+                i == j
+                or kind == "OutputStation"
+                or stations[j][0] == "Extractor"
+                or (i, j) in links
+                or _reaches(links, j, i)
+            ):
+                return None
+            links.append((i, j))
+        else:
+            if not links:
+                return None
+            del links[rng.randrange(len(links))]
+        return tuple(stations), tuple(links)
+
+    def _material(self, kind):
+        return self.rng.choice(RAW_MATERIALS) if kind == "Extractor" else None
+
+    def _free_tile(self, stations, x, y):
+        taken = {(s[1], s[2]) for s in stations}
+        for _ in range(10):
+            tile = (
+                x + self.rng.randint(-NEARBY, NEARBY),
+                y + self.rng.randint(-NEARBY, NEARBY),
+            )
+            if 0 <= tile[0] < COLUMNS and 0 <= tile[1] < ROWS and tile not in taken:
+                return tile
+        return None
+
+
+def _reaches(links, start, goal):
+    # Whether following links from start gets to goal, which a link from
+    # goal to start would turn into a loop
+    seen = {start}
+    stack = [start]
+    while stack:
+        node = stack.pop()
+        if node == goal:
+            return True
+        for s, t in links:
+            if s == node and t not in seen:
+                seen.add(t)
+                stack.append(t)
+    return False
+
+
+def describe(layout):
+    """One line per station: its index, kind, tile and what it feeds"""
+    stations, links = layout
+    rows = []
+    for i, (kind, x, y, material) in enumerate(stations):
+        feeds = ", ".join(str(t) for s, t in links if s == i)
+        label = f"{kind} ({material})" if material else kind
+        rows.append(f"  {i}: {label} at ({x}, {y})" + (f" -> {feeds}" if feeds else ""))
+    return "\n".join(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Search station layouts of the midterm game for the "
+        "cheapest one making a target number of products per second"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=1.0,
+        help="products per second to reach (default: 1)",
+    )
+    parser.add_argument(
+        "--rounds", type=int, default=200, help="annealing rounds (default: 200)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="worker processes for the simulations (default: one per core)",
+    )
+    parser.add_argument(
+        "--batch",
+        type=int,
+        help="layouts proposed per round (default: twice the workers)",
+    )
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=3600,
+        help="frames each production line is measured over, after half "
+        "as many to warm up (default: 3600)",
+    )
+    parser.add_argument("--seed", type=int, help="seed for the search")
+    parser.add_argument(
+        "--load",
+        metavar="PATH",
+        help="start from the layout of a saved snapshot instead of the default one",
+    )
+    parser.add_argument(
+        "--save",
+        metavar="PATH",
+        help="save the best layout as a snapshot (factory.snap is the one "
+        "F9 loads in the game)",
+    )
+    args = parser.parse_args()
+    if args.rate <= 0:
+        parser.error("--rate must be positive")
+
+    optimizer = Optimizer(
+        args.rate,
+        workers=args.workers,
+        frames=args.frames,
+        warmup=args.frames // 2,
+        batch=args.batch,
+        seed=args.seed,
+    )
+
+    def log(n, temperature, score, best):
+        if n % 10 == 0 or n == args.rounds - 1:
+            print(
+                f"round {n}: temperature {temperature:.2f}, score {score:.1f}, "
+                f"best {best[0]:.1f} ({best[2][0]:.3f}/s with "
+                f"{len(best[1][0])} stations)"
+            )
+
+    factory = Factory.load(args.load, log=None) if args.load else Factory(log=None)
+    start = time.perf_counter()
+    layout, (rate, tiles) = optimizer.run(layout_of(factory), args.rounds, log)
+    elapsed = time.perf_counter() - start
+    print(
+        f"Simulated {optimizer.simulations} production lines in {elapsed:.1f}s "
+        f"on {optimizer.workers} workers"
+    )
+
+    factory = build(layout)
+    measured = factory.measure_throughput(args.frames, args.frames // 2)
+    print(
+        f"Best layout: {len(layout[0])} stations, {tiles} conveyor tiles, "
+        f"{measured:.3f} products/s (lines scored {rate:.3f}/s)"
+    )
+    print(describe(layout))
+    if args.save:
+        factory.save(args.save)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import math
+
+import pytest
+
+from main import Factory, ReplayLog
+
+
+@pytest.mark.parametrize("p", [0.01, 0.5, 0.6, 0.99])
+def test_operating_charges_mean(p):
+    factory = Factory(initialize=False, seed=1)
+    factory.cost_chance = p
+    stations, draws = 2500, 400
+    mean = sum(factory._operating_charges(stations) for _ in range(draws)) / draws
+    sd = math.sqrt(stations * p * (1 - p) / draws)
+    assert abs(mean - stations * p) < 5 * sd
+
+
+@pytest.mark.parametrize("p, expected", [(0.0, 0), (1.0, 2500)])
+def test_operating_charges_certain(p, expected):
+    factory = Factory(initialize=False, seed=1)
+    factory.cost_chance = p
+    assert factory._operating_charges(2500) == expected
+
+
+def run_with_clicks(ticks, log):
+    """A seeded default factory run for `ticks` updates, switching its
+    furnace off and on again now and then. Returns its digest every tick."""
+    from main import GRID_SIZE, WIDTH
+
+    factory = Factory(seed=7, log=None)
+    factory.log = log
+    log.add_keyframe(factory.tick, factory.to_bytes())
+    furnace = (6 * GRID_SIZE + 10, 2 * GRID_SIZE + 10)
+    toggle = (WIDTH - 200, 160)
+    digests = [factory.digest()]
+    for _ in range(ticks):
+        factory.update()
+        if factory.tick % 97 == 0:
+            factory.handle_click(furnace)
+            factory.handle_click(toggle)
+        digests.append(factory.digest())
+    return digests
+
+
+def test_replay_reconstructs_every_tick():
+    log = ReplayLog(keyframe_interval=50, recent=2)
+    digests = run_with_clicks(1200, log)
+    assert len(log.keyframes) < 1200 // 50
+    for tick in range(0, 1201, 37):
+        assert log.reconstruct(tick).digest() == digests[tick]
+
+
+def test_replay_log_round_trip():
+    log = ReplayLog(keyframe_interval=50, recent=2)
+    digests = run_with_clicks(300, log)
+    loaded = ReplayLog.from_bytes(log.to_bytes())
+    assert loaded.events == log.events
+    assert loaded.keyframes == log.keyframes
+    assert loaded.reconstruct(300).digest() == digests[300]